@@ -2,24 +2,42 @@
 Module d'analyse des captures d'écran
 """
 import os
+import time
 import base64
+import asyncio
+import threading
+import contextvars
+from contextlib import nullcontext
 from PIL import Image
-from clients.langchain_client import get_chat_model
+from clients.langchain_client import get_chat_model, require_api_key
 from utils.config_loader import ConfigLoader
-from langchain_anthropic import ChatAnthropic
-from langchain.schema import SystemMessage, HumanMessage
+from utils.analysis_cache import get_analysis_cache
+from utils.artifact_store import get_artifact_store
+from utils.image_preprocessing import (
+    preprocess_from_config, preprocess_screenshot, get_preprocessing_settings, map_analysis_coordinates
+)
+from utils.ui_elements import (
+    UIElementStore, AnalysisParser, parse_analysis, load_ui_elements, save_ui_elements
+)
+from utils.calibration import calibrate_and_apply
+from utils import template_locator
+from utils.tracing import span, current_span
 
 # Initialisation de la configuration
 config = ConfigLoader()
 
+# Dernière capture analysée, référence du mode incrémental
+_last_analyzed_screenshot = None
+
 def read_latest_screenshot(directory=None):
     """
     Lit la capture d'écran la plus récente du dossier
     """
     try:
-        # Utiliser le répertoire configuré si non spécifié
+        # Utiliser le manifeste du stockage des captures si le dossier n'est pas spécifié
         if directory is None:
-            directory = config.get_screenshots_dir()
+            record = get_artifact_store().latest()
+            return record.path if record else None
             
         # Obtenir tous les fichiers du dossier
         files = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith('.png')]
@@ -33,9 +51,13 @@ def read_latest_screenshot(directory=None):
         print(f"Erreur lors de la lecture de la capture d'écran : {str(e)}")
         return None
 
-def save_analysis(analysis, directory=None):
+def save_analysis(analysis, directory=None, screenshot=None):
     """
-    Sauvegarde l'analyse dans le fichier interface_description.txt
+    Sauvegarde l'analyse dans le fichier interface_description.txt ainsi que
+    les éléments structurés extraits dans l'index ui_elements.json
+
+    Les positions des éléments sont corrigées par la calibration de
+    l'affichage de la capture analysée (`screenshot`, chemin ou image).
     """
     try:
         # Utiliser le répertoire configuré si non spécifié
@@ -45,30 +67,81 @@ def save_analysis(analysis, directory=None):
         filepath = config.get_ui_description_path()
         with open(filepath, "w", encoding="utf-8") as f:
             f.write(analysis)
+
+        elements = parse_analysis(analysis)
+        if screenshot is not None and elements:
+            with open_screenshot(screenshot) as img:
+                calibration = calibrate_and_apply(elements, img)
+                if calibration is not None:
+                    current_span().set(calibration=True)
+                if template_locator.is_enabled():
+                    _add_templates(img, elements)
+        elements_path = save_ui_elements(UIElementStore(elements))
             
-        print(f"Analyse sauvegardée dans : {filepath}")
+        print(f"Analyse sauvegardée dans : {filepath} ({len(elements)} éléments dans {elements_path})")
         return True
     except Exception as e:
         print(f"Erreur lors de la sauvegarde de l'analyse : {str(e)}")
         return False
 
-def analyze_screenshot():
+def _add_templates(image, elements):
+    """Ajoute les vignettes des éléments analysés à la bibliothèque des éléments connus"""
+    try:
+        added = template_locator.get_template_library().add_screen(image, elements)
+        if added:
+            print(f"{added} vignette(s) d'éléments ajoutée(s) à la bibliothèque")
+    except Exception as e:
+        print(f"Erreur lors de l'ajout des vignettes : {str(e)}")
+
+def locate_known_elements(screenshot):
     """
-    Analyse la dernière capture d'écran et sauvegarde la description
+    Retrouve localement les éléments d'un écran déjà analysé, par
+    corrélation avec la bibliothèque de vignettes, sans appel au modèle
+
+    Args:
+        screenshot (str | Image.Image): Chemin de la capture ou image en mémoire
+
+    Returns:
+        bool: True si l'écran a été retrouvé avec confiance et l'index des
+            éléments mis à jour, False si l'analyse par le modèle est nécessaire
     """
-    # Récupérer la dernière capture d'écran
-    screenshot_path = read_latest_screenshot()
-    if not screenshot_path:
-        print("Aucune capture d'écran trouvée")
+    if not template_locator.is_enabled():
         return False
-        
     try:
-        # Charger l'image pour obtenir ses dimensions
-        with Image.open(screenshot_path) as img:
-            width, height = img.size
-            
-        # Créer le prompt pour l'analyse
-        prompt = f"""Analyse cette capture d'écran et DÉCRIS UNIQUEMENT LES ÉLÉMENTS INTERACTIFS DE L'INTERFACE UTILISATEUR DE L'APPLICATION TESTÉE.
+        with open_screenshot(screenshot) as img:
+            elements = template_locator.find_known_elements(img)
+        if elements is None:
+            return False
+        use_known_elements(elements, screenshot, source="templates")
+        return True
+    except Exception as e:
+        print(f"Erreur lors de la recherche des éléments connus : {str(e)}")
+        return False
+
+def use_known_elements(elements, screenshot, source):
+    """
+    Enregistre comme dernière analyse les éléments d'un écran retrouvé
+    localement (vignettes, graphe des états), sans appel au modèle
+
+    Args:
+        elements (UIElementStore): Les éléments de l'écran
+        screenshot (str | Image.Image): La capture correspondante
+        source (str): Origine des éléments, tracée dans le span courant
+    """
+    global _last_analyzed_screenshot
+
+    save_ui_elements(elements)
+    with open(config.get_ui_description_path(), "w", encoding="utf-8") as f:
+        f.write(elements.to_prompt_text())
+    _last_analyzed_screenshot = screenshot
+    current_span().set(source=source)
+    print(f"Écran connu retrouvé localement ({source}) : {len(elements)} éléments, sans appel au modèle")
+
+def build_analysis_prompt(width, height):
+    """
+    Construit le prompt d'analyse pour une capture de la taille donnée
+    """
+    return f"""Analyse cette capture d'écran et DÉCRIS UNIQUEMENT LES ÉLÉMENTS INTERACTIFS DE L'INTERFACE UTILISATEUR DE L'APPLICATION TESTÉE.
 
 CONCENTRE-TOI EXCLUSIVEMENT sur les éléments suivants:
 - Boutons (boutons de navigation, boutons d'action, etc.)
@@ -109,47 +182,464 @@ Taille: largeur x hauteur pixels
 Description: [description détaillée]
 État: [si applicable]"""
 
-        # Vérifier que l'image existe
-        if not os.path.exists(screenshot_path):
-            raise FileNotFoundError(f"L'image {screenshot_path} n'existe pas")
-        
-        # Lire l'image et la convertir en base64
-        with open(screenshot_path, "rb") as f:
-            image_bytes = f.read()
-            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-        
-        # Vérifier que la clé API est présente
-        if "ANTHROPIC_API_KEY" not in os.environ:
-            raise ValueError("La clé API Anthropic n'est pas définie. Utilisez: export ANTHROPIC_API_KEY=votre-clé")
-        
-        
-        # Créer les messages pour le chat
-        messages = [
-            SystemMessage(content="Vous êtes un assistant spécialisé dans l'analyse d'interfaces utilisateur pour l'automatisation de tests. Vous identifiez UNIQUEMENT les éléments interactifs avec lesquels un utilisateur peut interagir."),
-            HumanMessage(content=[
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/png;base64,{image_base64}"
-                    }
-                },
-                {
-                    "type": "text",
-                    "text": prompt
+def build_analysis_messages(image_base64, width, height, media_type="image/png"):
+    """
+    Construit les messages d'analyse pour une image encodée en base64
+    """
+    from langchain.schema import SystemMessage, HumanMessage
+
+    # Vérifier que la clé API est présente
+    require_api_key()
+
+    # Créer les messages pour le chat
+    return [
+        SystemMessage(content="Vous êtes un assistant spécialisé dans l'analyse d'interfaces utilisateur pour l'automatisation de tests. Vous identifiez UNIQUEMENT les éléments interactifs avec lesquels un utilisateur peut interagir."),
+        HumanMessage(content=[
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{media_type};base64,{image_base64}"
                 }
-            ])
-        ]
-        
-        # Obtenir la réponse du modèle
-        response = get_chat_model().invoke(messages)
+            },
+            {
+                "type": "text",
+                "text": build_analysis_prompt(width, height)
+            }
+        ])
+    ]
+
+def _response_text(response):
+    # Extraire le contenu de la réponse
+    if hasattr(response, 'content'):
+        return str(response.content)
+    return None
+
+def request_analysis(image_base64, width, height, media_type="image/png"):
+    """
+    Envoie une capture encodée en base64 au modèle et retourne son analyse
+
+    Args:
+        image_base64 (str): L'image encodée en base64
+        width (int): Largeur de l'image en pixels
+        height (int): Hauteur de l'image en pixels
+        media_type (str): Type MIME de l'image
+
+    Returns:
+        str: L'analyse produite par le modèle, ou None
+    """
+    messages = build_analysis_messages(image_base64, width, height, media_type)
+    return _response_text(get_chat_model(task="vision").invoke(messages))
+
+async def arequest_analysis(image_base64, width, height, media_type="image/png"):
+    """
+    Version asynchrone de request_analysis, via ainvoke
+    """
+    messages = build_analysis_messages(image_base64, width, height, media_type)
+    return _response_text(await get_chat_model(task="vision").ainvoke(messages))
+
+def open_screenshot(screenshot):
+    """
+    Ouvre une capture donnée par son chemin ou déjà chargée en mémoire
+
+    Returns:
+        Un gestionnaire de contexte fournissant l'image PIL
+    """
+    if isinstance(screenshot, Image.Image):
+        return nullcontext(screenshot)
+    return Image.open(screenshot)
+
+def _prepare_image(screenshot):
+    """
+    Prétraite une capture (recadrage, réduction, réencodage) et l'encode en base64
+    """
+    bytes_before = None if isinstance(screenshot, Image.Image) else os.path.getsize(screenshot)
+    with open_screenshot(screenshot) as img:
+        processed = preprocess_from_config(img, bytes_before=bytes_before)
+    stats = processed.stats()
+    current_span().set(payload_bytes=stats["bytes_after"], image_size=f"{processed.width}x{processed.height}")
+    before = f"{stats['bytes_before']} octets" if stats["bytes_before"] else "capture en mémoire"
+    print(f"Image prétraitée : {before} -> {stats['bytes_after']} octets "
+          f"({processed.width}x{processed.height}, {processed.media_type})")
+    return processed, base64.b64encode(processed.data).decode('utf-8')
+
+def _cache_key(cache, screenshot):
+    with open_screenshot(screenshot) as img:
+        return cache.key_for(img)
+
+def compute_analysis(screenshot):
+    """
+    Retourne l'analyse d'une capture, depuis le cache ou via le modèle
+
+    Args:
+        screenshot (str | Image.Image): Chemin de la capture ou image en mémoire
+
+    Returns:
+        str: L'analyse en coordonnées écran, ou None
+    """
+    def compute():
+        processed, image_base64 = _prepare_image(screenshot)
+        analysis = request_analysis(image_base64, processed.width, processed.height, processed.media_type)
+        # Ramener les coordonnées dans l'espace de l'écran d'origine
+        return map_analysis_coordinates(analysis, processed.transform) if analysis else analysis
+
+    with span("analysis") as analysis_span:
+        cache = get_analysis_cache()
+        cache_key = _cache_key(cache, screenshot) if cache else None
+        if not cache_key:
+            return compute()
+        analysis, cached = cache.get_or_compute(cache_key, compute)
+        analysis_span.set(cache_hit=cached)
+        if cached:
+            print(f"Analyse trouvée dans le cache ({cache_key.rsplit(':', 1)[-1][:12]})")
+        print(f"Cache des analyses : {cache.stats()}")
+        return analysis
+
+async def acompute_analysis(screenshot):
+    """
+    Version asynchrone de compute_analysis : l'appel au modèle passe par
+    ainvoke et le cache conserve son single-flight
+    """
+    async def compute():
+        processed, image_base64 = await asyncio.to_thread(_prepare_image, screenshot)
+        analysis = await arequest_analysis(image_base64, processed.width, processed.height, processed.media_type)
+        return map_analysis_coordinates(analysis, processed.transform) if analysis else analysis
+
+    with span("analysis") as analysis_span:
+        cache = get_analysis_cache()
+        cache_key = await asyncio.to_thread(_cache_key, cache, screenshot) if cache else None
+        if not cache_key:
+            return await compute()
+
+        loop = asyncio.get_running_loop()
+        # Le cache est synchrone : l'appel au modèle est exécuté sur la boucle
+        # pendant que le thread du cache attend son résultat
+        analysis, cached = await asyncio.to_thread(
+            cache.get_or_compute, cache_key,
+            lambda: asyncio.run_coroutine_threadsafe(compute(), loop).result()
+        )
+        analysis_span.set(cache_hit=cached)
+        if cached:
+            print(f"Analyse trouvée dans le cache ({cache_key.rsplit(':', 1)[-1][:12]})")
+        return analysis
+
+def get_streaming_settings():
+    """Retourne la section `streaming` de la configuration"""
+    return config.get_section("streaming")
+
+class AnalysisStream:
+    """
+    Analyse d'une capture reçue en flux, dans un thread d'arrière-plan
+
+    Les éléments sont extraits au fil de la réponse du modèle (une ligne
+    complète à la fois), ramenés en coordonnées écran, calibrés puis
+    publiés aux abonnés ; l'exécution peut commencer dès que l'élément
+    attendu est reçu. Une fois la réponse complète, l'analyse est mise en
+    cache et sauvegardée comme par analyze_screenshot.
+    """
+
+    def __init__(self, screenshot):
+        self.screenshot = screenshot
+        self.elements = UIElementStore()
+        self.analysis = None
+        self.saved = False
+        self.error = None
+        self._subscribers = []
+        self._condition = threading.Condition()
+        self._done = False
+        self._started = None
+        self._span = None
+        self._thread = None
+
+    def start(self):
+        """Lance l'analyse en arrière-plan (les spans restent rattachés au contexte appelant)"""
+        self._started = time.perf_counter()
+        context = contextvars.copy_context()
+        self._thread = threading.Thread(target=context.run, args=(self._run,),
+                                        name="analysis-stream", daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def done(self):
+        return self._done
+
+    def subscribe(self, callback):
+        """
+        Abonne `callback(element)` aux éléments publiés ; les éléments déjà
+        reçus lui sont transmis immédiatement
+        """
+        with self._condition:
+            received = list(self.elements)
+            self._subscribers.append(callback)
+        for element in received:
+            callback(element)
+
+    def _publish(self, elements):
+        if not elements:
+            return
+        with self._condition:
+            first = not len(self.elements)
+            for element in elements:
+                self.elements.add(element)
+            subscribers = list(self._subscribers)
+            self._condition.notify_all()
+        if first and self._span is not None:
+            self._span.set(first_element=time.perf_counter() - self._started)
+        for callback in subscribers:
+            for element in elements:
+                try:
+                    callback(element)
+                except Exception as e:
+                    print(f"Erreur dans un abonné de l'analyse : {str(e)}")
+
+    def snapshot(self):
+        """Retourne une copie des éléments reçus jusqu'ici"""
+        with self._condition:
+            return UIElementStore(list(self.elements))
+
+    def wait_for(self, predicate, timeout=None):
+        """
+        Attend que les éléments reçus satisfassent `predicate(elements)`
+
+        Args:
+            predicate (Callable): Fonction recevant l'UIElementStore des
+                éléments reçus et retournant une valeur vraie une fois satisfaite
+            timeout (float): Délai maximal en secondes, sans limite si None
+
+        Returns:
+            La valeur retournée par le prédicat, ou None si l'analyse s'est
+            terminée (ou le délai écoulé) sans le satisfaire
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                found = predicate(self.elements)
+                if found:
+                    current_span().set(time_to_target=time.perf_counter() - self._started,
+                                       elements_received=len(self.elements))
+                    return found
+                if self._done:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def result(self, timeout=None):
+        """
+        Attend la fin de l'analyse et de sa sauvegarde
+
+        Returns:
+            bool: True si l'analyse complète a été sauvegardée
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self._done and self.saved
+
+    def _compute(self, image_size):
+        processed, image_base64 = _prepare_image(self.screenshot)
+        messages = build_analysis_messages(image_base64, processed.width, processed.height, processed.media_type)
+        parser = AnalysisParser()
+        lines, pending = [], ""
+
+        def feed(line):
+            # Coordonnées ramenées dans l'espace écran avant l'analyse de la ligne
+            line = map_analysis_coordinates(line, processed.transform)
+            lines.append(line)
+            self._publish(self._calibrated(parser.feed_line(line), image_size))
+
+        for chunk in get_chat_model(streaming=True, task="vision").stream(messages):
+            pending += _chunk_text(chunk)
+            *complete, pending = pending.split("\n")
+            for line in complete:
+                feed(line)
+        if pending:
+            feed(pending)
+        self._publish(self._calibrated(parser.close(), image_size))
+        return "\n".join(lines) or None
+
+    @staticmethod
+    def _calibrated(elements, image_size):
+        if elements:
+            calibrate_and_apply(elements, image_size=image_size)
+        return elements
+
+    def _run(self):
+        global _last_analyzed_screenshot
+
+        try:
+            with span("analysis", streaming=True) as analysis_span:
+                self._span = analysis_span
+                with open_screenshot(self.screenshot) as img:
+                    image_size = img.size
+                cache = get_analysis_cache()
+                cache_key = _cache_key(cache, self.screenshot) if cache else None
+                cached = False
+                if cache_key:
+                    analysis, cached = cache.get_or_compute(cache_key, lambda: self._compute(image_size))
+                    analysis_span.set(cache_hit=cached)
+                else:
+                    analysis = self._compute(image_size)
+                if cached:
+                    print(f"Analyse trouvée dans le cache ({cache_key.rsplit(':', 1)[-1][:12]})")
+                    self._publish(self._calibrated(parse_analysis(analysis), image_size))
+                self.analysis = analysis
+            if analysis and save_analysis(analysis, screenshot=self.screenshot):
+                _last_analyzed_screenshot = self.screenshot
+                self.saved = True
+        except Exception as e:
+            self.error = str(e)
+            print(f"Erreur lors de l'analyse en flux : {str(e)}")
+        finally:
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
+
+def _chunk_text(chunk):
+    """Texte d'un fragment de réponse (contenu texte ou blocs de contenu)"""
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content
+                   if isinstance(block, dict) and block.get("type", "text") == "text")
+
+def stream_analysis(screenshot):
+    """
+    Lance l'analyse en flux d'une capture
+
+    Args:
+        screenshot (str | Image.Image): Chemin de la capture ou image en mémoire
+
+    Returns:
+        AnalysisStream: L'analyse en cours, dont les éléments sont publiés au fil de la réponse
+    """
+    return AnalysisStream(screenshot).start()
+
+def _analyze_region(screenshot, box):
+    """
+    Analyse une zone de la capture et retourne ses éléments en coordonnées écran
+    """
+    region = screenshot.crop(box)
+    settings = get_preprocessing_settings()
+
+    def compute():
+        processed = preprocess_screenshot(
+            region,
+            max_long_edge=settings.get("max_long_edge"),
+            image_format=settings.get("format", "PNG"),
+            quality=settings.get("quality", 85),
+        )
+        image_base64 = base64.b64encode(processed.data).decode('utf-8')
+        analysis = request_analysis(image_base64, processed.width, processed.height, processed.media_type)
+        # Coordonnées relatives à la zone : l'entrée de cache reste valable à une autre position
+        return map_analysis_coordinates(analysis, processed.transform) if analysis else analysis
+
+    cache = get_analysis_cache()
+    cache_key = cache.key_for(region, kind="region") if cache else None
+    if cache_key:
+        analysis, _ = cache.get_or_compute(cache_key, compute)
+    else:
+        analysis = compute()
+
+    left, top = box[0], box[1]
+    elements = parse_analysis(analysis or "")
+    for element in elements:
+        element.x += left
+        element.y += top
+    return elements
+
+def analyze_incremental(screenshot, previous):
+    """
+    Réanalyse uniquement les zones modifiées depuis la capture précédente
+
+    Les pixels modifiés sont regroupés en zones, seules ces zones sont
+    envoyées au modèle et leurs éléments remplacent ceux de l'index situés
+    dans les mêmes zones.
+
+    Args:
+        screenshot (str | Image.Image): Capture courante
+        previous (str | Image.Image): Capture de la dernière analyse
+
+    Returns:
+        bool: True si l'analyse incrémentale a abouti, False si une analyse
+            complète est nécessaire
+    """
+    from utils.screen_diff import diff_mask, changed_regions, changed_ratio
+
+    settings = config.get_section("incremental")
+    elements = load_ui_elements()
+    if not len(elements) or previous is None:
+        return False
+    if not isinstance(previous, Image.Image) and not os.path.exists(previous):
+        return False
+
+    with open_screenshot(previous) as previous, open_screenshot(screenshot) as current:
+        if previous.size != current.size:
+            return False
+        mask = diff_mask(previous, current, settings.get("threshold", 24))
+        boxes = changed_regions(
+            mask,
+            block_size=settings.get("block_size", 16),
+            merge_gap=settings.get("merge_gap", 1),
+            padding=settings.get("padding", 16),
+        )
+        ratio = changed_ratio(boxes, current.size)
+        if ratio > settings.get("max_changed_ratio", 0.4):
+            print(f"Analyse incrémentale : {ratio:.0%} de l'écran modifié, analyse complète")
+            return False
+
+        print(f"Analyse incrémentale : {len(boxes)} zone(s) modifiée(s), {ratio:.1%} de l'écran")
+        current.load()
+        new_elements = [element for box in boxes for element in _analyze_region(current, box)]
+        # Les éléments conservés sont déjà calibrés
+        calibrate_and_apply(new_elements, image_size=current.size)
+
+    removed = elements.remove_in_regions(boxes)
+    for element in new_elements:
+        elements.add(element)
+    save_ui_elements(elements)
+    with open(config.get_ui_description_path(), "w", encoding="utf-8") as f:
+        f.write(elements.to_prompt_text())
+    print(f"Analyse incrémentale : {removed} élément(s) retiré(s), {len(new_elements)} ajouté(s)")
+    return True
+
+def analyze_screenshot(screenshot_path=None, incremental=None, image=None):
+    """
+    Analyse la dernière capture d'écran (ou celle indiquée) et sauvegarde la description
+
+    Args:
+        screenshot_path (str, optional): Capture à analyser, la plus récente si non spécifiée
+        incremental (bool, optional): Réanalyser uniquement les zones modifiées depuis
+            la capture précédente (valeur de la configuration si non spécifié)
+        image (Image.Image, optional): Capture déjà en mémoire, analysée sans relecture disque
+    """
+    global _last_analyzed_screenshot
+
+    # Utiliser la capture en mémoire, sinon récupérer la dernière capture d'écran
+    screenshot = image
+    if screenshot is None:
+        screenshot = screenshot_path or read_latest_screenshot()
+    if screenshot is None:
+        print("Aucune capture d'écran trouvée")
+        return False
         
-        # Extraire le contenu de la réponse
-        analysis = None
-        if hasattr(response, 'content'):
-            analysis = str(response.content)
+    try:
+        # Vérifier que l'image existe
+        if not isinstance(screenshot, Image.Image) and not os.path.exists(screenshot):
+            raise FileNotFoundError(f"L'image {screenshot} n'existe pas")
+
+        if incremental is None:
+            incremental = config.get_section("incremental").get("enabled", False)
+        if incremental and analyze_incremental(screenshot, _last_analyzed_screenshot):
+            _last_analyzed_screenshot = screenshot
+            print("Analyse terminée avec succès")
+            return True
+
+        analysis = compute_analysis(screenshot)
         
         # Sauvegarder l'analyse
-        if analysis and save_analysis(analysis):
+        if analysis and save_analysis(analysis, screenshot=screenshot):
+            _last_analyzed_screenshot = screenshot
             print("Analyse terminée avec succès")
             return True
         else:
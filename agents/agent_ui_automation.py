@@ -1,20 +1,28 @@
 """
 Module d'automatisation UI
+
+L'agent, ses outils, pyautogui et la calibration sont initialisés au
+premier usage : importer ce module ne nécessite ni clé API ni affichage.
 """
-from langchain.agents import AgentExecutor, create_react_agent
-from langchain.prompts import PromptTemplate
-from langchain.tools import Tool
-import pyautogui
+import sys
 import time
 import re
 import json
 from utils.config_loader import ConfigLoader
-from clients.langchain_client import get_chat_model
+from utils.ui_elements import load_ui_elements
+from utils.backends import get_pyautogui
+from utils.tracing import span
+from utils import stability
+from utils import action_verification as verification
+from utils.text_input import enter_text
+from utils.calibration import AffineCalibration, set_default_calibration
+from clients.langchain_client import get_chat_model, usage_recorder
 
 # Initialisation
 config = ConfigLoader()
 
-# Chargement des paramètres de calibration
+# Paramètres de calibration manuels, appliqués aux positions des éléments
+# à l'analyse pour les affichages sans calibration ajustée (utils.calibration)
 OFFSET_X = 0
 OFFSET_Y = 0
 SCALE_X = 1.0
@@ -33,14 +41,44 @@ def click_action(coordinates):
             x = int(numbers[0])
             y = int(numbers[1])
         else:
-            raise ValueError(f"Format de coordonnées non reconnu: {coordinates}")
+            # Sinon, rechercher l'élément par son libellé dans l'index de l'analyse
+            element = load_ui_elements().find_by_label(coordinates.strip().strip("'\""))
+            if element is None:
+                raise ValueError(f"Format de coordonnées non reconnu: {coordinates}")
+            x, y = element.center
             
-        # Ajouter un petit délai pour la sécurité
-        time.sleep(0.5)
-        
-        # Déplacer la souris et cliquer
-        pyautogui.moveTo(x, y, duration=0.2)
-        pyautogui.click()
+        with span("action.click", x=x, y=y) as click_span:
+            pyautogui = get_pyautogui()
+            def move():
+                pyautogui.moveTo(x, y, duration=stability.get_stability_settings().get("mouse_move_duration", 0.0))
+            def click():
+                move()
+                pyautogui.click()
+            if verification.is_enabled():
+                # Pointeur en place avant la capture de référence (le survol n'est pas un effet), clic,
+                # vérification de l'effet autour du point puis attente de la stabilité ; un nouvel essai
+                # n'a lieu qu'après page_change_timeout sans aucun changement de l'écran, et jamais
+                # dans l'élément qui a déjà le focus
+                _, check = verification.perform(
+                    "click", pyautogui.click, target=(x, y), prepare=move,
+                    retry_wait=stability.get_stability_settings().get("page_change_timeout", 3),
+                    retries=0 if verification.already_focused(x, y) else None)
+                click_span.set(effect=check.observed, attempts=check.attempts)
+                if not check.observed:
+                    # Un clic valide peut ne changer aucun pixel (champ déjà actif, bouton sans survol) :
+                    # avertissement, pas une erreur qui interromprait un plan
+                    return (f"Clic effectué aux coordonnées ({x}, {y}) (avertissement : aucun effet "
+                            f"visible après {check.attempts} essai(s))")
+            elif stability.is_enabled():
+                # Cliquer puis attendre que l'interface se stabilise
+                stability.settle("click", click)
+            else:
+                # Ajouter un petit délai pour la sécurité
+                time.sleep(0.5)
+
+                # Déplacer la souris et cliquer
+                pyautogui.moveTo(x, y, duration=0.2)
+                pyautogui.click()
         
         return f"Clic effectué aux coordonnées ({x}, {y})"
     except Exception as e:
@@ -49,36 +87,216 @@ def click_action(coordinates):
 # Fonction pour simuler la saisie de texte
 def type_text(text):
     try:
-        # Ajouter un petit délai pour la sécurité
-        time.sleep(0.5)
-        # Saisir le texte
-        pyautogui.typewrite(text, interval=0.1)
+        with span("action.type", characters=len(text)) as type_span:
+            if verification.is_enabled():
+                # Saisir le texte et vérifier l'effet dans le champ cliqué ; un nouvel essai
+                # redonne d'abord le focus au champ et sélectionne son contenu, remplacé par la saisie
+                target = verification.last_target()
+                def retype():
+                    pyautogui = get_pyautogui()
+                    if target is not None:
+                        pyautogui.click(*target)
+                    pyautogui.hotkey("command" if sys.platform == "darwin" else "ctrl", "a")
+                    return enter_text(text)
+                result, check = verification.perform(
+                    "type", lambda: enter_text(text), target=target, retry_action=retype, row=True,
+                    check=lambda entered: False if entered.error or entered.verified is False else (entered.verified or None))
+                type_span.set(effect=check.observed, attempts=check.attempts)
+                if not result.error and result.verified is not False and not check.observed:
+                    return f"Erreur lors de la saisie du texte : aucun effet observé après {check.attempts} essai(s)"
+            elif stability.is_enabled():
+                # Saisir le texte puis attendre que l'interface se stabilise (suggestions…)
+                result, _ = stability.settle("type", lambda: enter_text(text))
+            else:
+                # Ajouter un petit délai pour la sécurité
+                time.sleep(0.5)
+                # Saisir le texte
+                result = enter_text(text)
+            type_span.set(backend=result.backend, verified=result.verified)
+        if result.error:
+            return f"Erreur lors de la saisie du texte : {result.error}"
+        if result.verified is False:
+            return f"Erreur lors de la saisie du texte : le champ ne contient pas le texte saisi ({result.backend})"
         return f"Texte saisi : {text}"
     except Exception as e:
         return f"Erreur lors de la saisie du texte : {str(e)}"
 
-# Création des outils
-tools = [
-    Tool(
-        name="ClickAt",
-        func=click_action,
-        description="Clique à une position spécifique. Input format: 'x,y'"
-    ),
-    Tool(
-        name="TypeText",
-        func=type_text,
-        description="Saisit du texte dans un champ. Input: le texte à saisir"
-    )
-]
-
-# Définition du template pour le prompt
-template = """Tu es un assistant qui aide à interagir avec une interface utilisateur.
+# Fonction pour simuler l'appui sur une touche ou une combinaison ("enter", "ctrl+a")
+def press_key(key):
+    try:
+        keys = [k.strip().lower() for k in key.strip().strip("'\"").split("+") if k.strip()]
+        if not keys:
+            raise ValueError("Aucune touche indiquée")
+        keys = [KEY_ALIASES.get(k, k) for k in keys]
+        with span("action.press", key="+".join(keys)):
+            pyautogui = get_pyautogui()
+            press = (lambda: pyautogui.hotkey(*keys)) if len(keys) > 1 else (lambda: pyautogui.press(keys[0]))
+            if stability.is_enabled():
+                stability.settle("press", press)
+            else:
+                time.sleep(0.5)
+                press()
+        return f"Touche appuyée : {'+'.join(keys)}"
+    except Exception as e:
+        return f"Erreur lors de l'appui sur la touche : {str(e)}"
+
+# Fonction pour attendre que l'écran soit stable (délai maximal optionnel, en secondes)
+def wait_stable(timeout=""):
+    try:
+        timeout = float(timeout) if str(timeout).strip() else None
+        if not stability.is_enabled():
+            time.sleep(timeout if timeout is not None else 0.5)
+            return "Attente terminée"
+        # Observation déterministe (elle entre dans le prompt et l'empreinte des cassettes) :
+        # la durée de l'attente reste dans le span wait.plan
+        result = stability.wait_for_stable("plan", timeout=timeout)
+        return "Écran stable" if result.stable else "Écran instable"
+    except Exception as e:
+        return f"Erreur lors de l'attente : {str(e)}"
+
+# Noms de touches usuels (français) vers les noms pyautogui
+KEY_ALIASES = {"entrée": "enter", "entree": "enter", "return": "enter", "échap": "esc", "echap": "esc",
+               "escape": "esc", "tabulation": "tab", "espace": "space", "retour": "backspace",
+               "suppr": "delete", "control": "ctrl"}
+
+# Actions d'un plan : nom (français ou anglais) -> (fonction, libellé)
+PLAN_ACTIONS = {
+    "click": (click_action, "clic"), "clickat": (click_action, "clic"), "clic": (click_action, "clic"),
+    "cliquer": (click_action, "clic"),
+    "type": (type_text, "saisie"), "typetext": (type_text, "saisie"), "saisir": (type_text, "saisie"),
+    "press": (press_key, "touche"), "presskey": (press_key, "touche"), "key": (press_key, "touche"),
+    "touche": (press_key, "touche"), "appuyer": (press_key, "touche"),
+    "wait": (wait_stable, "attente"), "waitstable": (wait_stable, "attente"), "wait-stable": (wait_stable, "attente"),
+    "attendre": (wait_stable, "attente"),
+}
+
+# Séparateur des étapes d'un plan écrit : fin de ligne, ou « ; » suivi d'une
+# action connue (un « ; » dans un texte à saisir n'en est pas un), comme
+# utils.state_graph.PLAN_TEXT_ARGUMENT
+PLAN_STEP_SEPARATOR = re.compile(
+    r"\n|;(?=\s*(?:" + "|".join(map(re.escape, PLAN_ACTIONS)) + r")\b)", re.IGNORECASE)
+
+def parse_plan(plan):
+    """
+    Lit un plan d'actions : liste JSON ([{"action": "click", "input": "640,360"}, ...])
+    ou une action par ligne (ou séparées par « ; » devant une action connue),
+    sous la forme « action: argument »
+
+    Returns:
+        list: Étapes (action, argument)
+    """
+    plan = plan.strip().strip("`")
+    steps = []
+    if plan.startswith("["):
+        for item in json.loads(plan):
+            if isinstance(item, dict):
+                action = item.get("action") or item.get("tool") or ""
+                argument = next((item[key] for key in ("input", "target", "text", "key", "timeout", "argument")
+                                 if key in item), "")
+            else:
+                action, argument = item[0], item[1] if len(item) > 1 else ""
+            steps.append((str(action), str(argument)))
+        return steps
+    for line in PLAN_STEP_SEPARATOR.split(plan):
+        line = re.sub(r"^\s*(?:\d+[.)]|-)\s*", "", line).strip()
+        if not line:
+            continue
+        match = re.match(r"^([\w-]+)\s*(?::|\s)\s*(.*)$", line)
+        action, argument = (match.group(1), match.group(2)) if match else (line, "")
+        steps.append((action, argument.strip()))
+    return steps
+
+# Fonction pour exécuter un plan de plusieurs actions en une seule fois
+def execute_plan(plan):
+    try:
+        steps = parse_plan(plan)
+    except Exception as e:
+        return f"Erreur : plan illisible ({str(e)})"
+    if not steps:
+        return "Erreur : plan vide"
+
+    done = []
+    with span("plan", steps=len(steps)) as plan_span:
+        for index, (action, argument) in enumerate(steps, 1):
+            entry = PLAN_ACTIONS.get(action.strip().lower())
+            if entry is None:
+                observation = f"Erreur : action inconnue « {action} » (click, type, press, wait)"
+            else:
+                func, _ = entry
+                observation = func(argument)
+            if observation.startswith("Erreur"):
+                plan_span.set(failed_step=index)
+                summary = f" Réussies : {' ; '.join(done)}." if done else ""
+                return (f"Erreur à l'étape {index}/{len(steps)} ({action} {argument}) : {observation}."
+                        f"{summary} Étapes suivantes non exécutées.")
+            done.append(f"{index}. {observation}")
+    return f"Plan exécuté ({len(steps)} étapes) : {' ; '.join(done)}"
+
+# Outils, prompt et agent, construits au premier usage
+_tools = None
+_prompt = None
+_agent = None
+_agent_executor = None
+_calibration_loaded = False
+
+def _traced_tool(name, func):
+    """Enveloppe un outil de l'agent dans un span par appel"""
+    def run(argument):
+        with span(f"tool.{name}", input=argument) as tool_span:
+            observation = func(argument)
+            tool_span.set(ok=not observation.startswith("Erreur"))
+            return observation
+    return run
+
+def get_tools():
+    """Retourne les outils de l'agent"""
+    global _tools
+    if _tools is None:
+        from langchain.tools import Tool
+
+        # Création des outils
+        _tools = [
+            Tool(
+                name="ClickAt",
+                func=_traced_tool("ClickAt", click_action),
+                description="Clique à une position spécifique. Input format: 'x,y' ou le libellé exact d'un élément"
+            ),
+            Tool(
+                name="TypeText",
+                func=_traced_tool("TypeText", type_text),
+                description="Saisit du texte dans un champ. Input: le texte à saisir"
+            ),
+            Tool(
+                name="PressKey",
+                func=_traced_tool("PressKey", press_key),
+                description="Appuie sur une touche ou une combinaison. Input: 'enter', 'tab', 'ctrl+a'…"
+            ),
+            Tool(
+                name="ExecutePlan",
+                func=_traced_tool("ExecutePlan", execute_plan),
+                description=(
+                    "Exécute plusieurs actions à la suite en une seule fois et s'arrête à la première erreur. "
+                    "Input: une action par ligne ou séparées par ';' parmi 'click: x,y' (ou libellé), "
+                    "'type: texte', 'press: touche', 'wait' (attendre que l'écran soit stable). "
+                    "Exemple: click: 640,360; type: Anthropic Claude; press: enter; wait"
+                )
+            )
+        ]
+    return _tools
+
+# Définition du template pour le prompt : partie statique (consignes, outils,
+# format), identique à chaque itération de la boucle ReAct, puis la question
+system_template = """Tu es un assistant qui aide à interagir avec une interface utilisateur.
 Tu dois analyser le texte fourni qui décrit une interface et effectuer les actions nécessaires.
 
 Pour effectuer une recherche Google, tu dois :
 1. Cliquer sur la barre de recherche Google
 2. Saisir le texte de la recherche
 
+Chaque action coûte un aller-retour : lorsque tu connais déjà les étapes à enchaîner,
+exécute-les toutes en une seule action ExecutePlan (par exemple
+"click: x,y; type: texte; press: enter; wait") plutôt qu'une par une.
+
 Tu as accès aux outils suivants:
 {tools}
 
@@ -93,35 +311,136 @@ Observation: le résultat de l'action
 Thought: J'ai maintenant la réponse finale
 Final Answer: la réponse finale à la question
 
-Question: {input}
-{agent_scratchpad}"""
+"""
+question_template = """Question: {input}
+"""
+template = system_template + question_template + "{agent_scratchpad}"
+
+def get_agent_settings():
+    """Retourne la section `agent` de la configuration"""
+    return config.get_section("agent")
+
+def get_prompt():
+    """
+    Retourne le prompt de l'agent
+
+    Avec le cache de prompt (`agent.prompt_cache`), les consignes et les
+    outils forment un message système et la question le début du message
+    suivant, chacun marqué `cache_control`. Le client retire ces marqueurs
+    à l'envoi si le modèle appelé n'a pas de cache de prompt ou si le
+    préfixe est sous sa taille minimale (clients.langchain_client.cacheable_prefixes) :
+    le cache n'est donc effectif que pour un prompt assez long.
+    """
+    global _prompt
+    if _prompt is None:
+        if get_agent_settings().get("prompt_cache", True):
+            from langchain_core.prompts import (
+                ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
+            )
+
+            cached = {"type": "ephemeral"}
+            _prompt = ChatPromptTemplate.from_messages([
+                SystemMessagePromptTemplate.from_template(
+                    [{"type": "text", "text": system_template, "cache_control": cached}]),
+                # Le scratchpad vide de la première itération est omis par le client
+                HumanMessagePromptTemplate.from_template(
+                    [{"type": "text", "text": question_template, "cache_control": cached},
+                     {"type": "text", "text": "{agent_scratchpad}"}]),
+            ])
+        else:
+            from langchain.prompts import PromptTemplate
 
-# Création du prompt
-prompt = PromptTemplate(template=template, input_variables=["input", "tools", "tool_names", "agent_scratchpad"])
+            # Création du prompt
+            _prompt = PromptTemplate(template=template, input_variables=["input", "tools", "tool_names", "agent_scratchpad"])
+    return _prompt
 
-# Création de l'agent
-agent = create_react_agent(
-    llm=get_chat_model(),
-    tools=tools,
-    prompt=prompt
-)
+def get_agent_executor():
+    """Retourne l'exécuteur de l'agent ReAct, créé au premier appel"""
+    global _agent, _agent_executor
+    if _agent_executor is None:
+        from langchain.agents import AgentExecutor, create_react_agent
 
-# Création de l'exécuteur d'agent
-agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+        # Création de l'agent
+        _agent = create_react_agent(
+            # Routage : planification et simples étapes d'outil vers des niveaux de modèles distincts
+            llm=get_chat_model(task="agent"),
+            tools=get_tools(),
+            prompt=get_prompt()
+        )
+
+        # Création de l'exécuteur d'agent
+        # Les étapes intermédiaires sont retournées pour être rejouées (graphe des états)
+        _agent_executor = AgentExecutor(agent=_agent, tools=get_tools(), verbose=True,
+                                        return_intermediate_steps=True)
+    return _agent_executor
+
+def __getattr__(name):
+    # Compatibilité : `tools`, `prompt`, `agent` et `agent_executor` restent
+    # accessibles comme attributs du module, construits à la demande
+    if name == "tools":
+        return get_tools()
+    if name == "prompt":
+        return get_prompt()
+    if name == "agent_executor":
+        return get_agent_executor()
+    if name == "agent":
+        get_agent_executor()
+        return _agent
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def ensure_calibration_loaded():
+    """Charge les paramètres de calibration au premier usage"""
+    global _calibration_loaded
+    if _calibration_loaded:
+        return
+    _calibration_loaded = True
+    try:
+        load_calibration()
+    except Exception as e:
+        print(f"Erreur lors du chargement initial de la calibration: {str(e)}")
 
 # Fonction principale pour utiliser l'agent
-def process_ui_action(text: str, search_query: str, calibration=None):
+def compact_description(elements, task, top_k=None):
+    """
+    Décrit les éléments les plus pertinents pour une tâche, une ligne par élément
+
+    Args:
+        elements (UIElementStore): Éléments analysés
+        task (str): Tâche à accomplir
+        top_k (int): Nombre d'éléments conservés (celui de la configuration si non spécifié)
+
+    Returns:
+        str: Description compacte, avec le nombre d'éléments omis
+    """
+    if top_k is None:
+        top_k = get_agent_settings().get("context_top_k", 15)
+    selected = elements.rank(task, top_k) if top_k else list(elements)
+    text = elements.to_prompt_text(selected)
+    omitted = len(elements) - len(selected)
+    if omitted:
+        text += f"\n({omitted} autres éléments, moins pertinents pour la tâche, non listés)"
+    return text
+
+def process_ui_action(text: str, search_query: str, calibration=None, elements=None, task=None):
     """
     Traite une requête utilisateur et effectue les actions nécessaires sur l'interface
     
     Args:
         text (str): Description de l'interface
         search_query (str): Requête de l'utilisateur
-        calibration (dict, optional): Paramètres de calibration. Exemple: {'offset_x': 5, 'offset_y': -10}
+        calibration (dict, optional): Paramètres de calibration manuels, appliqués aux analyses
+            suivantes. Exemple: {'offset_x': 5, 'offset_y': -10}
+        elements (UIElementStore, optional): Éléments analysés ; s'ils sont fournis, seuls les
+            plus pertinents pour la requête remplacent `text` dans le prompt
+        task (str, optional): Consigne donnée à l'agent (par défaut, une recherche Google
+            de `search_query`)
     
     Returns:
-        dict: Résultat des actions effectuées
+        dict: Résultat des actions effectuées (`output`) et étapes de l'agent
+            (`steps` : outil, entrée et observation de chaque action)
     """
+    ensure_calibration_loaded()
+
     # Appliquer la calibration si fournie
     if calibration:
         set_calibration(
@@ -131,24 +450,38 @@ def process_ui_action(text: str, search_query: str, calibration=None):
             calibration.get('scale_y', SCALE_Y)
         )
     
+    task = task or f"Effectue une recherche Google avec le texte : {search_query}"
+    if elements is not None and len(elements):
+        text = compact_description(elements, task)
+
     # Ajouter des instructions supplémentaires pour améliorer la précision
     enhanced_prompt = f"""
 À partir de cette description d'interface : 
 {text}
 
-Effectue une recherche Google avec le texte : {search_query}
+{task}
 
 ATTENTION: La précision des coordonnées est cruciale. Assure-toi de cliquer exactement aux coordonnées spécifiées.
 Utilise les coordonnées exactes fournies dans la description de l'interface.
 """
     
     # Exécuter l'agent avec le prompt amélioré
-    return agent_executor.invoke({
-        "input": enhanced_prompt,
-        "tools": ", ".join([tool.name for tool in tools]),
-        "tool_names": ", ".join([f"'{tool.name}'" for tool in tools]),
-        "agent_scratchpad": ""
-    })
+    # La description des outils (dont le format des plans) est fournie par create_react_agent
+    recorder = usage_recorder()
+    with span("agent", context_chars=len(text)):
+        result = get_agent_executor().invoke({"input": enhanced_prompt}, config={"callbacks": [recorder]})
+    result["steps"] = [
+        {"tool": action.tool, "input": str(action.tool_input), "observation": str(observation)}
+        for action, observation in result.pop("intermediate_steps", [])
+    ]
+    # Usage réel de chaque itération : l'appel numéro i a choisi l'étape i (le dernier, la réponse finale)
+    result["usage"] = recorder.calls
+    for number, usage in enumerate(recorder.calls, 1):
+        if number <= len(result["steps"]):
+            result["steps"][number - 1]["usage"] = usage
+        print(f"Itération {number} de l'agent : {usage['input_tokens']} tokens d'entrée, "
+              f"dont {usage['cache_read_tokens']} lus et {usage['cache_creation_tokens']} écrits dans le cache de prompt")
+    return result
 
 def set_calibration(offset_x=0, offset_y=0, scale_x=1.0, scale_y=1.0):
     """
@@ -160,11 +493,14 @@ def set_calibration(offset_x=0, offset_y=0, scale_x=1.0, scale_y=1.0):
         scale_x (float): Facteur d'échelle horizontal
         scale_y (float): Facteur d'échelle vertical
     """
-    global OFFSET_X, OFFSET_Y, SCALE_X, SCALE_Y
+    global OFFSET_X, OFFSET_Y, SCALE_X, SCALE_Y, _calibration_loaded
+    # Une calibration explicite n'est pas écrasée par le chargement initial
+    _calibration_loaded = True
     OFFSET_X = offset_x
     OFFSET_Y = offset_y
     SCALE_X = scale_x
     SCALE_Y = scale_y
+    set_default_calibration(AffineCalibration.from_offsets(offset_x, offset_y, scale_x, scale_y))
     
     print(f"Nouveaux paramètres de calibration appliqués:")
     print(f"Décalage: ({offset_x}, {offset_y}) pixels")
@@ -213,9 +549,3 @@ def save_calibration(file_path='calibration.json'):
         print(f"Paramètres de calibration enregistrés dans {file_path}")
     except Exception as e:
         print(f"Erreur lors de l'enregistrement des paramètres de calibration: {str(e)}")
-
-# Essayer de charger les paramètres de calibration au démarrage
-try:
-    load_calibration()
-except Exception as e:
-    print(f"Erreur lors du chargement initial de la calibration: {str(e)}") 
\ No newline at end of file
@@ -0,0 +1,183 @@
+"""
+Module d'exécution directe des intentions courantes
+
+Les intentions simples (rechercher un texte, cliquer sur un élément
+nommé, remplir un champ) sont résolues directement contre les éléments
+de l'analyse et exécutées sans appel au modèle. L'agent ReAct n'est
+utilisé que lorsque la résolution échoue.
+"""
+import re
+from typing import Dict, List, Optional
+from agents.agent_ui_automation import click_action, type_text, press_key
+from utils.config_loader import ConfigLoader
+from utils.ui_elements import UIElement, UIElementStore, normalize_text
+from utils.tracing import span
+
+# Mots indiquant un champ de saisie dans le type ou le libellé d'un élément
+INPUT_WORDS = {"champ", "saisie", "input", "textbox", "zone", "field", "barre"}
+SEARCH_WORDS = {"recherche", "rechercher", "search", "chercher"}
+
+INTENT_PATTERNS = [
+    ("fill", re.compile(
+        r"^(?:fill(?: in)?(?: the)?(?: field)?|remplir|remplis|saisir dans|saisis dans)"
+        r"(?: le champ| la zone)?\s+(?P<label>.+?)\s+(?:with|avec)\s+(?P<text>.+)$", re.IGNORECASE)),
+    ("search", re.compile(
+        r"^(?:search(?: for)?|recherche(?:r)?|cherche(?:r)?|effectue une recherche(?: google)?(?: avec le texte)?)"
+        r"\s*:?\s+(?P<text>.+)$", re.IGNORECASE)),
+    ("click", re.compile(
+        r"^(?:click(?: on)?(?: the)?(?: button| link)?(?: labeled| labelled)?|clique(?:r)?(?: sur)?"
+        r"(?: le bouton| le lien| l'élément)?)\s+(?P<label>.+)$", re.IGNORECASE)),
+]
+
+
+class Intent:
+    """
+    Intention d'action résolue depuis une consigne
+    """
+    __slots__ = ("action", "label", "text")
+
+    def __init__(self, action: str, label: Optional[str] = None, text: Optional[str] = None):
+        self.action = action
+        self.label = label
+        self.text = text
+
+    def __repr__(self) -> str:
+        return f"Intent({self.action!r}, label={self.label!r}, text={self.text!r})"
+
+    @property
+    def key(self) -> str:
+        """
+        Action de l'intention dans le graphe des états : le libellé visé en
+        fait partie (cliquer sur deux éléments différents n'est pas la même
+        transition), seul le texte saisi est un paramètre
+        """
+        return f"{self.action}:{self.label}" if self.label else self.action
+
+    @property
+    def params(self) -> Dict[str, str]:
+        """Paramètres rejouables de l'intention (texte saisi), pour le graphe des états"""
+        return {"text": self.text} if self.text else {}
+
+    def task(self) -> str:
+        """Consigne transmise à l'agent lorsque l'intention n'a pas pu être exécutée directement"""
+        if self.action == "click":
+            return f"Clique sur l'élément : {self.label}"
+        if self.action == "fill":
+            return f"Remplis le champ {self.label} avec le texte : {self.text}"
+        return f"Effectue une recherche Google avec le texte : {self.text}"
+
+
+def _clean(value: str) -> str:
+    return value.strip().strip("'\"«»“”").strip()
+
+
+def parse_intent(instruction: str) -> Optional[Intent]:
+    """
+    Reconnaît une intention courante dans une consigne
+
+    Args:
+        instruction (str): Consigne en langage naturel (français ou anglais)
+
+    Returns:
+        Intent: L'intention reconnue, ou None
+    """
+    instruction = instruction.strip().rstrip(".")
+    for action, pattern in INTENT_PATTERNS:
+        match = pattern.match(instruction)
+        if match:
+            groups = match.groupdict()
+            return Intent(
+                action,
+                label=_clean(groups["label"]) if groups.get("label") else None,
+                text=_clean(groups["text"]) if groups.get("text") else None,
+            )
+    return None
+
+
+def intent_for(instruction: str) -> Intent:
+    """
+    Retourne l'intention d'une consigne du workflow : celle reconnue par
+    parse_intent, sinon une recherche du texte de la consigne
+    """
+    return parse_intent(instruction) or Intent("search", text=instruction.strip())
+
+
+def find_input_field(elements: UIElementStore, label: Optional[str] = None) -> Optional[UIElement]:
+    """
+    Retrouve le champ de saisie le plus probable, éventuellement par libellé
+    """
+    label_tokens = set(normalize_text(label).split()) if label else set()
+    best, best_score = None, 0
+    for element in elements:
+        type_tokens = set(normalize_text(element.element_type).split())
+        text_tokens = set(normalize_text(element.label).split())
+        score = 0
+        if type_tokens & INPUT_WORDS:
+            score += 2
+        if label_tokens:
+            score += 2 * len(label_tokens & (text_tokens | type_tokens))
+        elif (text_tokens | type_tokens) & SEARCH_WORDS:
+            score += 1
+        if score > best_score:
+            best, best_score = element, score
+    # Un champ sans correspondance de libellé demandé n'est pas retenu
+    if label_tokens and best_score <= 2:
+        return None
+    return best if best_score >= 2 else None
+
+
+def _run_step(steps: List[Dict[str, str]], tool: str, func, argument: str) -> bool:
+    with span(f"tool.{tool}", input=argument, path="fast") as tool_span:
+        observation = func(argument)
+        tool_span.set(ok=not observation.startswith("Erreur"))
+    steps.append({"tool": tool, "input": argument, "observation": observation})
+    return not observation.startswith("Erreur")
+
+
+def resolve_target(intent: Intent, elements: UIElementStore) -> Optional[UIElement]:
+    """Retrouve l'élément visé par une intention : par libellé pour un clic, sinon le champ de saisie"""
+    if intent.action == "click":
+        return elements.find_by_label(intent.label or "")
+    return find_input_field(elements, intent.label if intent.action == "fill" else None)
+
+
+def execute_intent(intent: Intent, elements: UIElementStore) -> Optional[Dict[str, object]]:
+    """
+    Exécute une intention directement contre les éléments analysés
+
+    Args:
+        intent (Intent): L'intention à exécuter
+        elements (UIElementStore): Les éléments de la dernière analyse
+
+    Returns:
+        dict: Résultat au format de l'agent (`output`) avec `path` et `steps`,
+            ou None si l'intention n'a pas pu être résolue ou exécutée
+    """
+    if not len(elements):
+        return None
+
+    target = resolve_target(intent, elements)
+    if target is None:
+        print(f"Chemin rapide : aucun élément trouvé pour {intent}")
+        return None
+
+    steps: List[Dict[str, str]] = []
+    ok = _run_step(steps, "ClickAt", click_action, f"{target.x},{target.y}")
+    if ok and intent.action in ("search", "fill"):
+        ok = _run_step(steps, "TypeText", type_text, intent.text or "")
+        if ok and intent.action == "search" and ConfigLoader().get_section("fast_path").get("submit_search", False):
+            ok = _run_step(steps, "PressKey", press_key, "enter")
+    if not ok:
+        print(f"Chemin rapide : échec de l'exécution ({steps[-1]['observation']})")
+        return None
+
+    return {
+        "output": " ; ".join(step["observation"] for step in steps),
+        "path": "fast",
+        "steps": steps,
+    }
+
+
+def is_enabled() -> bool:
+    """Indique si le chemin rapide est activé dans la configuration"""
+    return ConfigLoader().get_section("fast_path").get("enabled", True)
@@ -0,0 +1,99 @@
+"""
+Module de planification sur le graphe des états d'écran
+
+Depuis un écran connu, une action déjà réussie (arête du graphe) est
+rejouée directement avec ses étapes enregistrées, sans analyse ni appel
+au modèle. Le chemin rapide et l'agent ne sont utilisés que pour les
+écrans inconnus, les actions jamais observées depuis l'écran courant ou
+les transitions dont le taux de succès est insuffisant. Après un rejeu,
+l'écran obtenu est comparé aux écrans d'arrivée déjà obtenus avec les
+mêmes valeurs des paramètres (tous ceux de la transition si ses étapes
+n'ont pas de paramètre : un écran de résultats dépend du texte saisi) :
+s'il n'y correspond pas, le rejeu est compté comme un échec.
+"""
+from typing import Dict, List, Optional
+from agents.agent_ui_automation import click_action, type_text, press_key, execute_plan
+from utils.state_graph import StateGraph, StateNode, bind_steps, get_state_graph_settings
+from utils.screen_utils import capture_frame
+from utils.tracing import span
+
+# Outils rejouables, par nom d'outil de l'agent
+TOOLS = {
+    "ClickAt": click_action,
+    "TypeText": type_text,
+    "PressKey": press_key,
+    "ExecutePlan": execute_plan,
+}
+
+
+def replayable_edge(graph: StateGraph, node: StateNode, action: str):
+    """
+    Retourne la transition à rejouer depuis un état pour une action, ou
+    None si elle est inconnue ou pas assez fiable
+    """
+    edge = graph.edge(node.node_id, action)
+    if edge is None or not edge.steps:
+        return None
+    settings = get_state_graph_settings()
+    if edge.successes < settings.get("min_successes", 1):
+        return None
+    if edge.success_rate < settings.get("min_success_rate", 0.8):
+        return None
+    if any(step["tool"] not in TOOLS for step in edge.steps):
+        return None
+    return edge
+
+
+def replay(graph: StateGraph, node: StateNode, action: str, params: Dict[str, str]) -> Optional[Dict[str, object]]:
+    """
+    Rejoue la transition connue d'un état pour une action
+
+    Args:
+        graph (StateGraph): Le graphe des états
+        node (StateNode): L'état courant
+        action (str): L'action à exécuter (ex. "search")
+        params (dict): Valeurs des paramètres des étapes (ex. {"text": "requête"})
+
+    Returns:
+        dict: Résultat au format de l'agent (`output`) avec `path` ("graph")
+            et `steps`, ou None si aucune transition n'est rejouable ou si
+            le rejeu a échoué (étape en erreur ou écran obtenu différent des
+            écrans d'arrivée connus pour ces paramètres ; l'échec est
+            enregistré dans le graphe)
+    """
+    edge = replayable_edge(graph, node, action)
+    if edge is None:
+        return None
+
+    steps: List[Dict[str, str]] = []
+    with span("graph.replay", state=node.node_id, action=action, success_rate=edge.success_rate):
+        for step in bind_steps(edge.steps, params):
+            with span(f"tool.{step['tool']}", input=step["input"], path="graph") as tool_span:
+                observation = TOOLS[step["tool"]](step["input"])
+                ok = not observation.startswith("Erreur")
+                tool_span.set(ok=ok)
+            steps.append(dict(step, observation=observation))
+            if not ok:
+                print(f"Graphe des états : échec du rejeu de {action} depuis {node.node_id} ({observation})")
+                graph.record(node.node_id, action, success=False)
+                return None
+
+        targets = edge.expected_targets(params)
+        if targets:
+            with span("graph.verify", state=node.node_id) as verify_span:
+                after = capture_frame(archive=False)
+                reached = graph.reaches(graph.fingerprint(after.image) if after is not None else None, targets)
+                verify_span.set(reached=reached)
+            if not reached:
+                print(f"Graphe des états : après le rejeu de {action} depuis {node.node_id}, "
+                      f"l'écran ne correspond à aucun écran d'arrivée connu")
+                graph.record(node.node_id, action, success=False)
+                return None
+
+    print(f"Graphe des états : {action} rejoué depuis {node.node_id} ({len(steps)} étape(s), "
+          f"succès {edge.success_rate:.0%} sur {edge.successes + edge.failures} exécution(s))")
+    return {
+        "output": " ; ".join(step["observation"] for step in steps),
+        "path": "graph",
+        "steps": steps,
+    }
@@ -0,0 +1,3 @@
+"""
+Package contenant les benchmarks
+"""
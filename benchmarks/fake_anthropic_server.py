@@ -0,0 +1,185 @@
+"""
+Serveur HTTP local imitant l'API Messages d'Anthropic
+
+Permet d'exercer le client du modèle (connexions, débit, reprises,
+métriques) sans réseau ni clé réelle : chaque requête POST /v1/messages
+reçoit une réponse fixe après une latence simulée, et les `fail_first`
+premières requêtes peuvent être rejetées avec un statut d'erreur (429 par
+défaut). Les requêtes `"stream": true` reçoivent la réponse en événements
+SSE, une ligne par fragment.
+
+Usage :
+    server = FakeAnthropicServer(latency=0.05, fail_first=2).start()
+    # config.yaml : llm.base_url = server.url
+    ...
+    server.stop()
+
+Ou en ligne de commande : python -m benchmarks.fake_anthropic_server [--port 8765]
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = """1. Recherche Google
+   - Type : bouton
+   - Texte : "Recherche Google"
+   - Position : x=555, y=430
+   - Taille : 150x36
+   - État : actif"""
+
+
+class FakeAnthropicServer:
+    """
+    Serveur de substitution de l'API Messages, exécuté dans un thread
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, reply=DEFAULT_REPLY,
+                 fail_first=0, fail_status=429, retry_after=None):
+        self.latency = latency
+        self.reply = reply
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, response):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for event, data in server.stream_events(response):
+                    self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.requests.append(payload)
+                    index = len(server.requests)
+                    server.active += 1
+                    server.max_active = max(server.max_active, server.active)
+                try:
+                    if server.latency:
+                        time.sleep(server.latency)
+                    if index <= server.fail_first:
+                        headers = {"retry-after": str(server.retry_after)} if server.retry_after is not None else None
+                        self._send(server.fail_status, {
+                            "type": "error",
+                            "error": {"type": "rate_limit_error", "message": "Limite de débit simulée"},
+                        }, headers)
+                        return
+                    if payload.get("stream"):
+                        self._send_stream(server.response_for(payload, index))
+                    else:
+                        self._send(200, server.response_for(payload, index))
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client parti avant la réponse (délai dépassé)
+                    self.close_connection = True
+                finally:
+                    with server._lock:
+                        server.active -= 1
+
+        return Handler
+
+    def response_for(self, payload, index):
+        """Construit la réponse de l'API Messages pour une requête"""
+        reply = self.reply(payload) if callable(self.reply) else self.reply
+        return {
+            "id": f"msg_fake_{index}",
+            "type": "message",
+            "role": "assistant",
+            "model": payload.get("model", "fake"),
+            "content": [{"type": "text", "text": reply}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": len(json.dumps(payload.get("messages", []))) // 4,
+                      "output_tokens": len(reply) // 4},
+        }
+
+    @staticmethod
+    def stream_events(response):
+        """Découpe une réponse de l'API Messages en événements SSE (une ligne de texte par delta)"""
+        text = response["content"][0]["text"]
+        usage = response["usage"]
+        message = dict(response, content=[], stop_reason=None,
+                       usage={"input_tokens": usage["input_tokens"], "output_tokens": 0})
+        yield "message_start", {"type": "message_start", "message": message}
+        yield "content_block_start", {"type": "content_block_start", "index": 0,
+                                      "content_block": {"type": "text", "text": ""}}
+        for line in text.splitlines(keepends=True):
+            yield "content_block_delta", {"type": "content_block_delta", "index": 0,
+                                          "delta": {"type": "text_delta", "text": line}}
+        yield "content_block_stop", {"type": "content_block_stop", "index": 0}
+        yield "message_delta", {"type": "message_delta",
+                                "delta": {"stop_reason": response["stop_reason"], "stop_sequence": None},
+                                "usage": {"input_tokens": 0, "output_tokens": usage["output_tokens"]}}
+        yield "message_stop", {"type": "message_stop"}
+
+    def start(self):
+        """Démarre le serveur en arrière-plan et le retourne"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-anthropic", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Arrête le serveur"""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serveur local imitant l'API Messages d'Anthropic")
+    parser.add_argument("--port", type=int, default=8765, help="Port d'écoute")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latence simulée par requête, en secondes")
+    parser.add_argument("--fail-first", type=int, default=0, help="Nombre de requêtes initiales rejetées")
+    parser.add_argument("--fail-status", type=int, default=429, help="Statut HTTP des requêtes rejetées")
+    args = parser.parse_args(argv)
+
+    server = FakeAnthropicServer(port=args.port, latency=args.latency,
+                                 fail_first=args.fail_first, fail_status=args.fail_status)
+    print(f"Serveur de substitution à l'écoute sur {server.url} (llm.base_url)")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
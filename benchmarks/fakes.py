@@ -0,0 +1,323 @@
+"""
+Objets de substitution pour exécuter le workflow hors ligne
+
+- `FakeScreen` : écran synthétique (page de recherche) remplaçant PIL.ImageGrab ;
+  la page s'affiche après un temps de chargement, le champ cliqué prend le
+  focus et le texte saisi y est dessiné
+- `FakePyAutoGUI` : enregistre les déplacements, clics et saisies, en
+  respectant (optionnellement) leurs durées
+- `FakeWebBrowser` : enregistre les URL ouvertes
+- `FakeChatModel` : modèle de chat renvoyant une analyse fixe de l'écran
+  synthétique et un scénario ReAct, après une latence configurable (ou
+  ligne par ligne en streaming)
+"""
+import io
+import re
+import time
+import base64
+import asyncio
+from typing import Any, List, Optional, Tuple
+from PIL import Image, ImageDraw
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from clients.langchain_client import DEFAULT_MODEL, prompt_cache_min_tokens
+
+# Éléments de l'écran synthétique : (type, libellé, centre x, centre y, largeur, hauteur)
+SCREEN_ELEMENTS = [
+    ("champ de saisie", "Rechercher", 640, 360, 560, 44),
+    ("bouton", "Recherche Google", 555, 430, 150, 36),
+    ("bouton", "J'ai de la chance", 725, 430, 170, 36),
+    ("lien", "Gmail", 1110, 30, 50, 20),
+    ("lien", "Images", 1180, 30, 60, 20),
+]
+
+
+class FakeScreen:
+    """
+    Écran synthétique remplaçant PIL.ImageGrab (méthode grab)
+    """
+
+    def __init__(self, width: int = 1280, height: int = 800, elements=SCREEN_ELEMENTS, load_time: float = 0.3):
+        self.width = width
+        self.height = height
+        self.elements = list(elements)
+        self.load_time = load_time
+        self.typed = ""
+        self.focused = None
+        self.grabs = 0
+        self._loading_until = 0.0
+        self._frame = None
+        self._loading_frame = None
+
+    def _render(self) -> Image.Image:
+        image = Image.new("RGB", (self.width, self.height), "white")
+        draw = ImageDraw.Draw(image)
+        draw.text((self.width // 2 - 40, self.height // 2 - 140), "Google", fill=(66, 133, 244))
+        for element_type, label, x, y, width, height in self.elements:
+            box = (x - width // 2, y - height // 2, x + width // 2, y + height // 2)
+            if element_type == "lien":
+                draw.text((box[0], box[1]), label, fill=(26, 13, 171))
+            else:
+                outline = (26, 115, 232) if label == self.focused else (180, 180, 180)
+                draw.rectangle(box, outline=outline, fill=(248, 249, 250), width=2)
+                text = self.typed if element_type == "champ de saisie" and self.typed else label
+                draw.text((box[0] + 12, box[1] + height // 2 - 6), text, fill=(32, 33, 36))
+        return image
+
+    def type(self, text: str) -> None:
+        """Ajoute du texte saisi dans le champ de recherche"""
+        self.typed += text
+        self._frame = None
+
+    def click(self, x: int, y: int) -> None:
+        """Donne le focus à l'élément situé sous le point cliqué"""
+        focused = None
+        for element_type, label, ex, ey, width, height in self.elements:
+            if abs(x - ex) <= width // 2 and abs(y - ey) <= height // 2 and element_type != "lien":
+                focused = label
+        if focused != self.focused:
+            self.focused = focused
+            self._frame = None
+
+    def reset(self) -> None:
+        """Recharge la page : vide le champ et affiche l'écran de chargement pendant load_time"""
+        self.typed = ""
+        self.focused = None
+        self._frame = None
+        self._loading_until = time.monotonic() + self.load_time
+
+    def grab(self, bbox=None, *args, **kwargs) -> Image.Image:
+        self.grabs += 1
+        if time.monotonic() < self._loading_until:
+            if self._loading_frame is None:
+                self._loading_frame = Image.new("RGB", (self.width, self.height), (32, 33, 36))
+            frame = self._loading_frame
+        else:
+            if self._frame is None:
+                self._frame = self._render()
+            frame = self._frame
+        return frame.crop(bbox) if bbox else frame.copy()
+
+    def analysis_text(self, width: Optional[int] = None, height: Optional[int] = None) -> str:
+        """
+        Retourne l'analyse de l'écran, au format demandé par le prompt
+        d'analyse, dans l'espace d'une image de la taille donnée
+        """
+        scale_x = (width or self.width) / float(self.width)
+        scale_y = (height or self.height) / float(self.height)
+        lines = []
+        for index, (element_type, label, x, y, w, h) in enumerate(self.elements, 1):
+            lines += [
+                f"{index}. {label}",
+                f"   - Type : {element_type}",
+                f"   - Texte : \"{label}\"",
+                f"   - Position : x={round(x * scale_x)}, y={round(y * scale_y)}",
+                f"   - Taille : {round(w * scale_x)}x{round(h * scale_y)}",
+                "   - État : actif",
+            ]
+        return "\n".join(lines)
+
+
+class FakePyAutoGUI:
+    """
+    Remplace pyautogui : enregistre les actions et les répercute sur l'écran synthétique
+    """
+    FAILSAFE = False
+    PAUSE = 0
+
+    def __init__(self, screen: Optional[FakeScreen] = None, simulate_durations: bool = True):
+        self.screen = screen
+        self.simulate_durations = simulate_durations
+        self.events: List[Tuple[Any, ...]] = []
+        self._position = (0, 0)
+
+    def _wait(self, seconds: float) -> None:
+        if self.simulate_durations and seconds:
+            time.sleep(seconds)
+
+    def size(self):
+        return (self.screen.width, self.screen.height) if self.screen else (1280, 800)
+
+    def position(self):
+        return self._position
+
+    def moveTo(self, x, y, duration=0.0, *args, **kwargs):
+        self._wait(duration)
+        self._position = (x, y)
+        self.events.append(("move", x, y))
+
+    def click(self, x=None, y=None, *args, **kwargs):
+        if x is not None and y is not None:
+            self._position = (x, y)
+        self.events.append(("click",) + tuple(self._position))
+        if self.screen:
+            self.screen.click(*self._position)
+
+    def typewrite(self, text, interval=0.0, *args, **kwargs):
+        if isinstance(text, (list, tuple)):
+            for key in text:
+                self.press(key)
+            return
+        self._wait(interval * len(text))
+        self.events.append(("type", text))
+        if self.screen:
+            self.screen.type(text.rstrip("\n"))
+
+    write = typewrite
+
+    def press(self, key, *args, **kwargs):
+        self.events.append(("press", key))
+
+    def hotkey(self, *keys, **kwargs):
+        self.events.append(("hotkey",) + keys)
+
+
+class FakeWebBrowser:
+    """Remplace webbrowser : enregistre les URL ouvertes"""
+
+    def __init__(self, screen: Optional[FakeScreen] = None):
+        self.screen = screen
+        self.opened: List[str] = []
+
+    def open(self, url, *args, **kwargs):
+        self.opened.append(url)
+        if self.screen:
+            self.screen.reset()
+        return True
+
+
+def _image_size(messages) -> Optional[Tuple[int, int]]:
+    """Retourne la taille de la première image des messages"""
+    for message in messages:
+        if not isinstance(message.content, list):
+            continue
+        for block in message.content:
+            if isinstance(block, dict) and block.get("type") == "image_url":
+                url = block["image_url"]["url"] if isinstance(block["image_url"], dict) else block["image_url"]
+                with Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1]))) as image:
+                    return image.size
+    return None
+
+
+def _message_text(messages) -> str:
+    parts = []
+    for message in messages:
+        if isinstance(message.content, str):
+            parts.append(message.content)
+        else:
+            parts.extend(str(block.get("text", "")) for block in message.content if isinstance(block, dict))
+    return "\n".join(parts)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Modèle de chat de substitution
+
+    Les requêtes contenant une image reçoivent l'analyse de l'écran
+    synthétique ; les requêtes de l'agent reçoivent un scénario ReAct
+    (clic sur le champ de recherche, saisie, réponse finale), en un seul
+    plan ExecutePlan si l'outil est proposé et `use_plans` activé.
+
+    En streaming, le premier fragment arrive après `first_token_share` de
+    la latence et les lignes suivantes sont réparties sur le reste.
+
+    Le cache de prompt du fournisseur est simulé avec ses règles : pour un
+    modèle compatible (`model_name`), les blocs marqués `cache_control`
+    délimitent des préfixes, ignorés sous la taille minimale du modèle,
+    écrits au premier envoi puis comptés en lecture de cache
+    (`input_token_details`).
+    """
+    screen: Any = None
+    model_name: str = DEFAULT_MODEL
+    latency: float = 0.0
+    first_token_share: float = 0.3
+    use_plans: bool = True
+    calls: int = 0
+    cached_prefixes: Any = None
+    # Tokens (d'entrée, lus dans le cache) de chaque appel
+    usage_log: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _reply(self, messages) -> str:
+        size = _image_size(messages)
+        if size is not None:
+            return self.screen.analysis_text(*size)
+        text = _message_text(messages)
+        query = re.search(r"recherche Google avec le texte : (.+)", text)
+        query = query.group(1).strip() if query else ""
+        scratchpad = text.rsplit("Question:", 1)[-1]
+        if "Texte saisi" in scratchpad or "Plan exécuté" in scratchpad:
+            return "Thought: J'ai maintenant la réponse finale\nFinal Answer: Recherche effectuée"
+        _, label, x, y, _, _ = self.screen.elements[0]
+        if "ExecutePlan" in text and self.use_plans:
+            return (f"Thought: Je clique sur le champ {label} et saisis la recherche\n"
+                    f"Action: ExecutePlan\nAction Input: click: {x},{y}; type: {query}; wait")
+        if "Clic effectué" in scratchpad:
+            return f"Thought: Je saisis la recherche\nAction: TypeText\nAction Input: {query}"
+        return f"Thought: Je clique sur le champ {label}\nAction: ClickAt\nAction Input: {x},{y}"
+
+    def _cache_usage(self, messages) -> Tuple[int, int]:
+        """Retourne les tokens (lus, écrits) du cache de prompt simulé"""
+        if self.cached_prefixes is None:
+            self.cached_prefixes = set()
+        minimum = prompt_cache_min_tokens(self.model_name)
+        if minimum is None:
+            return 0, 0
+        prefixes, text = [], ""
+        for message in messages:
+            blocks = message.content if isinstance(message.content, list) else [{"text": message.content}]
+            for block in blocks:
+                if isinstance(block, dict):
+                    text += "\n" + str(block.get("text", ""))
+                    if block.get("cache_control") and len(text) // 4 >= minimum:
+                        prefixes.append(text)
+        if not prefixes:
+            return 0, 0
+        read = max((len(prefix) for prefix in prefixes if prefix in self.cached_prefixes), default=0)
+        self.cached_prefixes.update(prefixes)
+        return read // 4, max(0, len(prefixes[-1]) - read) // 4
+
+    def _result(self, messages) -> ChatResult:
+        self.calls += 1
+        reply = self._reply(messages)
+        input_tokens = len(_message_text(messages)) // 4
+        cache_read, cache_creation = self._cache_usage(messages)
+        if self.usage_log is None:
+            self.usage_log = []
+        self.usage_log.append((input_tokens, cache_read))
+        message = AIMessage(content=reply, usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": len(reply) // 4,
+            "total_tokens": input_tokens + len(reply) // 4,
+            "input_token_details": {"cache_read": cache_read, "cache_creation": cache_creation},
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._result(messages)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        result = self._result(messages)
+        message = result.generations[0].message
+        lines = message.content.split("\n")
+        if self.latency:
+            time.sleep(self.latency * self.first_token_share)
+        for index, line in enumerate(lines):
+            if index and self.latency:
+                time.sleep(self.latency * (1 - self.first_token_share) / max(1, len(lines) - 1))
+            last = index == len(lines) - 1
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content=line if last else line + "\n",
+                usage_metadata=message.usage_metadata if last else None,
+            ))
@@ -0,0 +1,347 @@
+"""
+Benchmark hors ligne du workflow et de l'analyseur
+
+L'écran, pyautogui, le navigateur et le modèle sont remplacés par les
+objets de `benchmarks.fakes` : aucun affichage, navigateur ni clé API
+n'est nécessaire. Pour chaque scénario, le benchmark mesure la latence de
+bout en bout (p50, p95), la durée moyenne de chaque étape (spans de
+utils.tracing), le débit (runs/min) et le pic mémoire, puis compare les
+résultats aux références enregistrées : toute régression au-delà de la
+tolérance fait échouer le benchmark.
+
+Scénarios :
+- `workflow` : Orchestrator.run_workflow avec la configuration courante
+  (après le préchauffage, l'écran et la recherche sont connus du graphe
+  des états et rejoués)
+- `workflow_agent` : run_workflow sans chemin rapide ni graphe des états (agent ReAct)
+- `workflow_stream` : run_workflow avec analyse en flux, sans bibliothèque
+  de vignettes ni graphe des états : chaque run analyse l'écran et le
+  chemin rapide part dès que le champ de recherche est reçu
+- `analyzer` : analyse d'une capture (compute_analysis), sans cache
+- `batch` : Orchestrator.run_many sur une série de cas, avec capture à
+  l'avance (`lookahead=BATCH_LOOKAHEAD`, chaque cas capturé à l'avance
+  est rouvert avant son exécution)
+- `batch_sequential` : la même série avec `lookahead=0`, le réglage par
+  défaut (aucune réouverture, analyses non recouvertes)
+
+Usage : python -m benchmarks.offline [--scenario workflow] [--runs 3] [--latency 0.2]
+                                     [--update-baseline] [--tolerance 0.25]
+"""
+import os
+import sys
+import json
+import copy
+import time
+import argparse
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
+from benchmarks.fakes import FakeScreen, FakePyAutoGUI, FakeWebBrowser, FakeChatModel
+
+SCENARIOS = ("workflow", "workflow_agent", "workflow_stream", "analyzer", "batch", "batch_sequential")
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# Marges absolues ajoutées à la tolérance relative, pour ignorer le bruit des petites valeurs
+LATENCY_SLACK = 0.02
+MEMORY_SLACK_MB = 2.0
+TOKEN_SLACK = 50
+
+SEARCH_QUERY = "Anthropic Claude"
+
+# Cas par itération des scénarios par lots, et cas capturés à l'avance du scénario `batch`
+BATCH_CASES = 4
+BATCH_LOOKAHEAD = 2
+
+
+class OfflineEnvironment:
+    """
+    Environnement hors ligne : objets de substitution installés et données
+    écrites dans un dossier temporaire
+    """
+
+    def __init__(self, latency=0.2, simulate_durations=True, cache=False, fast_path=True, type_interval=0.0,
+                 templates=True, streaming=True, state_graph=True):
+        self.latency = latency
+        self.state_graph = state_graph
+        self.templates = templates
+        self.streaming = streaming
+        self.type_interval = type_interval
+        self.simulate_durations = simulate_durations
+        self.cache = cache
+        self.fast_path = fast_path
+        self.screen = FakeScreen()
+        self.pyautogui = FakePyAutoGUI(self.screen, simulate_durations=simulate_durations)
+        self.browser = FakeWebBrowser(self.screen)
+        self.model = FakeChatModel(screen=self.screen, latency=latency)
+        self.data_dir = None
+
+    @contextmanager
+    def installed(self):
+        from utils import backends, tracing
+        from utils.config_loader import ConfigLoader
+        from clients import langchain_client, cassette
+        import utils.analysis_cache as analysis_cache
+
+        config = ConfigLoader().get_config()
+        saved_config = copy.deepcopy(config)
+        with tempfile.TemporaryDirectory(prefix="offline_bench_") as data_dir:
+            self.data_dir = data_dir
+            config["paths"]["data_dir"] = data_dir
+            config.setdefault("analysis_cache", {})["enabled"] = self.cache
+            config.setdefault("fast_path", {})["enabled"] = self.fast_path
+            config.setdefault("templates", {})["enabled"] = self.templates
+            config.setdefault("streaming", {})["enabled"] = self.streaming
+            config.setdefault("state_graph", {})["enabled"] = self.state_graph
+            config["tracing"] = {"enabled": True, "directory": os.path.join(data_dir, "traces")}
+            config["cassette"] = {"mode": "off"}
+            # Ni injection xdotool ni presse-papiers : seul pyautogui est remplacé
+            config["text_input"] = {"backend": "pyautogui", "interval": self.type_interval, "verify": False}
+            ConfigLoader()._directories_created = False
+
+            previous_backends = backends.set_backends(self.pyautogui, self.screen, self.browser)
+            previous_model = langchain_client.set_chat_model(self.model)
+            previous_cache = analysis_cache._analysis_cache
+            analysis_cache._analysis_cache = None
+            tracing.set_enabled(True)
+            cassette.set_cassette(None)
+            try:
+                yield self
+            finally:
+                from utils.screen_utils import flush_archive
+                from utils.artifact_store import _artifact_stores
+
+                flush_archive()
+                tracing.export_run("benchmark")
+                for directory in [d for d in _artifact_stores if d.startswith(data_dir)]:
+                    _artifact_stores.pop(directory)._db.close()
+                tracing.set_enabled(None)
+                analysis_cache._analysis_cache = previous_cache
+                langchain_client.set_chat_model(previous_model)
+                backends.set_backends(*previous_backends)
+                config.clear()
+                config.update(saved_config)
+                ConfigLoader()._directories_created = False
+                self.data_dir = None
+
+    def read_spans(self, offset):
+        """Retourne les spans exportés depuis la position `offset` du fichier de trace et la nouvelle position"""
+        from utils import tracing
+
+        tracing.export_run("benchmark")
+        path = os.path.join(tracing.get_traces_dir(), "trace.jsonl")
+        if not os.path.exists(path):
+            return [], offset
+        with open(path, "r", encoding="utf-8") as f:
+            f.seek(offset)
+            spans = [json.loads(line) for line in f if line.strip()]
+            return spans, f.tell()
+
+
+def _run_once(scenario, environment):
+    """Exécute une itération du scénario et retourne True en cas de succès"""
+    if scenario in ("workflow", "workflow_agent", "workflow_stream"):
+        from core.orchestrator import Orchestrator
+
+        return Orchestrator().run_workflow(SEARCH_QUERY)
+    if scenario in ("batch", "batch_sequential"):
+        from core.orchestrator import Orchestrator
+
+        report = Orchestrator().run_many([SEARCH_QUERY] * BATCH_CASES,
+                                         lookahead=0 if scenario == "batch_sequential" else BATCH_LOOKAHEAD)
+        return report["stats"]["succeeded"] == BATCH_CASES
+    if scenario == "analyzer":
+        from agents.agent_analyzer import compute_analysis
+        from utils.tracing import span
+
+        with span("analyzer"):
+            return bool(compute_analysis(environment.screen.grab()))
+    raise ValueError(f"Scénario inconnu : {scenario}")
+
+
+def _percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile * (len(values) - 1))))]
+
+
+@contextmanager
+def _quiet(enabled):
+    """Masque les sorties du workflow pendant les mesures"""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w") as devnull:
+        stdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+def run_scenario(scenario, runs=3, warmup=1, latency=0.2, simulate_durations=True, verbose=False):
+    """
+    Mesure un scénario dans l'environnement hors ligne
+
+    Returns:
+        dict: runs, failures, latency_p50, latency_p95, latency_mean,
+            runs_per_minute, stages (durée moyenne par span), peak_memory_mb,
+            tokens (tokens d'entrée par appel au modèle, dont lus dans le cache de prompt)
+    """
+    environment = OfflineEnvironment(latency=latency, simulate_durations=simulate_durations,
+                                     fast_path=scenario != "workflow_agent",
+                                     templates=scenario != "workflow_stream",
+                                     state_graph=scenario == "workflow",
+                                     streaming=not scenario.startswith("batch"))
+    durations, failures, stages = [], 0, {}
+    usage = []
+    with _quiet(not verbose), environment.installed():
+        for _ in range(warmup):
+            _run_once(scenario, environment)
+        _, offset = environment.read_spans(0)
+        logged = len(environment.model.usage_log or ())
+
+        for _ in range(runs):
+            start = time.perf_counter()
+            ok = _run_once(scenario, environment)
+            durations.append(time.perf_counter() - start)
+            failures += 0 if ok else 1
+            spans, offset = environment.read_spans(offset)
+            for span in spans:
+                stages[span["name"]] = stages.get(span["name"], 0.0) + span["duration"]
+
+        usage = (environment.model.usage_log or [])[logged:]
+
+        # Pic mémoire mesuré sur une itération séparée : tracemalloc ralentit l'exécution
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        _run_once(scenario, environment)
+        peak = tracemalloc.get_traced_memory()[1]
+        if started:
+            tracemalloc.stop()
+
+    mean = sum(durations) / len(durations)
+    calls = len(usage)
+    input_tokens = sum(tokens for tokens, _ in usage)
+    cache_read_tokens = sum(read for _, read in usage)
+    return {
+        "runs": runs,
+        "failures": failures,
+        "latency_p50": _percentile(durations, 0.5),
+        "latency_p95": _percentile(durations, 0.95),
+        "latency_mean": mean,
+        "runs_per_minute": 60.0 / mean if mean else 0.0,
+        "stages": {name: total / runs for name, total in sorted(stages.items())},
+        "peak_memory_mb": peak / (1024 * 1024),
+        "tokens": {
+            "llm_calls_per_run": calls / runs,
+            "input_per_call": input_tokens / calls if calls else 0.0,
+            "uncached_input_per_call": (input_tokens - cache_read_tokens) / calls if calls else 0.0,
+        },
+    }
+
+
+def compare(results, baselines, tolerance=0.25):
+    """
+    Compare les résultats aux références
+
+    Returns:
+        list: Régressions, sous forme de messages
+    """
+    regressions = []
+    for scenario, result in results.items():
+        baseline = baselines.get(scenario)
+        if not baseline:
+            continue
+        if result["failures"] > baseline.get("failures", 0):
+            regressions.append(f"{scenario} : {result['failures']} échec(s) (référence {baseline.get('failures', 0)})")
+        checks = [("latency_p50", result["latency_p50"], baseline.get("latency_p50"), LATENCY_SLACK, "s"),
+                  ("peak_memory_mb", result["peak_memory_mb"], baseline.get("peak_memory_mb"), MEMORY_SLACK_MB, "Mo")]
+        for name in ("input_per_call", "uncached_input_per_call"):
+            checks.append((name, result.get("tokens", {}).get(name, 0.0),
+                           (baseline.get("tokens") or {}).get(name), TOKEN_SLACK, "tokens"))
+        for stage, value in result["stages"].items():
+            checks.append((f"stage {stage}", value, (baseline.get("stages") or {}).get(stage), LATENCY_SLACK, "s"))
+        for name, value, reference, slack, unit in checks:
+            if reference is None:
+                continue
+            limit = reference * (1 + tolerance) + slack
+            if value > limit:
+                regressions.append(f"{scenario} : {name} = {value:.3f} {unit} > {limit:.3f} {unit} "
+                                   f"(référence {reference:.3f} {unit}, tolérance {tolerance:.0%})")
+    return regressions
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def print_result(scenario, result):
+    print(f"\n== {scenario} ({result['runs']} runs, {result['failures']} échec(s))")
+    print(f"latence p50 {result['latency_p50'] * 1000:8.1f} ms, p95 {result['latency_p95'] * 1000:8.1f} ms, "
+          f"{result['runs_per_minute']:.1f} runs/min, pic mémoire {result['peak_memory_mb']:.1f} Mo")
+    tokens = result["tokens"]
+    if tokens["llm_calls_per_run"]:
+        print(f"{tokens['llm_calls_per_run']:.1f} appels au modèle par run, {tokens['input_per_call']:.0f} tokens "
+              f"d'entrée par appel dont {tokens['uncached_input_per_call']:.0f} hors cache de prompt")
+    for stage, value in result["stages"].items():
+        print(f"  {stage:<24} {value * 1000:8.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark hors ligne du workflow et de l'analyseur")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="Scénario à mesurer (répétable, tous par défaut)")
+    parser.add_argument("--runs", type=int, default=3, help="Nombre d'itérations mesurées par scénario")
+    parser.add_argument("--warmup", type=int, default=1, help="Nombre d'itérations de préchauffage")
+    parser.add_argument("--latency", type=float, default=0.2, help="Latence simulée du modèle, en secondes")
+    parser.add_argument("--no-durations", action="store_true",
+                        help="Ne pas simuler la durée des déplacements et de la saisie")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Fichier des références")
+    parser.add_argument("--update-baseline", action="store_true", help="Enregistrer les résultats comme références")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Dégradation relative tolérée")
+    parser.add_argument("--output", help="Fichier JSON où écrire les résultats")
+    parser.add_argument("--verbose", action="store_true", help="Afficher les sorties du workflow")
+    args = parser.parse_args(argv)
+
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(project_dir)
+
+    results = {}
+    for scenario in args.scenario or SCENARIOS:
+        results[scenario] = run_scenario(scenario, runs=args.runs, warmup=args.warmup, latency=args.latency,
+                                         simulate_durations=not args.no_durations, verbose=args.verbose)
+        print_result(scenario, results[scenario])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        baselines = load_baselines(args.baseline)
+        baselines.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2)
+            f.write("\n")
+        print(f"\nRéférences enregistrées dans {args.baseline}")
+        return 0
+
+    regressions = compare(results, load_baselines(args.baseline), args.tolerance)
+    if regressions:
+        print("\n" + "!" * 72)
+        print("RÉGRESSION DE PERFORMANCE")
+        for regression in regressions:
+            print(f"  - {regression}")
+        print("!" * 72)
+        return 1
+    print("\nOK : aucune régression par rapport aux références")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Benchmark du routage des appels entre niveaux de modèles
+
+Deux serveurs locaux imitant l'API Messages (benchmarks.fake_anthropic_server)
+tiennent lieu de grand modèle (lent) et de petit modèle (rapide) : aucun
+réseau ni clé réelle n'est nécessaire. Le benchmark envoie des séries
+d'appels de chaque type (analyse d'une capture, planification de l'agent,
+reprise après une observation en erreur, conclusion après un plan exécuté) :
+
+- `direct` : sans routage, tous les appels vers le grand modèle (référence mesurée)
+- `routed` : avec routage, chaque type vers son niveau
+- `failover` : grand modèle plus lent que son délai maximal : les appels
+  basculent sur le petit modèle, puis l'évitent pendant le temps de récupération
+
+Pour chaque scénario : durée totale, latence par appel et rapport du
+routage (appels par type et niveau, p50/p95 par niveau, bascules, coût et
+latence comparés au niveau de référence). Le benchmark échoue si les
+appels ne sont pas routés ou ne basculent pas comme attendu.
+
+Usage : python -m benchmarks.routing [--rounds 5] [--large-latency 0.3] [--small-latency 0.05]
+"""
+import os
+import sys
+import copy
+import time
+import argparse
+from contextlib import contextmanager
+from benchmarks.fake_anthropic_server import FakeAnthropicServer
+
+# Image PNG 1x1, suffisante pour marquer un appel d'analyse
+PIXEL = ("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8DwHwAFBQIAX8jx0gAAAABJRU5ErkJggg==")
+
+QUESTION = "Question: Rechercher Anthropic Claude sur Google\n"
+
+
+def _messages(task):
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    if task == "vision":
+        return [HumanMessage(content=[
+            {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": PIXEL}},
+            {"type": "text", "text": "Décris les éléments de l'interface."},
+        ])]
+    scratchpad = ""
+    if task == "tool":
+        scratchpad = ("Thought: Je clique sur le champ et saisis la recherche\nAction: ExecutePlan\n"
+                      "Action Input: click: 640,360; type: Anthropic Claude\n"
+                      "Observation: Plan exécuté (2 étapes) : Clic effectué aux coordonnées (640, 360) ; "
+                      "Texte saisi : Anthropic Claude\nThought: ")
+    elif task == "replanning":
+        scratchpad = ("Thought: Je clique sur le champ\nAction: ClickAt\nAction Input: 640, 360\n"
+                      "Observation: Erreur lors du clic : aucun effet observé aux coordonnées (640, 360)\nThought: ")
+    return [SystemMessage(content="Réponds au format Thought/Action/Action Input/Observation."),
+            HumanMessage(content=QUESTION + scratchpad)]
+
+
+@contextmanager
+def routing_config(enabled, large_url, small_url, large_timeout=None, cooldown=30.0):
+    """Configure (temporairement) le routage vers les deux serveurs"""
+    from utils.config_loader import ConfigLoader
+    from clients import model_router, langchain_client
+
+    config = ConfigLoader().get_config()
+    saved = copy.deepcopy(config)
+    saved_key = os.environ.get("ANTHROPIC_API_KEY")
+    os.environ.setdefault("ANTHROPIC_API_KEY", "fake")
+    try:
+        config["cassette"] = {"mode": "off"}
+        # Sans limite de débit : seules les latences des modèles sont mesurées
+        config.setdefault("llm", {}).update(base_url=large_url, max_retries=0,
+                                            requests_per_minute=None, tokens_per_minute=None)
+        langchain_client._controller = None
+        routing = config.setdefault("routing", {})
+        routing["enabled"] = enabled
+        routing["cooldown"] = cooldown
+        tiers = routing.setdefault("tiers", {})
+        tiers.setdefault("large", {}).update(base_url=large_url, timeout=large_timeout)
+        tiers.setdefault("small", {}).update(base_url=small_url)
+        model_router.reset_router()
+        yield
+    finally:
+        config.clear()
+        config.update(saved)
+        model_router.reset_router()
+        langchain_client._controller = None
+        if saved_key is None:
+            os.environ.pop("ANTHROPIC_API_KEY", None)
+
+
+def run_calls(rounds):
+    """Envoie `rounds` séries d'appels (analyse, planification, reprise, conclusion) ; retourne les latences par type"""
+    from clients.langchain_client import get_chat_model
+
+    latencies = {"vision": [], "planning": [], "replanning": [], "tool": []}
+    for _ in range(rounds):
+        for task in latencies:
+            model = get_chat_model(task="vision" if task == "vision" else "agent")
+            start = time.perf_counter()
+            model.invoke(_messages(task))
+            latencies[task].append(time.perf_counter() - start)
+    return latencies
+
+
+def run_scenario(name, rounds, large_latency, small_latency):
+    from clients import model_router
+
+    large = FakeAnthropicServer(latency=large_latency if name != "failover" else large_latency * 4).start()
+    small = FakeAnthropicServer(latency=small_latency).start()
+    try:
+        # Délai du grand modèle dépassé dans le scénario de bascule
+        timeout = large_latency * 2 if name == "failover" else None
+        with routing_config(name != "direct", large.url, small.url, large_timeout=timeout):
+            start = time.perf_counter()
+            latencies = run_calls(rounds)
+            elapsed = time.perf_counter() - start
+            report = model_router.get_routing_report() if name != "direct" else None
+        return {"elapsed": elapsed, "latencies": latencies, "report": report,
+                "requests": {"large": len(large.requests), "small": len(small.requests)}}
+    finally:
+        large.stop()
+        small.stop()
+
+
+def print_result(name, result):
+    calls = sum(len(values) for values in result["latencies"].values())
+    print(f"\n== {name} ({calls} appels en {result['elapsed']:.2f}s ; requêtes : "
+          f"grand modèle {result['requests']['large']}, petit modèle {result['requests']['small']})")
+    for task, values in result["latencies"].items():
+        print(f"  {task:<10} moyenne {sum(values) / len(values) * 1000:7.1f} ms")
+    report = result["report"]
+    if report is None:
+        return
+    for tier, stats in report["tiers"].items():
+        print(f"  {tier:<6} {stats['model']:<28} {stats['calls']:3d} appels, {stats['failures']} échec(s), "
+              f"p50 {stats['latency_p50'] * 1000:7.1f} ms, p95 {stats['latency_p95'] * 1000:7.1f} ms, "
+              f"coût {stats['cost']:.5f} $")
+    print(f"  routes : {report['routes']}, bascules : {report['failovers']}")
+    print(f"  coût {report['cost']:.5f} $ contre {report['baseline_cost']:.5f} $ "
+          f"tout sur {report['baseline']} (économie {report['cost_saving']:.0%})")
+    if report["latency_saving"] is not None:
+        print(f"  latence estimée {report['latency']:.2f}s contre {report['baseline_latency']:.2f}s "
+              f"(économie {report['latency_saving']:.0%})")
+
+
+def check(results, rounds):
+    """Retourne les écarts au comportement attendu du routage"""
+    problems = []
+    routed = results.get("routed")
+    if routed:
+        routes = routed["report"]["routes"]
+        if routes.get("tool") != {"small": rounds}:
+            problems.append(f"conclusions non routées vers le petit modèle : {routes.get('tool')}")
+        # La reprise après une erreur est une planification
+        if routes.get("planning") != {"large": 2 * rounds} or routes.get("vision") != {"large": rounds}:
+            problems.append(f"analyse, planification ou reprise hors du grand modèle : {routes}")
+        direct = results.get("direct")
+        if direct and routed["elapsed"] >= direct["elapsed"]:
+            problems.append("le routage n'a pas réduit la durée totale")
+    failover = results.get("failover")
+    if failover:
+        report = failover["report"]
+        if report["failovers"] < 1 or report["tiers"]["large"]["timeouts"] < 1:
+            problems.append("aucune bascule après un délai dépassé")
+        # Pendant la récupération, le grand modèle n'est plus sollicité
+        if failover["requests"]["large"] != report["tiers"]["large"]["failures"]:
+            problems.append(f"grand modèle sollicité pendant la récupération : {failover['requests']}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark du routage des appels entre niveaux de modèles")
+    parser.add_argument("--rounds", type=int, default=5, help="Séries d'appels (analyse, planification, reprise, conclusion)")
+    parser.add_argument("--large-latency", type=float, default=0.3, help="Latence du grand modèle, en secondes")
+    parser.add_argument("--small-latency", type=float, default=0.05, help="Latence du petit modèle, en secondes")
+    args = parser.parse_args(argv)
+
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(project_dir)
+
+    results = {}
+    for name in ("direct", "routed", "failover"):
+        results[name] = run_scenario(name, args.rounds, args.large_latency, args.small_latency)
+        print_result(name, results[name])
+
+    problems = check(results, args.rounds)
+    if problems:
+        print("\nÉCHEC :")
+        for problem in problems:
+            print(f"  - {problem}")
+        return 1
+    print("\nOK : appels routés par type et bascule sur délai dépassé")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Benchmark du démarrage à froid de main.py
+
+Mesure, dans un interpréteur neuf et sans clé API ni affichage, le temps
+écoulé jusqu'au point où main.py prendrait sa première capture : import de
+main, création de l'orchestrateur et résolution du module de capture.
+Le benchmark échoue si ce temps dépasse le budget fixé.
+
+Usage : python -m benchmarks.startup [--budget 1.0] [--runs 5]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# Budget par défaut du démarrage à froid, en secondes
+DEFAULT_BUDGET = 1.0
+
+CHILD_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import main
+from core.orchestrator import Orchestrator
+imported = time.perf_counter()
+Orchestrator()
+created = time.perf_counter()
+from utils import screen_utils
+screen_utils.get_image_grab()
+ready = time.perf_counter()
+print(json.dumps({"import": imported - start, "orchestrator": created - imported,
+                  "capture_ready": ready - start}))
+"""
+
+
+def measure_once(project_dir):
+    """
+    Lance un interpréteur neuf et retourne ses temps de démarrage
+
+    Returns:
+        dict: Durées en secondes (import, orchestrator, capture_ready, process)
+    """
+    env = dict(os.environ)
+    # Le démarrage ne doit dépendre ni de la clé API ni d'un affichage
+    env.pop("ANTHROPIC_API_KEY", None)
+    env.pop("DISPLAY", None)
+    env["PYTHONPATH"] = project_dir + os.pathsep + env.get("PYTHONPATH", "")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", CHILD_SCRIPT], cwd=project_dir, env=env,
+                               capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"Échec du démarrage :\n{completed.stderr}")
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    timings["process"] = elapsed
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark du démarrage à froid de main.py")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET,
+                        help="Temps maximal jusqu'à la première capture, en secondes")
+    parser.add_argument("--runs", type=int, default=5, help="Nombre de démarrages mesurés")
+    args = parser.parse_args(argv)
+
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    runs = [measure_once(project_dir) for _ in range(args.runs)]
+    # La médiane limite l'effet du cache disque sur le premier démarrage
+    median = sorted(run["capture_ready"] for run in runs)[len(runs) // 2]
+
+    for key in ("import", "orchestrator", "capture_ready", "process"):
+        values = sorted(run[key] for run in runs)
+        print(f"{key:<14} médiane {values[len(values) // 2] * 1000:7.1f} ms, max {values[-1] * 1000:7.1f} ms")
+
+    if median > args.budget:
+        print(f"ÉCHEC : démarrage jusqu'à la première capture en {median:.3f}s (budget {args.budget:.3f}s)")
+        return 1
+    print(f"OK : démarrage jusqu'à la première capture en {median:.3f}s (budget {args.budget:.3f}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
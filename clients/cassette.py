@@ -0,0 +1,250 @@
+"""
+Module d'enregistrement et de rejeu des appels au modèle
+
+Chaque appel est identifié par une empreinte de la requête (modèle,
+paramètres, textes des messages) ; les images y figurent par leur hash
+perceptuel, si bien qu'une capture identique au bruit de quelques pixels
+près retrouve la réponse enregistrée. Les interactions sont ajoutées à une
+cassette JSONL.
+
+Modes :
+- `record` : appelle le modèle et enregistre chaque interaction (cassette réinitialisée)
+- `replay-strict` : rejoue les réponses enregistrées, une requête inconnue est une erreur
+- `replay-or-record` : rejoue si possible, sinon appelle le modèle et enregistre
+"""
+import io
+import os
+import json
+import base64
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from PIL import Image
+from utils.analysis_cache import perceptual_hash, hamming_distance
+from utils.config_loader import ConfigLoader
+
+MODES = ("off", "record", "replay-strict", "replay-or-record")
+
+
+class CassetteMissError(LookupError):
+    """Requête absente de la cassette en mode replay-strict"""
+
+
+def _decode_image(data: str) -> Optional[Image.Image]:
+    try:
+        return Image.open(io.BytesIO(base64.b64decode(data)))
+    except Exception:
+        return None
+
+
+def _image_data(block: Dict[str, Any]) -> Optional[str]:
+    """Retourne les données base64 d'un bloc image (format LangChain ou Anthropic)"""
+    if block.get("type") == "image_url":
+        url = block["image_url"]["url"] if isinstance(block.get("image_url"), dict) else block.get("image_url")
+        if isinstance(url, str) and url.startswith("data:") and "," in url:
+            return url.split(",", 1)[1]
+    elif block.get("type") == "image":
+        source = block.get("source") or {}
+        if source.get("type") == "base64":
+            return source.get("data")
+    return None
+
+
+def fingerprint(messages: List[Any], params: Dict[str, Any], hash_size: int = 16) -> Tuple[str, List[str]]:
+    """
+    Calcule l'empreinte d'une requête
+
+    Args:
+        messages (list): Les messages LangChain envoyés au modèle
+        params (dict): Paramètres de l'appel (modèle, température, arrêts…)
+        hash_size (int): Taille du hash perceptuel des images
+
+    Returns:
+        tuple: (clé de la partie texte, hashs perceptuels des images)
+    """
+    normalized, images = [], []
+    for message in messages:
+        content = message.content
+        if isinstance(content, list):
+            parts = []
+            for block in content:
+                if isinstance(block, dict) and block.get("type") in ("image_url", "image"):
+                    data = _image_data(block)
+                    image = _decode_image(data) if data else None
+                    if image is not None:
+                        images.append(perceptual_hash(image, hash_size))
+                    else:
+                        images.append(hashlib.sha256(json.dumps(block, sort_keys=True).encode("utf-8")).hexdigest())
+                    parts.append({"type": "image"})
+                else:
+                    parts.append(block)
+            content = parts
+        normalized.append({"role": message.type, "content": content})
+    payload = json.dumps({"params": params, "messages": normalized}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest(), images
+
+
+def _serialize_result(result) -> List[Dict[str, Any]]:
+    generations = []
+    for generation in result.generations:
+        message = generation.message
+        generations.append(json.loads(json.dumps({
+            "content": message.content,
+            "usage_metadata": getattr(message, "usage_metadata", None),
+            "response_metadata": getattr(message, "response_metadata", None) or {},
+        }, default=str)))
+    return generations
+
+
+def _deserialize_result(generations: List[Dict[str, Any]]):
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+
+    return ChatResult(generations=[
+        ChatGeneration(message=AIMessage(
+            content=generation["content"],
+            usage_metadata=generation.get("usage_metadata"),
+            response_metadata=generation.get("response_metadata") or {},
+        ))
+        for generation in generations
+    ])
+
+
+class Cassette:
+    """
+    Cassette d'interactions avec le modèle
+    """
+
+    def __init__(self, path: str, mode: str = "replay-or-record", max_distance: int = 4, hash_size: int = 16):
+        if mode not in MODES:
+            raise ValueError(f"Mode de cassette inconnu : {mode} (modes : {', '.join(MODES)})")
+        self.path = path
+        self.mode = mode
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._replayed: Dict[Tuple[str, int], int] = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if mode == "record":
+            open(path, "w", encoding="utf-8").close()
+        else:
+            self._load()
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode in ("replay-strict", "replay-or-record")
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Dernière ligne tronquée par une interruption
+                    continue
+                self._entries.setdefault(entry["key"], []).append(entry)
+
+    def _match(self, key: str, images: List[str]) -> Optional[Tuple[int, List[Dict[str, Any]]]]:
+        """Retourne l'index de la requête correspondante et les réponses enregistrées pour elle"""
+        candidates = self._entries.get(key) or []
+        best, best_distance = None, None
+        for index, entry in enumerate(candidates):
+            recorded = entry["images"]
+            if len(recorded) != len(images):
+                continue
+            distance = sum(hamming_distance(a, b) for a, b in zip(recorded, images))
+            if distance <= self.max_distance * max(1, len(images)) and (best is None or distance < best_distance):
+                best, best_distance = index, distance
+        if best is None:
+            return None
+        # Les requêtes répétées rejouent leurs réponses dans l'ordre d'enregistrement
+        reference = candidates[best]["images"]
+        same = [entry for entry in candidates if entry["images"] == reference]
+        return best, same
+
+    def lookup(self, messages: List[Any], params: Dict[str, Any]):
+        """
+        Retourne la réponse enregistrée d'une requête (ChatResult), ou None
+
+        Raises:
+            CassetteMissError: En mode replay-strict, si la requête est inconnue
+        """
+        key, images = fingerprint(messages, params, self.hash_size)
+        with self._lock:
+            match = self._match(key, images) if self.replaying else None
+            if match is None:
+                self.misses += 1
+                if self.mode == "replay-strict":
+                    raise CassetteMissError(f"Requête absente de la cassette {self.path} (empreinte {key[:12]})")
+                return None
+            index, entries = match
+            position = self._replayed.get((key, index), 0)
+            self._replayed[(key, index)] = position + 1
+            self.hits += 1
+            entry = entries[min(position, len(entries) - 1)]
+        return _deserialize_result(entry["generations"])
+
+    def record(self, messages: List[Any], params: Dict[str, Any], result) -> None:
+        """Ajoute une interaction à la cassette"""
+        key, images = fingerprint(messages, params, self.hash_size)
+        entry = {"key": key, "images": images, "params": params, "generations": _serialize_result(result)}
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._entries.setdefault(key, []).append(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        """Retourne le mode, le nombre d'interactions et les succès/échecs de rejeu"""
+        with self._lock:
+            count = sum(len(entries) for entries in self._entries.values())
+        return {"mode": self.mode, "path": self.path, "interactions": count, "hits": self.hits, "misses": self.misses}
+
+
+_cassette = None
+_cassette_loaded = False
+_cassette_lock = threading.Lock()
+
+
+def set_cassette(mode: Optional[str], path: Optional[str] = None) -> Optional[Cassette]:
+    """
+    Active (ou désactive avec mode=None ou "off") l'enregistrement/rejeu des appels
+
+    Args:
+        mode (str): record, replay-strict ou replay-or-record
+        path (str): Chemin de la cassette, celui de la configuration si non spécifié
+
+    Returns:
+        Cassette: La cassette active, ou None
+    """
+    global _cassette, _cassette_loaded
+    with _cassette_lock:
+        _cassette_loaded = True
+        if not mode or mode == "off":
+            _cassette = None
+            return None
+        config = ConfigLoader()
+        settings = config.get_section("cassette")
+        _cassette = Cassette(
+            path or settings.get("path") or os.path.join(config.get_cassettes_dir(), "default.jsonl"),
+            mode=mode,
+            max_distance=settings.get("max_distance", 4),
+            hash_size=settings.get("hash_size", 16),
+        )
+        return _cassette
+
+
+def get_cassette() -> Optional[Cassette]:
+    """Retourne la cassette active, configurée par la section `cassette` au premier appel"""
+    if not _cassette_loaded:
+        settings = ConfigLoader().get_section("cassette")
+        return set_cassette(settings.get("mode", "off"))
+    return _cassette
@@ -1,33 +1,697 @@
 """
 Module pour l'intégration de LangChain avec Anthropic
+
+Tous les appels au modèle passent par un contrôleur partagé qui réutilise
+les connexions HTTP, limite le nombre d'appels simultanés, applique un
+débit maximal (requêtes et tokens par minute), réessaie les erreurs
+transitoires (429, 5xx) avec un backoff exponentiel aléatoire et mesure
+la latence et les tokens de chaque appel.
 """
 import os
-from typing import Dict, Any
-from langchain_anthropic import ChatAnthropic
+import time
+import random
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, TYPE_CHECKING
 from utils.config_loader import ConfigLoader
+from utils.tracing import span, current_span
+
+if TYPE_CHECKING:
+    from langchain_anthropic import ChatAnthropic
 
 # Initialisation de la configuration
 config = ConfigLoader()
 
-def get_chat_model(temperature: float = 0.7, max_tokens_to_sample: int = 1000) -> ChatAnthropic:
+DEFAULT_MODEL = "claude-3-sonnet-20240229"
+
+# Statuts HTTP considérés comme transitoires
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+# Estimation forfaitaire des tokens d'une image, avant que l'API ne donne l'usage réel
+IMAGE_TOKEN_ESTIMATE = 1600
+
+# Intervalle entre deux tentatives de prise du sémaphore par un appel asynchrone (s)
+SEMAPHORE_POLL_INTERVAL = 0.005
+
+# Modèles compatibles avec le cache de prompt (par préfixe de nom) et taille
+# minimale, en tokens, d'un préfixe mis en cache ; en deçà, le fournisseur
+# ignore le marqueur. claude-3-sonnet n'est pas compatible.
+PROMPT_CACHE_MIN_TOKENS = {
+    "claude-3-haiku": 2048,
+    "claude-3-5-haiku": 2048,
+    "claude-3-opus": 1024,
+    "claude-3-5-sonnet": 1024,
+    "claude-3-7-sonnet": 1024,
+    "claude-sonnet-4": 1024,
+    "claude-opus-4": 1024,
+}
+
+
+class TokenBucket:
+    """
+    Seau à jetons : `rate` jetons par seconde, au plus `capacity` en réserve.
+    Le solde peut devenir négatif lorsqu'une consommation réelle dépasse
+    l'estimation ; les appels suivants attendent alors le remboursement.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Réserve `amount` jetons et retourne le délai à attendre avant de les utiliser
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def adjust(self, amount: float) -> None:
+        """Corrige le solde d'une différence entre consommation réelle et estimée"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class CallMetric:
+    """
+    Mesure d'un appel au modèle
+    """
+    __slots__ = ("model", "latency", "input_tokens", "output_tokens", "cache_read_tokens",
+                 "cache_creation_tokens", "attempts", "waited", "error")
+
+    def __init__(self, model: str):
+        self.model = model
+        self.latency = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_creation_tokens = 0
+        self.attempts = 0
+        self.waited = 0.0
+        self.error = None
+
+
+def _usage(result: Any) -> Dict[str, int]:
+    """
+    Retourne les tokens d'entrée et de sortie d'un ChatResult (ou d'un
+    fragment de flux), dont les tokens d'entrée lus et écrits dans le cache
+    de prompt du fournisseur
+    """
+    usage = {"input_tokens": 0, "output_tokens": 0, "cache_read_tokens": 0, "cache_creation_tokens": 0}
+    generations = getattr(result, "generations", None)
+    if generations is None and hasattr(result, "message"):
+        generations = (result,)
+    # LLMResult (callbacks) : une liste de générations par requête
+    generations = [item for entry in generations or () for item in (entry if isinstance(entry, list) else (entry,))]
+    for generation in generations:
+        metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+        usage["input_tokens"] += metadata.get("input_tokens", 0)
+        usage["output_tokens"] += metadata.get("output_tokens", 0)
+        details = metadata.get("input_token_details") or {}
+        usage["cache_read_tokens"] += details.get("cache_read") or 0
+        usage["cache_creation_tokens"] += details.get("cache_creation") or 0
+    return usage
+
+
+def usage_recorder():
+    """
+    Retourne un gestionnaire de callbacks LangChain qui relève l'usage réel
+    de chaque appel au modèle (tokens d'entrée et de sortie, lus et écrits
+    dans le cache de prompt) dans sa liste `calls`
+    """
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class UsageRecorder(BaseCallbackHandler):
+        def __init__(self):
+            self.calls: List[Dict[str, int]] = []
+
+        def on_llm_end(self, response, **kwargs):
+            self.calls.append(_usage(response))
+
+    return UsageRecorder()
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile * (len(values) - 1))))]
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # Erreurs réseau et délais dépassés du SDK Anthropic ou de la bibliothèque standard
+    return (exc.__class__.__name__ in ("APIConnectionError", "APITimeoutError")
+            or isinstance(exc, (TimeoutError, ConnectionError)))
+
+
+def _is_timeout(exc: BaseException) -> bool:
+    """Indique si l'erreur est un délai dépassé (client ou serveur)"""
+    return (exc.__class__.__name__ == "APITimeoutError" or isinstance(exc, TimeoutError)
+            or _status_code(exc) in (408, 504))
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(messages: List[Any]) -> int:
+    """
+    Estime le nombre de tokens d'entrée d'une liste de messages (4 caractères par token)
+    """
+    characters, images = 0, 0
+    for message in messages:
+        content = getattr(message, "content", message)
+        if isinstance(content, str):
+            characters += len(content)
+            continue
+        for block in content or ():
+            if isinstance(block, dict) and block.get("type") in ("image", "image_url"):
+                images += 1
+            elif isinstance(block, dict):
+                characters += len(str(block.get("text", "")))
+            else:
+                characters += len(str(block))
+    return characters // 4 + images * IMAGE_TOKEN_ESTIMATE
+
+
+def prompt_cache_min_tokens(model: str) -> Optional[int]:
+    """Taille minimale (tokens) d'un préfixe mis en cache pour un modèle, None s'il n'a pas de cache de prompt"""
+    matches = [prefix for prefix in PROMPT_CACHE_MIN_TOKENS if model.startswith(prefix)]
+    return PROMPT_CACHE_MIN_TOKENS[max(matches, key=len)] if matches else None
+
+
+def cacheable_prefixes(messages: List[Any], model: str) -> List[Any]:
+    """
+    Retire des messages les marqueurs `cache_control` sans effet pour le
+    modèle : tous s'il n'a pas de cache de prompt, sinon ceux dont le
+    préfixe (le contenu qui précède, marqueur compris) est plus court que
+    le minimum ; une écriture dans le cache n'est ainsi facturée que si
+    elle peut être relue
+    """
+    minimum = prompt_cache_min_tokens(model)
+    cleaned, characters = [], 0
+    for message in messages:
+        content = getattr(message, "content", None)
+        if isinstance(content, str) or not content:
+            characters += len(content or "")
+            cleaned.append(message)
+            continue
+        blocks, changed = [], False
+        for block in content:
+            if isinstance(block, dict):
+                characters += len(str(block.get("text", "")))
+                if block.get("cache_control") and (minimum is None or characters // 4 < minimum):
+                    block = {key: value for key, value in block.items() if key != "cache_control"}
+                    changed = True
+            blocks.append(block)
+        cleaned.append(message.model_copy(update={"content": blocks}) if changed else message)
+    return cleaned
+
+
+class ClientController:
+    """
+    Contrôle partagé des appels : concurrence, débit, reprises et métriques
+    """
+
+    def __init__(self, max_concurrency: int = 4, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, max_retries: int = 5,
+                 backoff_base: float = 1.0, backoff_max: float = 30.0, max_metrics: int = 10000):
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.request_bucket = TokenBucket(requests_per_minute / 60.0, max(1.0, requests_per_minute / 60.0 * 5)) \
+            if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_metrics = max_metrics
+        self.metrics: List[CallMetric] = []
+        self._metrics_lock = threading.Lock()
+
+    def _admission_delay(self, estimated_tokens: int) -> float:
+        delay = 0.0
+        if self.request_bucket:
+            delay = max(delay, self.request_bucket.reserve(1))
+        if self.token_bucket:
+            delay = max(delay, self.token_bucket.reserve(estimated_tokens))
+        return delay
+
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            return min(self.backoff_max, retry_after)
+        # Backoff exponentiel avec gigue complète
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _record(self, metric: CallMetric, estimated_tokens: int) -> None:
+        if self.token_bucket and metric.input_tokens:
+            self.token_bucket.adjust(metric.input_tokens + metric.output_tokens - estimated_tokens)
+        with self._metrics_lock:
+            self.metrics.append(metric)
+            if len(self.metrics) > self.max_metrics:
+                del self.metrics[:len(self.metrics) - self.max_metrics]
+
+    @staticmethod
+    def _fill_usage(metric: CallMetric, result: Any) -> None:
+        usage = _usage(result)
+        metric.input_tokens += usage["input_tokens"]
+        metric.output_tokens += usage["output_tokens"]
+        metric.cache_read_tokens += usage["cache_read_tokens"]
+        metric.cache_creation_tokens += usage["cache_creation_tokens"]
+
+    def _retryable(self, exc: BaseException, attempt: int, retry_timeouts: bool) -> bool:
+        if attempt >= self.max_retries or not _is_retryable(exc):
+            return False
+        return retry_timeouts or not _is_timeout(exc)
+
+    def call(self, fn: Callable[[], Any], model: str, estimated_tokens: int, retry_timeouts: bool = True) -> Any:
+        """
+        Exécute un appel synchrone sous contrôle de concurrence, de débit et de reprise
+
+        Sans `retry_timeouts`, un délai dépassé n'est pas réessayé (l'appelant
+        bascule sur un autre modèle).
+        """
+        metric = CallMetric(model)
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                metric.attempts += 1
+                delay = self._admission_delay(estimated_tokens)
+                if delay:
+                    metric.waited += delay
+                    time.sleep(delay)
+                with self.semaphore:
+                    try:
+                        result = fn()
+                        self._fill_usage(metric, result)
+                        return result
+                    except Exception as e:
+                        if not self._retryable(e, attempt, retry_timeouts):
+                            metric.error = f"{type(e).__name__}: {str(e)}"
+                            raise
+                        backoff = self._backoff(attempt, e)
+                        reason = _status_code(e) or type(e).__name__
+                print(f"Appel au modèle en échec ({reason}), "
+                      f"nouvelle tentative dans {backoff:.1f}s")
+                metric.waited += backoff
+                time.sleep(backoff)
+        finally:
+            metric.latency = time.perf_counter() - start
+            current_span().set(attempts=metric.attempts, waited=metric.waited)
+            self._record(metric, estimated_tokens)
+
+    async def _acquire(self) -> None:
+        """
+        Prend une place du sémaphore, partagé avec les appels synchrones des
+        autres threads, sans bloquer la boucle : tentative non bloquante,
+        répétée jusqu'à ce qu'une place se libère. Une tâche annulée pendant
+        l'attente ne prend aucune place (aucun thread ne reste en attente du
+        sémaphore pour elle)
+        """
+        while not self.semaphore.acquire(blocking=False):
+            await asyncio.sleep(SEMAPHORE_POLL_INTERVAL)
+
+    async def acall(self, fn: Callable[[], Any], model: str, estimated_tokens: int,
+                    retry_timeouts: bool = True) -> Any:
+        """
+        Version asynchrone de call : `fn` retourne une coroutine
+        """
+        metric = CallMetric(model)
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                metric.attempts += 1
+                delay = self._admission_delay(estimated_tokens)
+                if delay:
+                    metric.waited += delay
+                    await asyncio.sleep(delay)
+                await self._acquire()
+                try:
+                    result = await fn()
+                    self._fill_usage(metric, result)
+                    return result
+                except Exception as e:
+                    if not self._retryable(e, attempt, retry_timeouts):
+                        metric.error = f"{type(e).__name__}: {str(e)}"
+                        raise
+                    backoff = self._backoff(attempt, e)
+                    reason = _status_code(e) or type(e).__name__
+                finally:
+                    self.semaphore.release()
+                print(f"Appel au modèle en échec ({reason}), "
+                      f"nouvelle tentative dans {backoff:.1f}s")
+                metric.waited += backoff
+                await asyncio.sleep(backoff)
+        finally:
+            metric.latency = time.perf_counter() - start
+            current_span().set(attempts=metric.attempts, waited=metric.waited)
+            self._record(metric, estimated_tokens)
+
+    def stream(self, fn: Callable[[], Iterator[Any]], model: str, estimated_tokens: int,
+               retry_timeouts: bool = True) -> Iterator[Any]:
+        """
+        Version en flux de call : `fn` retourne un itérateur de fragments,
+        transmis au fur et à mesure ; une erreur n'est réessayée que si
+        aucun fragment n'a encore été transmis
+        """
+        metric = CallMetric(model)
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                metric.attempts += 1
+                delay = self._admission_delay(estimated_tokens)
+                if delay:
+                    metric.waited += delay
+                    time.sleep(delay)
+                received = False
+                with self.semaphore:
+                    try:
+                        for chunk in fn():
+                            received = True
+                            self._fill_usage(metric, chunk)
+                            yield chunk
+                        return
+                    except Exception as e:
+                        if received or not self._retryable(e, attempt, retry_timeouts):
+                            metric.error = f"{type(e).__name__}: {str(e)}"
+                            raise
+                        backoff = self._backoff(attempt, e)
+                        reason = _status_code(e) or type(e).__name__
+                print(f"Appel au modèle en échec ({reason}), "
+                      f"nouvelle tentative dans {backoff:.1f}s")
+                metric.waited += backoff
+                time.sleep(backoff)
+        finally:
+            metric.latency = time.perf_counter() - start
+            current_span().set(attempts=metric.attempts, waited=metric.waited)
+            self._record(metric, estimated_tokens)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Retourne les métriques agrégées par modèle : appels, erreurs, reprises,
+        latence p50/p95 et tokens (dont ceux lus et écrits dans le cache de prompt)
+        """
+        with self._metrics_lock:
+            metrics = list(self.metrics)
+        by_model: Dict[str, List[CallMetric]] = {}
+        for metric in metrics:
+            by_model.setdefault(metric.model, []).append(metric)
+        summary = {}
+        for model, entries in by_model.items():
+            latencies = [m.latency for m in entries]
+            summary[model] = {
+                "calls": len(entries),
+                "errors": sum(1 for m in entries if m.error),
+                "retries": sum(m.attempts - 1 for m in entries),
+                "latency_p50": _percentile(latencies, 0.5),
+                "latency_p95": _percentile(latencies, 0.95),
+                "waited": sum(m.waited for m in entries),
+                "input_tokens": sum(m.input_tokens for m in entries),
+                "output_tokens": sum(m.output_tokens for m in entries),
+                "cache_read_tokens": sum(m.cache_read_tokens for m in entries),
+                "cache_creation_tokens": sum(m.cache_creation_tokens for m in entries),
+            }
+        return summary
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_llm_settings() -> Dict[str, Any]:
+    """Retourne la section `llm` de la configuration"""
+    return config.get_section("llm")
+
+
+def get_controller() -> ClientController:
+    """Retourne le contrôleur partagé, configuré par la section `llm`"""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            settings = get_llm_settings()
+            _controller = ClientController(
+                max_concurrency=settings.get("max_concurrency", 4),
+                requests_per_minute=settings.get("requests_per_minute"),
+                tokens_per_minute=settings.get("tokens_per_minute"),
+                max_retries=settings.get("max_retries", 5),
+                backoff_base=settings.get("backoff_base", 1.0),
+                backoff_max=settings.get("backoff_max", 30.0),
+            )
+        return _controller
+
+
+def get_client_metrics() -> Dict[str, Dict[str, float]]:
+    """Retourne les métriques agrégées des appels au modèle"""
+    return get_controller().summary()
+
+
+# Clients HTTP Anthropic partagés, par paramètres de connexion
+_http_clients: Dict[tuple, Any] = {}
+_http_clients_lock = threading.Lock()
+
+
+def _shared_http_client(kind: str, params: Dict[str, Any]) -> Any:
+    import anthropic
+
+    key = (kind, params.get("api_key"), params.get("base_url"), params.get("timeout"),
+           tuple(sorted((params.get("default_headers") or {}).items())))
+    with _http_clients_lock:
+        if key not in _http_clients:
+            client_class = anthropic.AsyncClient if kind == "async" else anthropic.Client
+            _http_clients[key] = client_class(**params)
+        return _http_clients[key]
+
+
+def _get_cassette():
+    from clients.cassette import get_cassette
+
+    return get_cassette()
+
+
+def require_api_key() -> None:
+    """
+    Vérifie que la clé API est présente, sauf en rejeu strict d'une cassette
+    où aucun appel réel n'est effectué
+    """
+    if "ANTHROPIC_API_KEY" in os.environ or _model_override is not None:
+        return
+    cassette = _get_cassette()
+    if cassette is not None and cassette.mode == "replay-strict":
+        return
+    raise ValueError("La clé API Anthropic n'est pas définie. Utilisez: export ANTHROPIC_API_KEY=votre-clé")
+
+
+def _managed_model_class():
+    """
+    Construit (une seule fois) la sous-classe de ChatAnthropic dont les
+    appels passent par le contrôleur partagé
+    """
+    global _ManagedChatAnthropic
+    if _ManagedChatAnthropic is not None:
+        return _ManagedChatAnthropic
+
+    from langchain_anthropic import ChatAnthropic
+
+    class ManagedChatAnthropic(ChatAnthropic):
+        """ChatAnthropic avec connexions partagées, débit limité, reprises et métriques"""
+
+        # Réessayer les délais dépassés (sans objet quand le routage bascule sur un autre modèle)
+        retry_timeouts: bool = True
+
+        @property
+        def _client(self):
+            return _shared_http_client("sync", self._client_params)
+
+        @property
+        def _async_client(self):
+            return _shared_http_client("async", self._client_params)
+
+        def _cassette_params(self, stop):
+            return {"model": self.model, "temperature": self.temperature,
+                    "max_tokens": self.max_tokens, "stop": stop}
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            messages = cacheable_prefixes(messages, self.model)
+            with span("llm.call", model=self.model) as call_span:
+                cassette = _get_cassette()
+                if cassette is not None:
+                    result = cassette.lookup(messages, self._cassette_params(stop))
+                    if result is not None:
+                        call_span.set(replayed=True, **_usage(result))
+                        return result
+                generate = super(ManagedChatAnthropic, self)._generate
+                result = get_controller().call(
+                    lambda: generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+                    self.model, estimate_tokens(messages) + self.max_tokens, self.retry_timeouts)
+                call_span.set(**_usage(result))
+                if cassette is not None:
+                    cassette.record(messages, self._cassette_params(stop), result)
+                return result
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            messages = cacheable_prefixes(messages, self.model)
+            with span("llm.call", model=self.model) as call_span:
+                cassette = _get_cassette()
+                if cassette is not None:
+                    result = cassette.lookup(messages, self._cassette_params(stop))
+                    if result is not None:
+                        call_span.set(replayed=True, **_usage(result))
+                        return result
+                agenerate = super(ManagedChatAnthropic, self)._agenerate
+                result = await get_controller().acall(
+                    lambda: agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+                    self.model, estimate_tokens(messages) + self.max_tokens, self.retry_timeouts)
+                call_span.set(**_usage(result))
+                if cassette is not None:
+                    cassette.record(messages, self._cassette_params(stop), result)
+                return result
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            from langchain_core.messages import AIMessageChunk
+            from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+            messages = cacheable_prefixes(messages, self.model)
+            with span("llm.call", model=self.model, streaming=True) as call_span:
+                cassette = _get_cassette()
+                if cassette is not None:
+                    result = cassette.lookup(messages, self._cassette_params(stop))
+                    if result is not None:
+                        # Réponse rejouée : un seul fragment
+                        call_span.set(replayed=True, **_usage(result))
+                        message = result.generations[0].message
+                        yield ChatGenerationChunk(message=AIMessageChunk(
+                            content=message.content, usage_metadata=message.usage_metadata))
+                        return
+                stream = super(ManagedChatAnthropic, self)._stream
+                merged = None
+                for chunk in get_controller().stream(
+                        lambda: stream(messages, stop=stop, run_manager=run_manager, **kwargs),
+                        self.model, estimate_tokens(messages) + self.max_tokens, self.retry_timeouts):
+                    merged = chunk if merged is None else merged + chunk
+                    yield chunk
+                if merged is None:
+                    return
+                result = ChatResult(generations=[ChatGeneration(message=merged.message)])
+                call_span.set(**_usage(result))
+                if cassette is not None:
+                    cassette.record(messages, self._cassette_params(stop), result)
+
+    _ManagedChatAnthropic = ManagedChatAnthropic
+    return ManagedChatAnthropic
+
+
+_ManagedChatAnthropic = None
+
+# Modèles déjà construits, par paramètres
+_models: Dict[tuple, Any] = {}
+_models_lock = threading.Lock()
+
+# Modèle de substitution renvoyé par get_chat_model (benchmarks hors ligne)
+_model_override = None
+
+
+def set_chat_model(model: Any) -> Any:
+    """
+    Remplace le modèle renvoyé par get_chat_model, quels que soient ses
+    paramètres ; None rétablit le modèle Anthropic
+
+    Returns:
+        Le modèle de substitution précédent
+    """
+    global _model_override
+    previous, _model_override = _model_override, model
+    return previous
+
+def get_chat_model(temperature: float = 0.7, max_tokens_to_sample: int = 1000,
+                   streaming: bool = False, task: Optional[str] = None) -> "ChatAnthropic":
     """
     Obtient un modèle de chat Anthropic via LangChain
-    
+
+    Le modèle est construit au premier appel puis réutilisé pour les mêmes
+    paramètres ; son nom, son délai maximal et l'URL de l'API (pour un
+    serveur local de substitution) viennent de la section `llm` de config.yaml.
+    Avec le routage (section `routing`), le type d'appel `task` choisit le
+    niveau de modèle (clients.model_router).
+
     Args:
         temperature (float): Température pour la génération de texte
         max_tokens_to_sample (int): Nombre maximum de tokens à générer
-        
+        streaming (bool): Modèle dont la méthode stream transmet la réponse
+            au fil de sa génération (sinon stream passe par _generate)
+        task (str): Type d'appel : "vision" (analyse d'une capture), "agent"
+            (itérations ReAct, planification ou simple étape d'outil),
+            "planning" ou "tool"
+
     Returns:
         ChatAnthropic: Le modèle de chat Anthropic
     """
+    if _model_override is not None:
+        return _model_override
+
     # Vérifier que la clé API est présente
-    if "ANTHROPIC_API_KEY" not in os.environ:
-        raise ValueError("La clé API Anthropic n'est pas définie. Utilisez: export ANTHROPIC_API_KEY=votre-clé")
-    
-    return ChatAnthropic(
-        model_name="claude-3-sonnet-20240229",
-        temperature=temperature,
-        max_tokens_to_sample=max_tokens_to_sample,
-        timeout=60,
-        stop=None
-    )
\ No newline at end of file
+    require_api_key()
+
+    if task is not None:
+        from clients import model_router
+
+        if model_router.is_enabled():
+            return model_router.get_routed_model(task, temperature, max_tokens_to_sample, streaming)
+
+    settings = get_llm_settings()
+    return build_chat_model(settings.get("model", DEFAULT_MODEL), temperature, max_tokens_to_sample, streaming,
+                            base_url=settings.get("base_url"), timeout=settings.get("timeout", 60))
+
+
+def build_chat_model(model_name: str, temperature: float, max_tokens_to_sample: int, streaming: bool = False,
+                     base_url: Optional[str] = None, timeout: float = 60,
+                     retry_timeouts: bool = True) -> "ChatAnthropic":
+    """Construit (une seule fois par paramètres) un modèle dont les appels passent par le contrôleur partagé"""
+    key = (model_name, temperature, max_tokens_to_sample, streaming, base_url, timeout, retry_timeouts)
+    with _models_lock:
+        if key not in _models:
+            model_class = _managed_model_class()
+            params = {}
+            if base_url:
+                params["base_url"] = base_url
+            if "ANTHROPIC_API_KEY" not in os.environ:
+                # Rejeu strict : le client n'est jamais utilisé
+                params["api_key"] = "replay"
+            _models[key] = model_class(
+                model_name=model_name,
+                temperature=temperature,
+                max_tokens_to_sample=max_tokens_to_sample,
+                timeout=timeout,
+                # Les reprises sont gérées par le contrôleur partagé
+                max_retries=0,
+                retry_timeouts=retry_timeouts,
+                # Les appels en streaming (agent ReAct) passent aussi par _generate,
+                # sauf pour le modèle demandé en flux (analyse en streaming)
+                disable_streaming=not streaming,
+                stop=None,
+                **params
+            )
+        return _models[key]
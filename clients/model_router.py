@@ -0,0 +1,413 @@
+"""
+Module de routage des appels entre niveaux de modèles
+
+Chaque type d'appel est dirigé vers un niveau de modèle (section
+`routing` de config.yaml) : l'analyse des captures et la planification de
+l'agent (tout choix d'une nouvelle action, dont la reprise après une
+erreur) vers le grand modèle, les itérations ReAct qui n'ont plus qu'à
+conclure après un plan exécuté vers un modèle plus petit et plus rapide,
+à température nulle. La latence de chaque niveau
+est suivie sur une fenêtre glissante (p50/p95). Un délai dépassé (ou une
+erreur transitoire persistante) bascule l'appel sur le niveau de secours
+et écarte le niveau fautif pendant un temps de récupération. Le rapport
+compare le coût et la latence obtenus à ceux du niveau de référence.
+"""
+import time
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional
+from utils.config_loader import ConfigLoader
+from utils.tracing import span
+
+# Niveaux par défaut : prix en dollars par million de tokens
+DEFAULT_TIERS = {
+    "large": {"model": "claude-3-sonnet-20240229", "input_cost": 3.0, "output_cost": 15.0},
+    "small": {"model": "claude-3-haiku-20240307", "temperature": 0.0, "input_cost": 0.25, "output_cost": 1.25},
+}
+DEFAULT_ROUTES = {"vision": "large", "planning": "large", "tool": "small"}
+DEFAULT_FALLBACKS = {"large": "small", "small": "large"}
+# Observations après lesquelles l'itération suivante n'a plus qu'à conclure
+DEFAULT_TOOL_AFTER = ("Plan exécuté",)
+
+
+def get_routing_settings() -> Dict:
+    """Retourne la section `routing` de la configuration"""
+    return ConfigLoader().get_section("routing")
+
+
+def is_enabled() -> bool:
+    """Indique si les appels sont routés entre niveaux de modèles"""
+    return get_routing_settings().get("enabled", False)
+
+
+def _message_text(message: Any) -> str:
+    content = getattr(message, "content", message)
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content or ())
+
+
+def _has_image(messages: List[Any]) -> bool:
+    for message in messages:
+        content = getattr(message, "content", None)
+        if isinstance(content, list) and any(
+                isinstance(block, dict) and block.get("type") in ("image", "image_url") for block in content):
+            return True
+    return False
+
+
+def classify(messages: List[Any], tool_after=DEFAULT_TOOL_AFTER) -> str:
+    """
+    Type d'un appel, selon ce qu'il doit produire : "vision" s'il contient
+    une image ; "tool" pour une itération ReAct dont la dernière
+    observation (dans le scratchpad, après la question) commence par l'un
+    des préfixes `tool_after` (plan exécuté : il ne reste qu'à conclure) ;
+    "planning" sinon, en particulier pour la première itération, le choix
+    d'une nouvelle action et toute reprise après une observation en erreur
+    """
+    if _has_image(messages):
+        return "vision"
+    text = _message_text(messages[-1]) if messages else ""
+    scratchpad = text.rsplit("Question:", 1)[-1]
+    if "\nObservation:" not in scratchpad:
+        return "planning"
+    observation = scratchpad.rsplit("\nObservation:", 1)[1].strip()
+    if observation.startswith("Erreur"):
+        return "planning"
+    return "tool" if observation.startswith(tuple(tool_after)) else "planning"
+
+
+class TierStats:
+    """
+    Mesures d'un niveau : latences récentes, appels, échecs, tokens et coût
+    """
+
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+        self.baseline_cost = 0.0
+        self.unavailable_until = 0.0
+
+
+class ModelRouter:
+    """
+    Choix du niveau de modèle par type d'appel, bascule et mesures
+    """
+
+    def __init__(self, settings: Optional[Dict] = None):
+        settings = get_routing_settings() if settings is None else settings
+        self.tiers: Dict[str, Dict] = settings.get("tiers") or DEFAULT_TIERS
+        self.routes: Dict[str, str] = dict(DEFAULT_ROUTES, **(settings.get("routes") or {}))
+        self.fallbacks: Dict[str, str] = settings.get("fallbacks") or DEFAULT_FALLBACKS
+        self.tool_after = tuple(settings.get("tool_after") or DEFAULT_TOOL_AFTER)
+        self.baseline = settings.get("baseline") or self.routes["planning"]
+        self.cooldown = settings.get("cooldown", 30.0)
+        self.window = settings.get("window", 200)
+        self.stats = {tier: TierStats(self.window) for tier in self.tiers}
+        self.route_counts: Dict[str, Dict[str, int]] = {}
+        self.failovers = 0
+        self._lock = threading.Lock()
+        for tier in list(self.routes.values()) + list(self.fallbacks.values()) + [self.baseline]:
+            if tier not in self.tiers:
+                raise ValueError(f"Niveau de modèle inconnu dans la section routing : {tier}")
+
+    def candidates(self, task: str) -> List[str]:
+        """
+        Niveaux à essayer pour un type d'appel, dans l'ordre : le niveau de
+        la route puis son secours ; un niveau en récupération après un délai
+        dépassé passe en dernier
+        """
+        tier = self.routes.get(task, self.baseline)
+        order = [tier]
+        fallback = self.fallbacks.get(tier)
+        if fallback and fallback != tier:
+            order.append(fallback)
+        now = time.monotonic()
+        with self._lock:
+            return sorted(order, key=lambda name: self.stats[name].unavailable_until > now)
+
+    def model_name(self, tier: str) -> str:
+        from clients.langchain_client import get_llm_settings, DEFAULT_MODEL
+
+        return self.tiers[tier].get("model") or get_llm_settings().get("model", DEFAULT_MODEL)
+
+    def model(self, tier: str, temperature: float, max_tokens: int, streaming: bool):
+        """
+        Retourne le modèle d'un niveau ; sa température et son plafond de
+        tokens, s'ils sont fixés, remplacent ceux de l'appel, et son URL et
+        son délai maximal ceux de la section `llm`
+        """
+        from clients.langchain_client import build_chat_model, get_llm_settings
+
+        settings = self.tiers[tier]
+        llm = get_llm_settings()
+        if settings.get("temperature") is not None:
+            temperature = settings["temperature"]
+        if settings.get("max_tokens"):
+            max_tokens = min(max_tokens, settings["max_tokens"])
+        return build_chat_model(
+            self.model_name(tier),
+            temperature,
+            max_tokens,
+            streaming,
+            base_url=settings.get("base_url") or llm.get("base_url"),
+            timeout=settings.get("timeout") or llm.get("timeout", 60),
+            # Un délai dépassé bascule sur le secours plutôt que d'être réessayé
+            retry_timeouts=not self.fallbacks.get(tier),
+        )
+
+    def _cost(self, tier: str, input_tokens: int, output_tokens: int) -> float:
+        settings = self.tiers[tier]
+        return (input_tokens * settings.get("input_cost", 0.0)
+                + output_tokens * settings.get("output_cost", 0.0)) / 1e6
+
+    def record(self, tier: str, task: str, latency: float, usage: Dict[str, int]) -> None:
+        """Enregistre un appel réussi sur un niveau"""
+        with self._lock:
+            stats = self.stats[tier]
+            stats.calls += 1
+            stats.latencies.append(latency)
+            stats.input_tokens += usage["input_tokens"]
+            stats.output_tokens += usage["output_tokens"]
+            stats.cost += self._cost(tier, usage["input_tokens"], usage["output_tokens"])
+            stats.baseline_cost += self._cost(self.baseline, usage["input_tokens"], usage["output_tokens"])
+            counts = self.route_counts.setdefault(task, {})
+            counts[tier] = counts.get(tier, 0) + 1
+
+    def record_failure(self, tier: str, timeout: bool, transient: bool) -> None:
+        """
+        Enregistre l'échec d'un appel ; après un délai dépassé ou une erreur
+        transitoire, le niveau est écarté pendant le temps de récupération
+        """
+        with self._lock:
+            stats = self.stats[tier]
+            stats.failures += 1
+            stats.timeouts += 1 if timeout else 0
+            if transient:
+                stats.unavailable_until = time.monotonic() + self.cooldown
+
+    def record_failover(self) -> None:
+        with self._lock:
+            self.failovers += 1
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Retourne, par niveau, les appels, échecs et latences p50/p95 récentes,
+        la répartition des appels par type et niveau, les bascules, ainsi que
+        le coût et la latence comparés à ceux du niveau de référence (mêmes
+        tokens à ses prix ; latences estimées par les p50 récents)
+        """
+        from clients.langchain_client import _percentile
+
+        with self._lock:
+            tiers = {}
+            for tier, stats in self.stats.items():
+                latencies = list(stats.latencies)
+                tiers[tier] = {
+                    "model": self.model_name(tier),
+                    "calls": stats.calls,
+                    "failures": stats.failures,
+                    "timeouts": stats.timeouts,
+                    "latency_p50": _percentile(latencies, 0.5),
+                    "latency_p95": _percentile(latencies, 0.95),
+                    "input_tokens": stats.input_tokens,
+                    "output_tokens": stats.output_tokens,
+                    "cost": stats.cost,
+                    "_baseline_cost": stats.baseline_cost,
+                }
+            routes = {task: dict(counts) for task, counts in self.route_counts.items()}
+            failovers = self.failovers
+
+        cost = sum(tier["cost"] for tier in tiers.values())
+        baseline_cost = sum(tier.pop("_baseline_cost") for tier in tiers.values())
+        calls = sum(tier["calls"] for tier in tiers.values())
+        latency = sum(tier["calls"] * tier["latency_p50"] for tier in tiers.values())
+        reference = tiers[self.baseline]
+        baseline_latency = calls * reference["latency_p50"] if reference["calls"] else None
+        return {
+            "tiers": tiers,
+            "routes": routes,
+            "failovers": failovers,
+            "baseline": self.baseline,
+            "cost": cost,
+            "baseline_cost": baseline_cost,
+            "cost_saving": 1.0 - cost / baseline_cost if baseline_cost else 0.0,
+            "latency": latency,
+            "baseline_latency": baseline_latency,
+            "latency_saving": 1.0 - latency / baseline_latency if baseline_latency else None,
+        }
+
+
+def _routed_model_class():
+    """
+    Construit (une seule fois) le modèle de chat LangChain qui route chaque
+    appel vers le niveau de son type
+    """
+    global _RoutedChatModel
+    if _RoutedChatModel is not None:
+        return _RoutedChatModel
+
+    from langchain_core.language_models import BaseChatModel
+    from clients.langchain_client import _is_retryable, _is_timeout, _status_code, _usage
+
+    def _failed(router, tier, task, error, remaining):
+        timeout, transient = _is_timeout(error), _is_retryable(error)
+        router.record_failure(tier, timeout, transient)
+        if not transient or not remaining:
+            return False
+        reason = "délai dépassé" if timeout else (_status_code(error) or type(error).__name__)
+        print(f"Routage : {tier} en échec pour {task} ({reason}), bascule sur {remaining[0]}")
+        router.record_failover()
+        return True
+
+    class RoutedChatModel(BaseChatModel):
+        """Modèle de chat dont chaque appel est dirigé vers le niveau de son type, avec bascule"""
+
+        task: str = "planning"
+        temperature: float = 0.7
+        max_tokens: int = 1000
+        streaming: bool = False
+
+        @property
+        def _llm_type(self) -> str:
+            return "routed"
+
+        def _route(self, messages):
+            router = get_router()
+            task = classify(messages, router.tool_after) if self.task == "agent" else self.task
+            return task, router.candidates(task)
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            router = get_router()
+            task, tiers = self._route(messages)
+            for index, tier in enumerate(tiers):
+                model = router.model(tier, self.temperature, self.max_tokens, self.streaming)
+                start = time.perf_counter()
+                try:
+                    with span("llm.route", task=task, tier=tier, model=model.model):
+                        result = model._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+                except Exception as e:
+                    if not _failed(router, tier, task, e, tiers[index + 1:]):
+                        raise
+                    continue
+                router.record(tier, task, time.perf_counter() - start, _usage(result))
+                return result
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            router = get_router()
+            task, tiers = self._route(messages)
+            for index, tier in enumerate(tiers):
+                model = router.model(tier, self.temperature, self.max_tokens, self.streaming)
+                start = time.perf_counter()
+                try:
+                    with span("llm.route", task=task, tier=tier, model=model.model):
+                        result = await model._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+                except Exception as e:
+                    if not _failed(router, tier, task, e, tiers[index + 1:]):
+                        raise
+                    continue
+                router.record(tier, task, time.perf_counter() - start, _usage(result))
+                return result
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            # La bascule n'est possible qu'avant le premier fragment
+            router = get_router()
+            task, tiers = self._route(messages)
+            for index, tier in enumerate(tiers):
+                model = router.model(tier, self.temperature, self.max_tokens, self.streaming)
+                start = time.perf_counter()
+                usage = {"input_tokens": 0, "output_tokens": 0}
+                received = False
+                try:
+                    with span("llm.route", task=task, tier=tier, model=model.model, streaming=True):
+                        for chunk in model._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                            received = True
+                            for name, value in _usage(chunk).items():
+                                if name in usage:
+                                    usage[name] += value
+                            yield chunk
+                except Exception as e:
+                    if received or not _failed(router, tier, task, e, tiers[index + 1:]):
+                        raise
+                    continue
+                router.record(tier, task, time.perf_counter() - start, usage)
+                return
+
+    _RoutedChatModel = RoutedChatModel
+    return RoutedChatModel
+
+
+_RoutedChatModel = None
+
+_router = None
+_router_lock = threading.Lock()
+
+# Modèles routés déjà construits, par paramètres
+_routed_models: Dict[tuple, Any] = {}
+
+
+def get_router() -> ModelRouter:
+    """Retourne le routeur partagé, configuré par la section `routing`"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
+
+
+def reset_router() -> None:
+    """Oublie le routeur et ses mesures (nouvelle configuration)"""
+    global _router
+    with _router_lock:
+        _router = None
+
+
+def get_routed_model(task: str, temperature: float = 0.7, max_tokens: int = 1000, streaming: bool = False):
+    """
+    Retourne le modèle routé d'un type d'appel ("vision", "planning",
+    "tool", ou "agent" pour classer chaque itération ReAct)
+    """
+    key = (task, temperature, max_tokens, streaming)
+    with _router_lock:
+        if key not in _routed_models:
+            _routed_models[key] = _routed_model_class()(
+                task=task, temperature=temperature, max_tokens=max_tokens, streaming=streaming,
+                # Comme les modèles Anthropic : stream passe par _generate, sauf pour un modèle en flux
+                disable_streaming=not streaming,
+            )
+        return _routed_models[key]
+
+
+def get_routing_report() -> Dict[str, Any]:
+    """Retourne le rapport du routage depuis le démarrage"""
+    return get_router().report()
+
+
+def print_routing_report() -> Optional[Dict[str, Any]]:
+    """
+    Affiche le rapport du routage (appels par type et niveau, latences,
+    bascules, coût et latence comparés au niveau de référence) si des
+    appels ont été routés ; retourne le rapport ou None
+    """
+    if not is_enabled() or _router is None:
+        return None
+    report = get_routing_report()
+    if not any(tier["calls"] or tier["failures"] for tier in report["tiers"].values()):
+        return None
+    print("Routage des appels au modèle :")
+    for tier, stats in report["tiers"].items():
+        print(f"  {tier} ({stats['model']}) : {stats['calls']} appel(s), {stats['failures']} échec(s), "
+              f"p50 {stats['latency_p50'] * 1000:.0f} ms, p95 {stats['latency_p95'] * 1000:.0f} ms, "
+              f"coût {stats['cost']:.5f} $")
+    print(f"  Répartition : {report['routes']}, bascules : {report['failovers']}")
+    print(f"  Coût {report['cost']:.5f} $ contre {report['baseline_cost']:.5f} $ tout sur {report['baseline']} "
+          f"(économie {report['cost_saving']:.0%})")
+    if report["latency_saving"] is not None:
+        print(f"  Latence estimée {report['latency']:.2f}s contre {report['baseline_latency']:.2f}s "
+              f"(économie {report['latency_saving']:.0%})")
+    return report
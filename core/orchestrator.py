@@ -1,71 +1,457 @@
 """
 Module d'orchestration
 """
-from agents.agent_ui_automation import process_ui_action
-from agents.agent_analyzer import analyze_screenshot
+import time
+import asyncio
+from contextlib import contextmanager
+from agents.agent_ui_automation import process_ui_action, ensure_calibration_loaded
+from agents.agent_analyzer import (
+    analyze_screenshot, acompute_analysis, save_analysis, locate_known_elements, stream_analysis,
+    get_streaming_settings, use_known_elements
+)
+from agents import fast_path, planner
+from clients.model_router import print_routing_report
+from utils import state_graph
 from utils.browser_utils import open_url
-from utils.screen_utils import take_screenshot
+from utils.screen_utils import capture_frame, flush_archive, start_run
 from utils.config_loader import ConfigLoader
+from utils.ui_elements import load_ui_elements
+from utils.analysis_cache import fingerprint, hamming_distance
+from utils.tracing import span, trace_run
+
+# Étapes du pipeline de run_many, dans l'ordre d'exécution d'un cas
+BATCH_STAGES = ("capture_wait", "capture", "analysis_wait", "analysis", "execute_wait", "reopen", "execute")
 
 class Orchestrator:
     def __init__(self):
         self.config = ConfigLoader()
         self.ui_description_path = self.config.get_ui_description_path()
+        # Chemin emprunté par chaque étape exécutée : (action, "graph" | "fast" | "agent"), ex. ("search", "fast")
+        self.step_paths = []
+        # Dernière capture en mémoire, transmise directement à l'analyse
+        self.last_capture = None
+        # État de l'écran analysé dans le graphe des états, et dernière étape exécutée depuis cet état
+        self.state = None
+        self.last_step = None
+        # Dernier run de run_steps : identifiant, durées par étape, résultats et erreur
+        self.run_id = None
+        self.timings = {}
+        self.outputs = []
+        self.error = None
+        # Les paramètres de calibration manuels s'appliquent dès la première analyse
+        ensure_calibration_loaded()
 
-    def open_browser(self):
-        """Ouvre le navigateur sur Google"""
-        if not open_url():
+    def open_browser(self, url=None):
+        """Ouvre le navigateur sur Google (ou sur l'URL indiquée)"""
+        if not open_url(url):
             raise Exception("Impossible d'ouvrir le navigateur sur Google")
 
-    def capture_screen(self):
-        """Capture l'écran actuel"""
-        screenshot_path = take_screenshot()
-        if screenshot_path is None:
+    def capture_frame(self):
+        """Capture l'écran actuel en mémoire (archivage disque en arrière-plan)"""
+        capture = capture_frame()
+        if capture is None:
             raise Exception("Impossible de prendre une capture d'écran")
-        return screenshot_path
+        self.last_capture = capture
+        return capture
+
+    def capture_screen(self):
+        """Capture l'écran actuel et retourne le chemin de son archive"""
+        capture = self.capture_frame()
+        flush_archive()
+        return capture.path
 
     def analyze_ui(self):
-        """Analyse l'interface et génère une description"""
-        if not analyze_screenshot():
+        """
+        Analyse l'interface et génère une description ; un écran déjà analysé
+        est retrouvé localement (graphe des états, puis vignettes des
+        éléments) sans appel au modèle
+
+        Returns:
+            AnalysisStream: L'analyse en cours en mode streaming (section
+                `streaming`), dont les éléments arrivent au fil de la réponse,
+                sinon None une fois l'analyse terminée
+        """
+        image = self.last_capture.image if self.last_capture else None
+        self.state = None
+        if image is not None and state_graph.is_enabled():
+            with span("state_graph.match") as match_span:
+                graph = state_graph.get_state_graph()
+                # Un écran presque uniforme (chargement) n'a pas d'empreinte : il n'entre pas dans le graphe
+                screen_key = graph.fingerprint(image)
+                self.state = graph.observe(screen_key) if screen_key else None
+                elements = self.state.element_store() if self.state else None
+                match_span.set(state=self.state.node_id if self.state else None, known=elements is not None)
+            if elements is not None:
+                use_known_elements(elements, image, source="graph")
+                return None
+        if image is not None and locate_known_elements(image):
+            return None
+        if image is not None and get_streaming_settings().get("enabled", False):
+            return stream_analysis(image)
+        if not analyze_screenshot(image=image):
             raise Exception("Erreur lors de l'analyse de l'interface")
+        return None
 
     def read_ui_description(self):
-        """Lit la description de l'interface"""
+        """
+        Lit la description de l'interface : la liste compacte des éléments
+        structurés si l'index existe, sinon l'analyse textuelle brute
+        """
+        elements = load_ui_elements()
+        if len(elements):
+            return elements.to_prompt_text()
         try:
             with open(self.ui_description_path, "r", encoding="utf-8") as f:
                 return f.read()
         except Exception as e:
             raise Exception(f"Erreur lors de la lecture de la description : {str(e)}")
 
-    def execute_search(self, search_query: str):
-        """Exécute une recherche Google"""
+    def execute_search(self, search_query: str, stream=None):
+        """
+        Exécute une consigne du workflow : l'intention reconnue par
+        fast_path.parse_intent (« cliquer sur Y », « remplir le champ Z avec
+        V », « rechercher X »), sinon une recherche Google du texte. Par rejeu
+        de la transition connue depuis l'écran courant (graphe des états),
+        sinon directement si l'élément visé est identifié dans l'analyse,
+        sinon via l'agent
+
+        Avec une analyse en flux (`stream`), le chemin rapide part dès que
+        l'élément visé est reçu ; l'agent attend l'analyse complète.
+        Après un rejeu en échec, l'écran a pu changer : il est de nouveau
+        capturé et analysé avant les autres chemins.
+        """
         try:
-            ui_description = self.read_ui_description()
-            result = process_ui_action(ui_description, search_query)
+            start = time.perf_counter()
+            intent = fast_path.intent_for(search_query)
+            action, params = intent.key, intent.params
+            result = None
+            if self.state is not None:
+                graph = state_graph.get_state_graph()
+                if planner.replayable_edge(graph, self.state, action) is not None:
+                    result = planner.replay(graph, self.state, action, params)
+                    if result is None:
+                        stream = self._refresh_analysis(stream)
+            if result is None and fast_path.is_enabled():
+                if stream is None:
+                    elements = load_ui_elements()
+                else:
+                    stream.wait_for(lambda received: fast_path.resolve_target(intent, received),
+                                    get_streaming_settings().get("wait_timeout"))
+                    elements = stream.snapshot()
+                result = fast_path.execute_intent(intent, elements)
+            if result is None:
+                if stream is not None and not stream.result():
+                    raise Exception("Erreur lors de l'analyse de l'interface")
+                ui_description = self.read_ui_description()
+                # Seuls les éléments les plus pertinents pour la consigne sont transmis à l'agent
+                result = process_ui_action(ui_description, intent.text or search_query, elements=load_ui_elements(),
+                                           task=intent.task())
+                result["path"] = "agent"
+            self.step_paths.append((action, result["path"]))
+            self.last_step = {"action": action, "params": params, "result": result,
+                              "duration": time.perf_counter() - start}
+            print(f"Chemin d'exécution : {result['path']}")
             return result["output"]
         except Exception as e:
             raise Exception(f"Erreur lors de l'exécution de la recherche : {str(e)}")
 
-    def run_workflow(self, search_query: str):
-        """Exécute le workflow complet"""
+    def _refresh_analysis(self, stream=None):
+        """
+        Capture et analyse de nouveau l'écran laissé par un rejeu en échec,
+        pour que les chemins suivants n'agissent pas sur les éléments de
+        l'écran de départ ; l'écran intermédiaire n'est pas un état de départ
+        à enregistrer dans le graphe
+
+        Args:
+            stream (AnalysisStream): Analyse en flux de l'écran de départ,
+                terminée avant la nouvelle analyse (elle écrirait sinon ses
+                éléments par-dessus)
+
+        Returns:
+            None: L'analyse est terminée (pas d'analyse en flux à attendre)
+        """
+        if stream is not None:
+            stream.result()
+        with self._stage("reanalyze"):
+            print("Nouvelle capture et analyse de l'écran après l'échec du rejeu...")
+            self.capture_frame()
+            stream = self.analyze_ui()
+            if stream is not None and not stream.result():
+                raise Exception("Erreur lors de l'analyse de l'interface")
+            self.state = None
+        return None
+
+    def run_workflow(self, search_query: str, profile=None, trace_memory=None, url=None):
+        """
+        Exécute le workflow complet, sur Google ou sur l'URL indiquée
+
+        Chaque étape est tracée (section `tracing` de config.yaml) ; le run
+        peut être profilé avec cProfile (`profile`) et tracemalloc (`trace_memory`).
+        Avec le routage entre modèles, son rapport (coût et latence) est affiché à la fin.
+        """
+        result = self.run_steps([search_query], url=url, profile=profile, trace_memory=trace_memory)
+        print_routing_report()
+        return result
+
+    @contextmanager
+    def _stage(self, name):
+        """Trace une étape du workflow et cumule sa durée dans `timings`"""
+        start = time.perf_counter()
         try:
-            print("1. Ouverture du navigateur...")
-            self.open_browser()
+            with span(name) as stage_span:
+                yield stage_span
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def run_steps(self, queries, url=None, profile=None, trace_memory=None):
+        """
+        Exécute un scénario : ouverture de Google (ou de l'URL indiquée) puis
+        une recherche par étape, chacune sur l'écran laissé par la précédente
+
+        L'identifiant du run (`run_id`), la durée cumulée de chaque étape
+        (`timings`), le résultat de chaque recherche (`outputs`) et l'erreur
+        éventuelle (`error`) restent disponibles après l'exécution.
+
+        Returns:
+            bool: True si toutes les étapes ont abouti
+        """
+        self.timings, self.outputs, self.error = {}, [], None
+        try:
+            self.run_id = run_id = start_run()
+            print(f"Run {run_id}")
+
+            query = queries[0] if len(queries) == 1 else list(queries)
+            with trace_run(run_id, profile=profile, trace_memory=trace_memory, query=query):
+                print("1. Ouverture du navigateur...")
+                with self._stage("open_browser"):
+                    self.open_browser(url)
+
+                for number, search_query in enumerate(queries, 1):
+                    if len(queries) > 1:
+                        print(f"\nÉtape {number}/{len(queries)} : {search_query}")
+                    print("2. Capture d'écran...")
+                    with self._stage("capture"):
+                        self.capture_frame()
+
+                    print("3. Analyse de l'interface...")
+                    with self._stage("analyze"):
+                        stream = self.analyze_ui()
 
-            print("2. Capture d'écran...")
-            self.capture_screen()
+                    print("4. Exécution de la recherche...")
+                    with self._stage("execute") as execute_span:
+                        result = self.execute_search(search_query, stream=stream)
+                        execute_span.set(path=self.step_paths[-1][1])
+                    self.outputs.append(result)
 
-            print("3. Analyse de l'interface...")
-            self.analyze_ui()
+                    analysis_saved = True
+                    if stream is not None:
+                        # Fin de l'analyse en arrière-plan : index des éléments, calibration et vignettes
+                        with self._stage("analysis_wait"):
+                            analysis_saved = stream.result()
+                            if not analysis_saved:
+                                print("Avertissement : l'analyse complète de l'interface n'a pas été sauvegardée")
 
-            print("4. Exécution de la recherche...")
-            result = self.execute_search(search_query)
+                    self.record_transition(analysis_saved=analysis_saved)
             
-            print("\nRésultat :")
-            print(result)
+            for result in self.outputs:
+                print(result)
             
             return True
             
         except Exception as e:
+            self.error = str(e)
             print(f"Erreur dans le workflow : {str(e)}")
-            return False 
\ No newline at end of file
+            return False
+
+    def record_transition(self, analysis_saved=True):
+        """
+        Enregistre dans le graphe des états la dernière étape exécutée :
+        éléments de l'écran de départ, étapes réussies (le texte de la
+        recherche paramétré), écran obtenu et durée
+
+        Args:
+            analysis_saved (bool): L'analyse de l'écran de départ a été
+                sauvegardée ; sinon l'index des éléments est encore celui de
+                l'écran précédent et n'est pas associé à l'état
+        """
+        step, self.last_step = self.last_step, None
+        if self.state is None or step is None:
+            return
+        try:
+            with span("state_graph.record", state=self.state.node_id):
+                graph = state_graph.get_state_graph()
+                if self.state.elements is None and analysis_saved:
+                    elements = load_ui_elements()
+                    if len(elements):
+                        graph.set_elements(self.state.node_id, elements)
+                after = capture_frame(archive=False)
+                screen_key = graph.fingerprint(after.image) if after is not None else None
+                target = graph.observe(screen_key) if screen_key else None
+                # Les étapes en erreur (dont l'agent s'est remis) ne sont pas rejouées
+                steps = [s for s in step["result"].get("steps", []) if not str(s.get("observation", "")).startswith("Erreur")]
+                graph.record(self.state.node_id, step["action"], success=True,
+                             steps=state_graph.parameterize_steps(steps, step["params"]),
+                             target=target.node_id if target is not None else None, duration=step["duration"],
+                             params=step["params"])
+                graph.save()
+        except Exception as e:
+            print(f"Erreur lors de l'enregistrement de la transition : {str(e)}")
+
+    @staticmethod
+    def _normalize_cases(cases):
+        for index, case in enumerate(cases):
+            if isinstance(case, str):
+                case = {"query": case}
+            yield {"id": case.get("id", index + 1), "query": case["query"], "url": case.get("url")}
+
+    @staticmethod
+    def _same_screen(image_a, image_b, max_distance=4):
+        return hamming_distance(fingerprint(image_a, min_detail=0), fingerprint(image_b, min_detail=0)) <= max_distance
+
+    def run_many(self, cases, concurrency=None, lookahead=None):
+        """
+        Exécute une série de cas de test en pipeline
+
+        Les étapes locales (ouverture, capture, exécution) se partagent l'écran
+        et restent séquentielles, mais la capture des cas suivants est prise
+        dès que l'écran est libre et leur analyse part en parallèle (ainvoke)
+        pendant l'exécution du cas courant. Avant d'exécuter un cas dont
+        l'écran a été remplacé entre-temps, son URL est rouverte et l'écran
+        vérifié par hash perceptuel (réanalyse en cas de différence).
+
+        Sur un seul écran, capturer à l'avance coûte une réouverture de l'URL
+        et une capture par cas (étape `reopen`) : l'avance n'est rentable que
+        si l'analyse est nettement plus longue que ces deux opérations ;
+        `lookahead=0` exécute les cas l'un après l'autre, sans réouverture.
+        Le lot est tracé comme un run (`trace_run`).
+
+        Args:
+            cases (iterable): Requêtes (str) ou dicts {"query", "url", "id"}
+            concurrency (int): Nombre maximal d'analyses simultanées
+            lookahead (int): Nombre de cas capturés à l'avance
+
+        Returns:
+            dict: Résultats par cas et statistiques (débit, attente par étape)
+        """
+        settings = self.config.get_section("batch")
+        concurrency = concurrency or settings.get("concurrency", 4)
+        lookahead = lookahead if lookahead is not None else settings.get("lookahead", 0)
+        cases = list(self._normalize_cases(cases))
+        self.run_id = run_id = start_run()
+        print(f"Run {run_id}")
+        # Les analyses du lot ne passent pas par le graphe des états
+        self.state = None
+        with trace_run(run_id, cases=len(cases), concurrency=concurrency, lookahead=lookahead) as run_span:
+            report = asyncio.run(self._run_many(cases, concurrency, lookahead))
+            stats = report["stats"]
+            run_span.set(succeeded=stats["succeeded"], reopened=stats["reopened"])
+
+        print(f"\n{stats['succeeded']}/{stats['cases']} cas réussis en {stats['elapsed']:.1f}s "
+              f"({stats['cases_per_minute']:.1f} cas/min, {stats['reopened']} réouverture(s) de l'écran)")
+        for stage, values in stats["stages"].items():
+            print(f"  {stage:<14} moyenne {values['mean']:.2f}s, max {values['max']:.2f}s")
+        return report
+
+    async def _run_many(self, cases, concurrency, lookahead):
+        screen = asyncio.Lock()
+        analysis_slots = asyncio.Semaphore(concurrency)
+        window = asyncio.Semaphore(lookahead + 1)
+        ready = asyncio.Queue()
+        screen_case = {"index": None}
+        started = time.perf_counter()
+
+        async def analyze(screenshot, timings):
+            queued = time.perf_counter()
+            async with analysis_slots:
+                timings["analysis_wait"] = time.perf_counter() - queued
+                try:
+                    return await acompute_analysis(screenshot)
+                finally:
+                    timings["analysis_done"] = time.perf_counter()
+                    timings["analysis"] = timings["analysis_done"] - queued - timings["analysis_wait"]
+
+        async def produce():
+            for index, case in enumerate(cases):
+                timings = {}
+                queued = time.perf_counter()
+                await window.acquire()
+                screenshot, task, error = None, None, None
+                async with screen:
+                    timings["capture_wait"] = time.perf_counter() - queued
+                    capture_start = time.perf_counter()
+                    try:
+                        with span("batch.capture", case=case["id"]):
+                            await asyncio.to_thread(self.open_browser, case["url"])
+                            capture = await asyncio.to_thread(self.capture_frame)
+                        screenshot = capture.image
+                        screen_case["index"] = index
+                        task = asyncio.create_task(analyze(screenshot, timings))
+                    except Exception as e:
+                        error = e
+                    timings["capture"] = time.perf_counter() - capture_start
+                await ready.put((index, case, timings, screenshot, task, error))
+            await ready.put(None)
+
+        async def consume():
+            results = []
+            while True:
+                item = await ready.get()
+                if item is None:
+                    return results
+                index, case, timings, screenshot, task, error = item
+                result = {"id": case["id"], "query": case["query"], "success": False}
+                try:
+                    if error:
+                        raise error
+                    analysis = await task
+                    async with screen:
+                        execute_start = time.perf_counter()
+                        timings["execute_wait"] = execute_start - timings.pop("analysis_done", execute_start)
+                        if screen_case["index"] != index:
+                            # L'écran a été remplacé par la capture d'un cas suivant
+                            with span("batch.reopen", case=case["id"]):
+                                await asyncio.to_thread(self.open_browser, case["url"])
+                                screen_case["index"] = index
+                                current = (await asyncio.to_thread(self.capture_frame)).image
+                                same = await asyncio.to_thread(self._same_screen, screenshot, current)
+                            timings["reopen"] = time.perf_counter() - execute_start
+                            if not same:
+                                print(f"Cas {case['id']} : écran différent de la capture, nouvelle analyse")
+                                analysis = await acompute_analysis(current)
+                                screenshot = current
+                        with span("batch.execute", case=case["id"]):
+                            if not analysis or not save_analysis(analysis, screenshot=screenshot):
+                                raise Exception("Erreur lors de l'analyse de l'interface")
+                            output = await asyncio.to_thread(self.execute_search, case["query"])
+                        timings["execute"] = time.perf_counter() - execute_start - timings.get("reopen", 0.0)
+                    result.update(success=True, output=output, path=self.step_paths[-1][1])
+                except Exception as e:
+                    result["error"] = str(e)
+                    print(f"Erreur dans le cas {case['id']} : {str(e)}")
+                finally:
+                    timings.pop("analysis_done", None)
+                    window.release()
+                result["timings"] = timings
+                results.append(result)
+
+        producer = asyncio.create_task(produce())
+        results = await consume()
+        await producer
+
+        elapsed = time.perf_counter() - started
+        stages = {}
+        for stage in BATCH_STAGES:
+            values = [r["timings"][stage] for r in results if stage in r["timings"]]
+            if values:
+                stages[stage] = {"mean": sum(values) / len(values), "max": max(values)}
+        return {
+            "results": results,
+            "stats": {
+                "cases": len(results),
+                "succeeded": sum(1 for r in results if r["success"]),
+                "reopened": sum(1 for r in results if "reopen" in r["timings"]),
+                "elapsed": elapsed,
+                "cases_per_minute": len(results) / elapsed * 60 if elapsed else 0.0,
+                "stages": stages,
+            },
+        }
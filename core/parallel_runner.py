@@ -0,0 +1,364 @@
+"""
+Module d'exécution parallèle des cas de test sur des affichages virtuels
+
+pyautogui et ImageGrab agissent sur l'écran global : un processus ne peut
+exécuter qu'un Orchestrator à la fois. Le runner lance N processus
+workers, chacun avec son propre affichage Xvfb (`DISPLAY`), son propre
+navigateur et son propre dossier de données (captures, analyses, traces).
+Les cas sont répartis en lots contigus, un par worker ; un worker dont le
+lot est épuisé vole les cas restants en fin du lot le plus chargé. Les
+résultats sont agrégés par le processus principal.
+"""
+import os
+import sys
+import time
+import queue
+import select
+import shutil
+import signal
+import subprocess
+import multiprocessing
+from typing import Dict, List, Optional
+from utils.config_loader import ConfigLoader
+
+
+class VirtualDisplay:
+    """
+    Affichage X virtuel (Xvfb) ; le numéro d'affichage libre est choisi par
+    Xvfb lui-même (-displayfd)
+    """
+
+    def __init__(self, screen: str = "1280x800x24"):
+        self.screen = screen
+        self.process = None
+        self.name = None
+
+    def start(self, timeout: float = 10.0) -> "VirtualDisplay":
+        if shutil.which("Xvfb") is None:
+            raise RuntimeError("Xvfb introuvable (sudo apt-get install xvfb)")
+        read_fd, write_fd = os.pipe()
+        try:
+            self.process = subprocess.Popen(
+                ["Xvfb", "-displayfd", str(write_fd), "-screen", "0", self.screen, "-nolisten", "tcp"],
+                pass_fds=(write_fd,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            os.close(write_fd)
+            write_fd = None
+            ready, _, _ = select.select([read_fd], [], [], timeout)
+            number = os.read(read_fd, 16).decode().strip() if ready else ""
+        finally:
+            if write_fd is not None:
+                os.close(write_fd)
+            os.close(read_fd)
+        if not number:
+            self.stop()
+            raise RuntimeError(f"Xvfb n'a pas démarré en {timeout}s")
+        self.name = f":{number}"
+        return self
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+
+class BrowserProcess:
+    """
+    Navigateur propre à un worker, lancé par une commande configurée (profil
+    dédié) ; remplace le module webbrowser (méthode open). Chaque ouverture
+    relance le navigateur pour repartir d'une fenêtre unique.
+    """
+
+    def __init__(self, command: List[str], profile_dir: str, width: int, height: int):
+        self.command = command
+        self.profile_dir = profile_dir
+        self.width = width
+        self.height = height
+        self.process = None
+
+    def open(self, url, *args, **kwargs):
+        self.close()
+        os.makedirs(self.profile_dir, exist_ok=True)
+        arguments = [part.format(url=url, profile=self.profile_dir, width=self.width, height=self.height)
+                     for part in self.command]
+        self.process = subprocess.Popen(arguments, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                        start_new_session=True)
+        return True
+
+    def close(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            # Le navigateur peut avoir lancé des processus enfants : arrêter tout le groupe
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+        self.process = None
+
+
+# Commandes par défaut d'un navigateur à profil dédié (une instance par worker), dans l'ordre de préférence
+DEFAULT_BROWSER_COMMANDS = [
+    ["chromium", "--user-data-dir={profile}", "--no-first-run", "--no-default-browser-check",
+     "--window-position=0,0", "--window-size={width},{height}", "{url}"],
+    ["chromium-browser", "--user-data-dir={profile}", "--no-first-run", "--no-default-browser-check",
+     "--window-position=0,0", "--window-size={width},{height}", "{url}"],
+    ["google-chrome", "--user-data-dir={profile}", "--no-first-run", "--no-default-browser-check",
+     "--window-position=0,0", "--window-size={width},{height}", "{url}"],
+    ["firefox", "--new-instance", "--profile", "{profile}", "--width", "{width}", "--height", "{height}", "{url}"],
+]
+
+
+def browser_command(settings: Dict) -> Optional[List[str]]:
+    """
+    Retourne la commande du navigateur des workers : celle de la
+    configuration, sinon la première commande par défaut dont le navigateur
+    est installé, ou None
+
+    Raises:
+        ValueError: Si les workers ont chacun leur affichage Xvfb et
+            qu'aucun navigateur à profil dédié n'est disponible : le
+            navigateur par défaut du système transmettrait l'URL à son
+            instance déjà ouverte, sur un autre affichage, et les workers
+            partageraient un seul navigateur
+    """
+    command = settings.get("browser_command")
+    if command:
+        return list(command)
+    for command in DEFAULT_BROWSER_COMMANDS:
+        if shutil.which(command[0]):
+            return command
+    if settings.get("xvfb", True):
+        raise ValueError("Aucun navigateur à profil dédié (chromium, google-chrome, firefox) : "
+                         "définissez parallel.browser_command pour lancer un navigateur par worker")
+    return None
+
+
+class ShardedQueue:
+    """
+    Files de cas partagées entre processus, une par worker
+
+    Chaque worker consomme son lot par le début ; un worker inactif vole
+    par la fin du lot qui contient le plus de cas restants.
+    """
+
+    def __init__(self, context, count: int, workers: int):
+        size, extra = divmod(count, workers)
+        self.shards = []
+        start = 0
+        for worker in range(workers):
+            end = start + size + (1 if worker < extra else 0)
+            self.shards.append((start, end))
+            start = end
+        # Bornes [début, fin) restantes de chaque lot
+        self._bounds = context.Array("i", [bound for shard in self.shards for bound in shard], lock=False)
+        self._locks = [context.Lock() for _ in range(workers)]
+
+    def remaining(self, worker: int) -> int:
+        return max(0, self._bounds[2 * worker + 1] - self._bounds[2 * worker])
+
+    def take(self, worker: int):
+        """
+        Retourne le prochain cas d'un worker : (indice, worker volé ou None),
+        ou (None, None) s'il ne reste aucun cas
+        """
+        with self._locks[worker]:
+            head, tail = self._bounds[2 * worker], self._bounds[2 * worker + 1]
+            if head < tail:
+                self._bounds[2 * worker] = head + 1
+                return head, None
+        while True:
+            victims = [(self.remaining(other), other) for other in range(len(self._locks)) if other != worker]
+            victims = [victim for victim in victims if victim[0] > 0]
+            if not victims:
+                return None, None
+            _, victim = max(victims)
+            with self._locks[victim]:
+                head, tail = self._bounds[2 * victim], self._bounds[2 * victim + 1]
+                if head < tail:
+                    self._bounds[2 * victim + 1] = tail - 1
+                    return tail - 1, victim
+
+
+def get_parallel_settings() -> Dict:
+    """Retourne la section `parallel` de la configuration"""
+    return ConfigLoader().get_section("parallel")
+
+
+def _configure_worker(data_dir: str, shared_cache_dir: Optional[str]) -> None:
+    """Dirige les données du worker vers son propre dossier"""
+    config = ConfigLoader()
+    settings = config.get_config()
+    settings.setdefault("paths", {})["data_dir"] = data_dir
+    if shared_cache_dir:
+        settings.setdefault("analysis_cache", {})["directory"] = shared_cache_dir
+    config._directories_created = False
+
+
+def _worker_main(worker, cases, shards, results, settings, base_dir, setup):
+    """Point d'entrée d'un worker : affichage, navigateur et données propres, puis consommation des cas"""
+    data_dir = os.path.join(base_dir, f"worker-{worker}")
+    os.makedirs(data_dir, exist_ok=True)
+    log = open(os.path.join(data_dir, "worker.log"), "a", encoding="utf-8", buffering=1)
+    sys.stdout = sys.stderr = log
+
+    display, browser, stats = None, None, {"cases": 0, "stolen": 0, "busy": 0.0}
+    started = time.perf_counter()
+    try:
+        screen = settings.get("screen", "1280x800x24")
+        if settings.get("xvfb", True):
+            display = VirtualDisplay(screen).start()
+            # pyautogui lit DISPLAY à l'import : les modules d'interface sont importés ensuite
+            os.environ["DISPLAY"] = display.name
+        shared_cache_dir = os.path.join(base_dir, "analysis_cache") if settings.get("share_analysis_cache", True) else None
+        _configure_worker(data_dir, shared_cache_dir)
+
+        if settings.get("browser_command"):
+            from utils.backends import set_backends
+
+            width, height = (int(value) for value in screen.split("x")[:2])
+            browser = BrowserProcess(settings["browser_command"], os.path.join(data_dir, "browser-profile"),
+                                     width, height)
+            set_backends(webbrowser=browser)
+
+        context = setup(worker) if setup else None
+        if context is not None:
+            context.__enter__()
+        try:
+            from core.orchestrator import Orchestrator
+
+            orchestrator = Orchestrator()
+            print(f"Worker {worker} prêt (affichage {os.environ.get('DISPLAY')}, données {data_dir})")
+            while True:
+                index, stolen_from = shards.take(worker)
+                if index is None:
+                    break
+                case = cases[index]
+                case_start = time.perf_counter()
+                try:
+                    success = orchestrator.run_workflow(case["query"], url=case.get("url"))
+                    error = None if success else "échec du workflow (voir worker.log)"
+                except Exception as e:
+                    success, error = False, str(e)
+                duration = time.perf_counter() - case_start
+                stats["cases"] += 1
+                stats["busy"] += duration
+                stats["stolen"] += 0 if stolen_from is None else 1
+                results.put(("result", index, {
+                    "id": case["id"], "query": case["query"], "success": success, "error": error,
+                    "worker": worker, "stolen_from": stolen_from, "duration": duration,
+                    "path": orchestrator.step_paths[-1][1] if success and orchestrator.step_paths else None,
+                }))
+        finally:
+            if context is not None:
+                context.__exit__(None, None, None)
+    except Exception as e:
+        print(f"Erreur dans le worker {worker} : {str(e)}")
+        stats["error"] = str(e)
+    finally:
+        if browser is not None:
+            browser.close()
+        if display is not None:
+            display.stop()
+        stats["elapsed"] = time.perf_counter() - started
+        results.put(("done", worker, stats))
+        log.close()
+
+
+def run_parallel(cases, workers: Optional[int] = None, directory: Optional[str] = None, setup=None):
+    """
+    Exécute une série de cas de test sur plusieurs workers en parallèle
+
+    Args:
+        cases (iterable): Requêtes (str) ou dicts {"query", "url", "id"}
+        workers (int): Nombre de workers (celui de la configuration si non spécifié)
+        directory (str): Dossier des données des workers (data/workers par défaut)
+        setup (callable): Fonction de niveau module appelée dans chaque worker
+            avec son numéro, avant les cas ; peut retourner un gestionnaire de
+            contexte actif pendant l'exécution (objets de substitution…)
+
+    Returns:
+        dict: Résultats par cas (dans l'ordre des cas) et statistiques
+            (débit, cas et vols par worker)
+
+    Raises:
+        ValueError: Si les workers ont un affichage Xvfb sans navigateur à
+            profil dédié (voir browser_command)
+    """
+    from core.orchestrator import Orchestrator
+
+    # Un navigateur à profil dédié par worker (commande résolue une fois, avant le lancement des workers)
+    settings = dict(get_parallel_settings())
+    settings["browser_command"] = browser_command(settings)
+    cases = list(Orchestrator._normalize_cases(cases))
+    workers = max(1, min(workers or settings.get("workers", 4), len(cases) or 1))
+    base_dir = os.path.abspath(directory or settings.get("directory")
+                               or os.path.join(ConfigLoader().get_data_dir(), "workers"))
+    os.makedirs(base_dir, exist_ok=True)
+
+    # spawn : chaque worker importe pyautogui après avoir reçu son propre DISPLAY
+    context = multiprocessing.get_context("spawn")
+    shards = ShardedQueue(context, len(cases), workers)
+    results = context.Queue()
+    processes = [
+        context.Process(target=_worker_main, name=f"worker-{worker}",
+                        args=(worker, cases, shards, results, settings, base_dir, setup))
+        for worker in range(workers)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    print(f"{len(cases)} cas répartis sur {workers} worker(s) (journaux dans {base_dir})")
+
+    by_index, worker_stats, done = {}, {}, set()
+    while len(done) < workers:
+        try:
+            message = results.get(timeout=1.0)
+        except queue.Empty:
+            # Un worker arrêté brutalement n'envoie pas de message de fin
+            for worker, process in enumerate(processes):
+                if worker not in done and not process.is_alive() and process.exitcode not in (None, 0):
+                    done.add(worker)
+                    worker_stats[worker] = {"error": f"arrêt inattendu (code {process.exitcode})"}
+            continue
+        if message[0] == "result":
+            _, index, result = message
+            by_index[index] = result
+            state = "ok" if result["success"] else f"échec ({result['error']})"
+            print(f"Cas {result['id']} : {state} - worker {result['worker']}, {result['duration']:.1f}s")
+        else:
+            _, worker, stats = message
+            done.add(worker)
+            worker_stats[worker] = stats
+    for process in processes:
+        process.join(timeout=10)
+    elapsed = time.perf_counter() - started
+
+    ordered = []
+    for index, case in enumerate(cases):
+        ordered.append(by_index.get(index) or {"id": case["id"], "query": case["query"], "success": False,
+                                               "error": "cas non exécuté (worker interrompu)"})
+    succeeded = sum(1 for result in ordered if result["success"])
+    report = {
+        "results": ordered,
+        "stats": {
+            "cases": len(ordered),
+            "succeeded": succeeded,
+            "workers": workers,
+            "elapsed": elapsed,
+            "cases_per_minute": len(ordered) / elapsed * 60 if elapsed else 0.0,
+            "per_worker": {worker: worker_stats.get(worker, {}) for worker in range(workers)},
+        },
+    }
+    print(f"\n{succeeded}/{len(ordered)} cas réussis en {elapsed:.1f}s "
+          f"({report['stats']['cases_per_minute']:.1f} cas/min, {workers} workers)")
+    for worker, stats in report["stats"]["per_worker"].items():
+        if "error" in stats and "cases" not in stats:
+            print(f"  worker {worker} : {stats['error']}")
+        else:
+            print(f"  worker {worker} : {stats.get('cases', 0)} cas dont {stats.get('stolen', 0)} volés, "
+                  f"occupé {stats.get('busy', 0.0):.1f}s sur {stats.get('elapsed', 0.0):.1f}s")
+    return report
@@ -0,0 +1,350 @@
+"""
+Module d'exécution de suites de scénarios
+
+Une suite est un fichier YAML (liste de cas, ou un cas par document) ou
+JSONL (un cas par ligne). Chaque cas décrit une URL, des étapes et les
+résultats attendus :
+
+    - id: recherche-claude
+      url: https://www.google.com
+      steps:
+        - search: Anthropic Claude
+      expect:
+        success: true
+        path: fast
+        output_contains: Anthropic
+        max_duration: 60
+
+Les cas sont lus un par un (générateurs), exécutés puis écrits aussitôt
+dans un fichier de résultats JSONL (statut, durées, artefacts), synchronisé
+sur disque au fil de l'eau : la mémoire reste constante quelle que soit la
+taille de la suite. Une exécution interrompue reprend après le dernier cas
+dont le résultat est complet.
+"""
+import os
+import json
+import time
+from typing import Callable, Dict, Iterator, Optional
+from utils.config_loader import ConfigLoader
+
+STATUSES = ("passed", "failed", "error")
+
+
+def get_suite_settings() -> Dict:
+    """Retourne la section `suite` de la configuration"""
+    return ConfigLoader().get_section("suite")
+
+
+def _iter_jsonl(path: str) -> Iterator[Dict]:
+    with open(path, "rb") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith(b"#"):
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}, ligne {number} : JSON invalide ({str(e)})")
+
+
+def _iter_yaml(path: str) -> Iterator[Dict]:
+    # Lecture par événements : seul le cas courant est construit en mémoire
+    import yaml
+
+    with open(path, "r", encoding="utf-8") as f:
+        loader = yaml.SafeLoader(f)
+        try:
+            loader.get_event()  # StreamStartEvent
+            while not loader.check_event(yaml.StreamEndEvent):
+                loader.get_event()  # DocumentStartEvent
+                if loader.check_event(yaml.SequenceStartEvent):
+                    loader.get_event()
+                    while not loader.check_event(yaml.SequenceEndEvent):
+                        yield loader.construct_document(loader.compose_node(None, None))
+                    loader.get_event()
+                elif not loader.check_event(yaml.DocumentEndEvent):
+                    yield loader.construct_document(loader.compose_node(None, None))
+                loader.get_event()  # DocumentEndEvent
+                loader.anchors = {}
+        finally:
+            loader.dispose()
+
+
+def normalize_case(raw, index: int) -> Dict:
+    """
+    Met un cas au format de l'exécution : {"id", "url", "steps", "expect"}
+
+    Une chaîne ou un dict avec `query` est un cas à une seule recherche ;
+    une étape est une requête (str) ou un dict {"search": requête}.
+    """
+    if isinstance(raw, str):
+        raw = {"query": raw}
+    if not isinstance(raw, dict):
+        raise ValueError(f"cas {index + 1} : format non pris en charge ({type(raw).__name__})")
+    steps = raw.get("steps")
+    if steps is None:
+        steps = [raw["query"]] if "query" in raw else []
+    elif not isinstance(steps, list):
+        steps = [steps]
+    queries = []
+    for step in steps:
+        if isinstance(step, dict):
+            query = step.get("search", step.get("query"))
+            if query is None:
+                raise ValueError(f"cas {raw.get('id', index + 1)} : étape non prise en charge ({step})")
+            step = query
+        queries.append(str(step))
+    if not queries:
+        raise ValueError(f"cas {raw.get('id', index + 1)} : aucune étape")
+    return {
+        "id": raw.get("id", index + 1),
+        "url": raw.get("url"),
+        "steps": queries,
+        "expect": raw.get("expect") or {},
+    }
+
+
+def load_cases(path: str) -> Iterator[Dict]:
+    """
+    Lit les cas d'une suite YAML ou JSONL, un par un
+
+    Un cas mal formé est retourné avec sa clé `error` (il sera compté en
+    erreur) au lieu d'interrompre la suite.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".ndjson"):
+        raw_cases = _iter_jsonl(path)
+    elif extension in (".yaml", ".yml"):
+        raw_cases = _iter_yaml(path)
+    else:
+        raise ValueError(f"Format de suite non pris en charge : {path} (YAML ou JSONL attendu)")
+    for index, raw in enumerate(raw_cases):
+        try:
+            yield normalize_case(raw, index)
+        except (KeyError, ValueError) as e:
+            case_id = raw.get("id", index + 1) if isinstance(raw, dict) else index + 1
+            yield {"id": case_id, "url": None, "steps": [], "expect": {}, "error": str(e)}
+
+
+def evaluate(case: Dict, outcome: Dict) -> list:
+    """
+    Compare le résultat d'un cas aux attentes (`expect`)
+
+    Returns:
+        list: Attentes non satisfaites (vide si le cas est réussi)
+    """
+    expect = case["expect"]
+    failures = []
+    if outcome["success"] != expect.get("success", True):
+        failures.append(f"succès attendu : {expect.get('success', True)}, obtenu : {outcome['success']}")
+    if "path" in expect:
+        paths = outcome["paths"]
+        expected = expect["path"]
+        if isinstance(expected, list):
+            if paths != expected:
+                failures.append(f"chemins attendus : {expected}, obtenus : {paths}")
+        elif not paths or paths[-1] != expected:
+            failures.append(f"chemin attendu : {expected}, obtenu : {paths[-1] if paths else None}")
+    if "output_contains" in expect:
+        output = str(outcome["outputs"][-1]) if outcome["outputs"] else ""
+        if str(expect["output_contains"]) not in output:
+            failures.append(f"résultat sans « {expect['output_contains']} »")
+    if expect.get("max_duration") is not None and outcome["duration"] > expect["max_duration"]:
+        failures.append(f"durée {outcome['duration']:.1f}s > {expect['max_duration']}s")
+    return failures
+
+
+class JsonlSink:
+    """
+    Fichier de résultats JSONL en ajout : chaque ligne est écrite d'un bloc
+    et le fichier synchronisé sur disque (fsync) toutes les `fsync_every`
+    lignes ou toutes les `fsync_interval` secondes
+    """
+
+    def __init__(self, path: str, fsync_every: Optional[int] = 1, fsync_interval: Optional[float] = 1.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "ab")
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def write(self, record: Dict) -> None:
+        self._file.write((json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+        self._file.flush()
+        self._pending += 1
+        if (self.fsync_every and self._pending >= self.fsync_every) or \
+                (self.fsync_interval is not None and time.monotonic() - self._last_sync >= self.fsync_interval):
+            self.sync()
+
+    def sync(self) -> None:
+        if self._pending:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.flush()
+            self.sync()
+            self._file.close()
+
+    def __enter__(self) -> "JsonlSink":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def completed_results(path: str) -> Iterator[Dict]:
+    """
+    Lit les résultats complets d'une exécution précédente, dans l'ordre
+
+    Une dernière ligne incomplète (interruption pendant l'écriture) est
+    retirée du fichier une fois les lignes complètes lues.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                result = json.loads(line)
+            except ValueError:
+                break
+            offset += len(line)
+            yield {"id": result.get("id"), "status": result.get("status")}
+    if offset < os.path.getsize(path):
+        print(f"Reprise : résultat incomplet retiré de {path}")
+        os.truncate(path, offset)
+
+
+class OrchestratorExecutor:
+    """
+    Exécute les cas avec un Orchestrator unique ; les artefacts d'un cas
+    sont ses captures (stockage des captures) et le fichier de trace
+    """
+
+    def __init__(self):
+        from core.orchestrator import Orchestrator
+
+        self.orchestrator = Orchestrator()
+
+    def __call__(self, case: Dict) -> Dict:
+        from utils.screen_utils import flush_archive
+        from utils.artifact_store import get_artifact_store
+        from utils.tracing import is_enabled as tracing_enabled, get_traces_dir
+
+        orchestrator = self.orchestrator
+        orchestrator.step_paths = []
+        # Chaque cas part de sa propre URL : l'écran du cas précédent n'est pas réutilisé
+        orchestrator.state = None
+        success = orchestrator.run_steps(case["steps"], url=case["url"])
+        flush_archive()
+        artifacts = {"run_id": orchestrator.run_id}
+        if orchestrator.run_id:
+            captures = get_artifact_store().captures_for_run(orchestrator.run_id)
+            artifacts["screenshots"] = [capture.path for capture in captures]
+        if tracing_enabled():
+            artifacts["trace"] = os.path.join(get_traces_dir(), "trace.jsonl")
+        outcome = {
+            "success": success,
+            "paths": [path for _, path in orchestrator.step_paths],
+            "outputs": list(orchestrator.outputs),
+            "timings": dict(orchestrator.timings),
+            "error": orchestrator.error,
+            "artifacts": artifacts,
+        }
+        orchestrator.step_paths = []
+        return outcome
+
+
+def default_results_path(suite_path: str) -> str:
+    """Retourne le fichier de résultats par défaut d'une suite : data/results/<suite>.jsonl"""
+    name = os.path.splitext(os.path.basename(suite_path))[0]
+    return os.path.join(ConfigLoader().get_data_dir(), "results", f"{name}.jsonl")
+
+
+def run_suite(path: str, results_path: Optional[str] = None, resume: bool = True, limit: Optional[int] = None,
+              executor: Optional[Callable[[Dict], Dict]] = None) -> Dict:
+    """
+    Exécute une suite de scénarios et écrit un résultat JSONL par cas
+
+    Args:
+        path (str): Fichier de la suite (YAML ou JSONL)
+        results_path (str): Fichier de résultats (data/results/<suite>.jsonl par défaut)
+        resume (bool): Reprendre après les cas déjà présents dans le fichier
+            de résultats (sinon le fichier est réécrit)
+        limit (int): Nombre maximal de cas à exécuter
+        executor (callable): Exécute un cas normalisé et retourne
+            {"success", "paths", "outputs", "timings", "error", "artifacts"}
+            (un Orchestrator par défaut)
+
+    Returns:
+        dict: Nombre de cas par statut, repris et exécutés, fichier de résultats et
+            rapport du routage entre modèles (`routing`, None sans routage)
+
+    Raises:
+        ValueError: Si le fichier de résultats ne correspond pas à la suite
+    """
+    settings = get_suite_settings()
+    results_path = results_path or settings.get("results") or default_results_path(path)
+    if not resume and os.path.exists(results_path):
+        open(results_path, "wb").close()
+    previous = completed_results(results_path)
+    counts = {status: 0 for status in STATUSES}
+    resumed = executed = 0
+    started = time.perf_counter()
+
+    with JsonlSink(results_path, settings.get("fsync_every", 1), settings.get("fsync_interval", 1.0)) as sink:
+        for case in load_cases(path):
+            done = next(previous, None)
+            if done is not None:
+                if done["id"] != case["id"]:
+                    raise ValueError(f"{results_path} ne correspond pas à {path} (cas {case['id']}, "
+                                     f"résultat {done['id']}) : relancer sans reprise (--no-resume)")
+                counts[done["status"]] = counts.get(done["status"], 0) + 1
+                resumed += 1
+                continue
+            if limit is not None and executed >= limit:
+                break
+            if executor is None:
+                executor = OrchestratorExecutor()
+
+            record = {"id": case["id"], "url": case["url"], "steps": case["steps"]}
+            case_start = time.perf_counter()
+            if "error" in case:
+                record.update(status="error", error=case["error"], duration=0.0)
+            else:
+                try:
+                    outcome = executor(case)
+                    outcome["duration"] = time.perf_counter() - case_start
+                    failures = evaluate(case, outcome)
+                    if outcome.get("error") and not outcome["success"]:
+                        status = "error"
+                    else:
+                        status = "failed" if failures else "passed"
+                    record.update(status=status, duration=outcome["duration"], paths=outcome["paths"],
+                                  timings=outcome["timings"], outputs=outcome["outputs"], failures=failures,
+                                  error=outcome.get("error"), artifacts=outcome.get("artifacts", {}))
+                except Exception as e:
+                    record.update(status="error", error=str(e), duration=time.perf_counter() - case_start)
+            record["finished_at"] = time.time()
+            sink.write(record)
+            counts[record["status"]] += 1
+            executed += 1
+            print(f"Cas {case['id']} : {record['status']} ({record['duration']:.1f}s)")
+
+    elapsed = time.perf_counter() - started
+    summary = dict(counts, cases=resumed + executed, resumed=resumed, executed=executed,
+                   elapsed=elapsed, results=results_path)
+    print(f"\n{counts['passed']}/{summary['cases']} cas réussis, {counts['failed']} en échec, "
+          f"{counts['error']} en erreur ({executed} exécutés en {elapsed:.1f}s, {resumed} repris) - {results_path}")
+    # Économies du routage entre modèles sur l'ensemble de la suite
+    from clients.model_router import print_routing_report
+
+    summary["routing"] = print_routing_report()
+    return summary
@@ -1,17 +1,41 @@
 """
 Point d'entrée principal de l'application
 """
+import sys
+import argparse
 from core.orchestrator import Orchestrator
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Automatisation d'interface guidée par Claude")
+    parser.add_argument("--query", default="Anthropic Claude", help="Requête de recherche (workflow simple)")
+    parser.add_argument("--url", default=None, help="URL à ouvrir (Google par défaut)")
+    parser.add_argument("--suite", default=None, help="Suite de scénarios YAML ou JSONL à exécuter")
+    parser.add_argument("--results", default=None, help="Fichier JSONL des résultats de la suite")
+    parser.add_argument("--no-resume", action="store_true", help="Réexécuter la suite depuis le début")
+    parser.add_argument("--limit", type=int, default=None, help="Nombre maximal de cas à exécuter")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.suite:
+        from core.suite_runner import run_suite
+
+        try:
+            summary = run_suite(args.suite, results_path=args.results, resume=not args.no_resume, limit=args.limit)
+        except (OSError, ValueError) as e:
+            print(f"Erreur lors de l'exécution de la suite : {str(e)}")
+            return 2
+        return 0 if summary["failed"] == 0 and summary["error"] == 0 else 1
+
     # Initialiser l'orchestrateur
     orchestrator = Orchestrator()
-    
+
     # Exécuter le workflow
-    search_query = "Anthropic Claude"
-    result = orchestrator.run_workflow(search_query)
-    
+    result = orchestrator.run_workflow(args.query, url=args.url)
+
     print(f"Résultat du workflow: {result}")
+    return 0 if result else 1
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""
+Module de vérification locale de l'effet des actions
+
+Un clic ou une saisie peut ne rien produire (clic à côté de la cible,
+focus perdu) sans que l'outil le sache. Plutôt que de le découvrir par
+une nouvelle capture analysée par le modèle, une petite zone autour de la
+cible de l'action (la boîte de l'élément qui la contient, ou un carré
+autour du point) est capturée avant l'action, pointeur déjà en place,
+puis échantillonnée après jusqu'à ce qu'un nombre suffisant de pixels ait
+changé (focus, curseur de saisie, texte, page suivante) ou jusqu'au délai.
+Sans effet dans la zone ni sur l'écran entier, l'action est relancée (un
+clic seulement après `page_change_timeout` sans changement de l'écran,
+pour ne jamais soumettre deux fois un formulaire dont le serveur est
+lent, et jamais dans l'élément qui a déjà le focus) ; l'absence d'effet
+est signalée à l'appelant, sans appel au modèle.
+"""
+import time
+from typing import Callable, Dict, Optional, Tuple
+import numpy as np
+from PIL import Image
+from utils.backends import get_image_grab
+from utils.config_loader import ConfigLoader
+from utils.tracing import span
+from utils.ui_elements import load_ui_elements
+from utils import stability
+
+Box = Tuple[int, int, int, int]
+
+# Dernier point cliqué : cible de la saisie suivante
+_last_target: Optional[Tuple[int, int]] = None
+
+
+class EffectCheck:
+    """
+    Résultat d'une vérification : effet observé, essais, durée et pixels modifiés
+    """
+    __slots__ = ("name", "observed", "attempts", "waited", "changed_pixels", "region")
+
+    def __init__(self, name: str, observed: bool, attempts: int, waited: float, changed_pixels: int,
+                 region: Optional[Box]):
+        self.name = name
+        self.observed = observed
+        self.attempts = attempts
+        self.waited = waited
+        self.changed_pixels = changed_pixels
+        self.region = region
+
+    def __repr__(self) -> str:
+        return (f"EffectCheck({self.name!r}, observed={self.observed}, attempts={self.attempts}, "
+                f"waited={self.waited:.3f}, changed_pixels={self.changed_pixels})")
+
+
+def get_verification_settings() -> Dict:
+    """Retourne la section `verification` de la configuration"""
+    return ConfigLoader().get_section("verification")
+
+
+def is_enabled() -> bool:
+    """Indique si l'effet des clics et des saisies est vérifié"""
+    return get_verification_settings().get("enabled", True)
+
+
+def last_target() -> Optional[Tuple[int, int]]:
+    """Retourne le dernier point cliqué, ou None"""
+    return _last_target
+
+
+def already_focused(x: int, y: int) -> bool:
+    """
+    Indique si le point (x, y) est dans l'élément analysé qui contient déjà
+    le dernier point cliqué : cliquer de nouveau dans un champ qui a le
+    focus ne change en général aucun pixel
+    """
+    if _last_target is None:
+        return False
+    elements = load_ui_elements()
+    element = elements.at(x, y)
+    return element is not None and element is elements.at(*_last_target)
+
+
+def action_region(x: int, y: int, size: Tuple[int, int], row: bool = False) -> Box:
+    """
+    Zone observée pour une action au point (x, y) : boîte de l'élément
+    analysé qui contient le point, agrandie de `padding`, sinon un carré
+    de demi-côté `radius` (ou, avec `row`, toute la largeur de l'écran sur
+    cette hauteur : le texte saisi commence au bord du champ, loin du point
+    cliqué) ; bornée à l'écran de taille `size`
+    """
+    settings = get_verification_settings()
+    element = load_ui_elements().at(x, y)
+    width, height = size
+    if element is not None:
+        padding = settings.get("padding", 8)
+        left, top, right, bottom = element.bbox
+        box = (left - padding, top - padding, right + padding, bottom + padding)
+    else:
+        radius = settings.get("radius", 48)
+        box = (0 if row else x - radius, y - radius, width if row else x + radius, y + radius)
+    return (max(0, box[0]), max(0, box[1]), min(width, box[2]), min(height, box[3]))
+
+
+def luminance(image: Image.Image) -> np.ndarray:
+    return np.asarray(image.convert("L"), dtype=np.int16)
+
+
+def changed_pixels(a: np.ndarray, b: np.ndarray, pixel_threshold: float = 24) -> int:
+    """Nombre de pixels dont la luminance diffère de plus de `pixel_threshold` (tous si les tailles diffèrent)"""
+    if a.shape != b.shape:
+        return int(max(a.size, b.size))
+    return int(np.count_nonzero(np.abs(a - b) > pixel_threshold))
+
+
+def _watch(grab: Callable[[], np.ndarray], before: np.ndarray, min_pixels: int, pixel_threshold: float,
+           timeout: float, interval: float) -> int:
+    """Échantillonne une zone jusqu'à `min_pixels` pixels modifiés ou jusqu'au délai ; retourne le dernier décompte"""
+    deadline = time.perf_counter() + timeout
+    while True:
+        changed = changed_pixels(grab(), before, pixel_threshold)
+        if changed >= min_pixels or time.perf_counter() + interval > deadline:
+            return changed
+        time.sleep(interval)
+
+
+def _settled(image_grab, screen: Image.Image, region: Tuple[int, int, int, int], min_pixels: int,
+             pixel_threshold: float, timeout: float, interval: float) -> Image.Image:
+    """
+    Attend que la zone ne change plus (effet de survol en cours) et retourne
+    la dernière capture de l'écran, au plus après `timeout` secondes
+    """
+    previous = luminance(screen.crop(region))
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        time.sleep(interval)
+        current = image_grab.grab()
+        sample = luminance(current.crop(region))
+        if changed_pixels(sample, previous, pixel_threshold) < min_pixels:
+            return current
+        screen, previous = current, sample
+    return screen
+
+
+def perform(name: str, action, target: Optional[Tuple[int, int]] = None, retry_action=None,
+            check: Optional[Callable[[object], Optional[bool]]] = None, row: bool = False,
+            prepare: Optional[Callable[[], None]] = None, retry_wait: float = 0.0,
+            retries: Optional[int] = None):
+    """
+    Exécute une action et vérifie qu'elle a un effet à l'écran
+
+    Args:
+        name (str): Nom de l'action (traçage et messages)
+        action (callable): Action à exécuter
+        target (tuple): Point (x, y) visé ; sans point, seul l'écran entier est observé
+        row (bool): Observer toute la largeur de l'écran autour du point, sans élément connu (saisie)
+        retry_action (callable): Action des nouveaux essais (l'action elle-même par défaut)
+        check (callable): Vérification propre à l'action, appelée avec sa valeur :
+            True (effet confirmé), False (échec, sans nouvel essai) ou None
+            (vérification par les pixels)
+        prepare (callable): Préparation exécutée avant la capture de référence
+            (déplacement du pointeur), dont l'effet sur la zone (survol) est
+            attendu : il n'est pas pris pour un effet de l'action
+        retry_wait (float): Durée minimale, depuis l'action, pendant laquelle
+            l'écran entier est encore observé avant un nouvel essai (un
+            serveur lent ne provoque pas de double clic)
+        retries (int): Nombre de nouveaux essais sans effet observé (celui de
+            la configuration si non spécifié)
+
+    Returns:
+        tuple: (valeur retournée par la dernière exécution, EffectCheck)
+    """
+    global _last_target
+    settings = get_verification_settings()
+    retries = settings.get("retries", 1) if retries is None else retries
+    pixel_threshold = settings.get("pixel_threshold", 24)
+    min_pixels = settings.get("min_pixels", 6)
+    timeout = settings.get("timeout", 0.3)
+    interval = settings.get("interval", 0.01)
+    stability_settings = stability.get_stability_settings()
+    width = stability_settings.get("thumbnail_width", 160)
+    image_grab = get_image_grab()
+
+    with span(f"verify.{name}") as verify_span:
+        start = time.perf_counter()
+        attempts, observed, changed, region = 0, False, 0, None
+        while True:
+            attempts += 1
+            if prepare is not None:
+                prepare()
+            screen = image_grab.grab()
+            if target is not None and region is None:
+                region = action_region(target[0], target[1], screen.size, row)
+            if prepare is not None and region is not None:
+                screen = _settled(image_grab, screen, region, min_pixels, pixel_threshold,
+                                  settings.get("hover_delay", 0.15), interval)
+            reference = stability.thumbnail_of(screen, width)
+            run = action if attempts == 1 or retry_action is None else retry_action
+            acted = time.perf_counter()
+            if region is not None:
+                before = luminance(screen.crop(region))
+                value = run()
+                confirmed = check(value) if check else None
+                if confirmed is None:
+                    changed = _watch(lambda: luminance(image_grab.grab(bbox=region)), before, min_pixels,
+                                     pixel_threshold, timeout, interval)
+                    # Effet hors de la zone (changement de page…) : un dernier coup d'œil à l'écran entier
+                    if changed < min_pixels:
+                        changed = changed_pixels(stability.grab_thumbnail(width), reference, pixel_threshold)
+            else:
+                value = run()
+                confirmed = check(value) if check else None
+                if confirmed is None:
+                    changed = _watch(lambda: stability.grab_thumbnail(width), reference, min_pixels,
+                                     pixel_threshold, timeout, interval)
+            remaining = retry_wait - (time.perf_counter() - acted)
+            if confirmed is None and changed < min_pixels and attempts <= retries and remaining > 0:
+                # Avant un nouvel essai, laisser à l'action le temps d'avoir un effet sur l'écran entier
+                changed = _watch(lambda: stability.grab_thumbnail(width), reference, min_pixels,
+                                 pixel_threshold, remaining, stability_settings.get("interval", 0.05))
+            observed = changed >= min_pixels if confirmed is None else confirmed
+            if observed or confirmed is False or attempts > retries:
+                break
+            print(f"Vérification {name} : aucun effet observé, nouvel essai ({attempts}/{retries})")
+            time.sleep(settings.get("retry_delay", 0.1))
+
+        result = EffectCheck(name, observed, attempts, time.perf_counter() - start, changed, region)
+        verify_span.set(observed=observed, attempts=attempts, waited=result.waited, changed_pixels=changed)
+
+    if target is not None:
+        _last_target = target
+    if observed and stability.is_enabled():
+        # L'effet a commencé : attendre la fin des animations et chargements
+        stability.wait_for_stable(name)
+    return value, result
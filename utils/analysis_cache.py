@@ -0,0 +1,343 @@
+"""
+Module de cache persistant des analyses de captures d'écran
+
+Les analyses sont indexées par l'empreinte de l'image : sa taille, son
+type (écran entier ou zone) et son hash perceptuel (dHash). Deux captures
+visuellement identiques (au curseur clignotant près) de même taille et de
+même type partagent la même entrée, ce qui évite un nouvel appel au modèle
+de vision. Les images presque uniformes (page blanche, écran de
+chargement) n'ont pas d'empreinte : leurs hashs sont trop proches de ceux
+d'écrans peu chargés pour être distingués.
+"""
+import os
+import json
+import time
+import threading
+from typing import Callable, Dict, Optional, Tuple
+import numpy as np
+from PIL import Image
+from utils.config_loader import ConfigLoader
+
+# Taille par défaut du hash perceptuel (16 x 16 = 256 bits)
+DEFAULT_HASH_SIZE = 16
+# Nombre minimal de gradients marqués (écart de luminance > DETAIL_THRESHOLD) d'une image à empreinte
+DEFAULT_MIN_DETAIL = 4
+DETAIL_THRESHOLD = 2
+
+
+def _gradients(image: Image.Image, hash_size: int) -> np.ndarray:
+    """Écarts de luminance horizontaux de l'image réduite à (hash_size + 1) x hash_size"""
+    gray = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16)
+    return gray[:, :-1] - gray[:, 1:]
+
+
+def _hex(gradients: np.ndarray, hash_size: int) -> str:
+    value = 0
+    for bit in (gradients > 0).flat:
+        value = (value << 1) | int(bit)
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+def perceptual_hash(image: Image.Image, hash_size: int = DEFAULT_HASH_SIZE) -> str:
+    """
+    Calcule le hash perceptuel (dHash) d'une image
+
+    Args:
+        image (Image.Image): L'image à hasher
+        hash_size (int): Nombre de gradients par ligne et par colonne
+
+    Returns:
+        str: Le hash sous forme hexadécimale
+    """
+    return _hex(_gradients(image, hash_size), hash_size)
+
+
+def fingerprint(image: Image.Image, kind: str = "screen", hash_size: int = DEFAULT_HASH_SIZE,
+                min_detail: int = DEFAULT_MIN_DETAIL) -> Optional[str]:
+    """
+    Calcule l'empreinte d'une image : `{largeur}x{hauteur}:{type}:{dHash}`
+
+    Args:
+        image (Image.Image): L'image
+        kind (str): Type de l'image ("screen" pour une capture entière, "region" pour une zone)
+        hash_size (int): Taille du hash perceptuel
+        min_detail (int): Nombre minimal de gradients marqués
+
+    Returns:
+        str: L'empreinte, ou None si l'image est presque uniforme
+    """
+    gradients = _gradients(image, hash_size)
+    if np.count_nonzero(np.abs(gradients) > DETAIL_THRESHOLD) < min_detail:
+        return None
+    width, height = image.size
+    return f"{width}x{height}:{kind}:{_hex(gradients, hash_size)}"
+
+
+def hamming_distance(hash_a: str, hash_b: str) -> int:
+    """
+    Calcule la distance de Hamming entre deux hashs hexadécimaux ; deux
+    empreintes de tailles ou de types différents sont à distance maximale
+    """
+    prefix_a, _, hash_a = hash_a.rpartition(":")
+    prefix_b, _, hash_b = hash_b.rpartition(":")
+    if prefix_a != prefix_b or len(hash_a) != len(hash_b):
+        return max(len(hash_a), len(hash_b)) * 4
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+
+class AnalysisCache:
+    """
+    Cache disque des analyses avec éviction LRU (taille, nombre, âge)
+    et single-flight entre threads et entre processus
+    """
+
+    def __init__(self, directory: str, max_entries: int = 500, max_bytes: int = 50 * 1024 * 1024,
+                 max_age: float = 7 * 24 * 3600, max_distance: int = 4,
+                 hash_size: int = DEFAULT_HASH_SIZE, min_detail: int = DEFAULT_MIN_DETAIL,
+                 lock_timeout: float = 120.0):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.min_detail = min_detail
+        self.lock_timeout = lock_timeout
+        self.hits = 0
+        self.misses = 0
+        self.shared_waits = 0
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, threading.Event] = {}
+        self._keys = set()
+        os.makedirs(directory, exist_ok=True)
+        self._load_keys()
+
+    def _load_keys(self) -> None:
+        """Charge la liste des clés présentes sur disque"""
+        self._keys = {f[:-5].replace("_", ":") for f in os.listdir(self.directory) if f.endswith(".json")}
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key.replace(':', '_')}.json")
+
+    def _lock_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key.replace(':', '_')}.lock")
+
+    def key_for(self, image: Image.Image, kind: str = "screen") -> Optional[str]:
+        """
+        Calcule la clé de cache d'une image (son empreinte), ou None si
+        l'image est trop peu détaillée pour être mise en cache
+        """
+        return fingerprint(image, kind, self.hash_size, self.min_detail)
+
+    def _resolve(self, key: str) -> Optional[str]:
+        """Retrouve la clé existante la plus proche dans la tolérance configurée"""
+        if key in self._keys:
+            return key
+        best, best_distance = None, self.max_distance + 1
+        for candidate in self._keys:
+            distance = hamming_distance(key, candidate)
+            if distance < best_distance:
+                best, best_distance = candidate, distance
+        return best
+
+    def _read(self, key: str) -> Optional[str]:
+        """Lit une entrée et met à jour sa date d'accès"""
+        path = self._entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._keys.discard(key)
+            return None
+        if time.time() - entry.get("created", 0) > self.max_age:
+            self._remove(key)
+            return None
+        os.utime(path, None)
+        return entry.get("analysis")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Retourne l'analyse en cache pour une clé, ou None
+
+        Args:
+            key (str): Empreinte de la capture
+        """
+        analysis = self._lookup(key)
+        if analysis is None:
+            self.misses += 1
+        return analysis
+
+    def _lookup(self, key: str) -> Optional[str]:
+        """Recherche une entrée sans compter les absences"""
+        with self._lock:
+            resolved = self._resolve(key)
+            if resolved is None and os.path.exists(self._entry_path(key)):
+                # Entrée écrite par un autre processus
+                self._keys.add(key)
+                resolved = key
+            analysis = self._read(resolved) if resolved else None
+            if analysis is not None:
+                self.hits += 1
+            return analysis
+
+    def put(self, key: str, analysis: str) -> None:
+        """
+        Enregistre une analyse dans le cache puis applique l'éviction
+        """
+        path = self._entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"hash": key, "created": time.time(), "analysis": analysis}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._keys.add(key)
+        self.evict()
+
+    def _remove(self, key: str) -> None:
+        self._keys.discard(key)
+        try:
+            os.remove(self._entry_path(key))
+        except OSError:
+            pass
+
+    def evict(self) -> int:
+        """
+        Supprime les entrées expirées puis les moins récemment utilisées
+        jusqu'à respecter les limites de nombre et de taille
+
+        Returns:
+            int: Nombre d'entrées supprimées
+        """
+        with self._lock:
+            now = time.time()
+            entries = []
+            for key in list(self._keys):
+                try:
+                    stat = os.stat(self._entry_path(key))
+                except OSError:
+                    self._keys.discard(key)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, key))
+
+            removed = 0
+            entries.sort()
+            total_bytes = sum(size for _, size, _ in entries)
+            while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes
+                               or now - entries[0][0] > self.max_age):
+                _, size, key = entries.pop(0)
+                self._remove(key)
+                total_bytes -= size
+                removed += 1
+            return removed
+
+    def _acquire_file_lock(self, key: str) -> bool:
+        """Prend le verrou inter-processus d'une clé, False s'il est déjà pris"""
+        path = self._lock_path(key)
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > self.lock_timeout:
+                    # Verrou abandonné par un processus interrompu
+                    os.remove(path)
+                    return self._acquire_file_lock(key)
+            except OSError:
+                pass
+            return False
+
+    def _release_file_lock(self, key: str) -> None:
+        try:
+            os.remove(self._lock_path(key))
+        except OSError:
+            pass
+
+    def get_or_compute(self, key: str, compute: Callable[[], Optional[str]]) -> Tuple[Optional[str], bool]:
+        """
+        Retourne l'analyse en cache ou la calcule une seule fois, même si
+        plusieurs threads ou processus demandent la même capture
+
+        Args:
+            key (str): Empreinte de la capture
+            compute (Callable): Fonction produisant l'analyse en cas d'absence
+
+        Returns:
+            tuple: (analyse, True si elle provient du cache)
+        """
+        while True:
+            analysis = self._lookup(key)
+            if analysis is not None:
+                return analysis, True
+
+            with self._lock:
+                leader_event = None
+                for inflight_key, event in self._inflight.items():
+                    if hamming_distance(key, inflight_key) <= self.max_distance:
+                        leader_event = event
+                        break
+                if leader_event is None:
+                    own_event = threading.Event()
+                    self._inflight[key] = own_event
+
+            if leader_event is not None:
+                # Un autre thread calcule déjà cette analyse
+                self.shared_waits += 1
+                leader_event.wait(self.lock_timeout)
+                continue
+
+            try:
+                if not self._acquire_file_lock(key):
+                    # Un autre processus calcule déjà cette analyse
+                    self.shared_waits += 1
+                    deadline = time.time() + self.lock_timeout
+                    while os.path.exists(self._lock_path(key)) and time.time() < deadline:
+                        if os.path.exists(self._entry_path(key)):
+                            break
+                        time.sleep(0.1)
+                    continue
+                try:
+                    self.misses += 1
+                    analysis = compute()
+                    if analysis:
+                        self.put(key, analysis)
+                    return analysis, False
+                finally:
+                    self._release_file_lock(key)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                own_event.set()
+
+    def stats(self) -> Dict[str, int]:
+        """Retourne les compteurs du cache"""
+        return {
+            "entries": len(self._keys),
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_waits": self.shared_waits,
+        }
+
+
+_analysis_cache = None
+
+
+def get_analysis_cache() -> Optional[AnalysisCache]:
+    """
+    Retourne l'instance partagée du cache configurée via la section
+    `analysis_cache` de config.yaml, ou None si le cache est désactivé
+    """
+    global _analysis_cache
+    settings = ConfigLoader().get_section("analysis_cache")
+    if not settings.get("enabled", True):
+        return None
+    if _analysis_cache is None:
+        _analysis_cache = AnalysisCache(
+            settings.get("directory") or ConfigLoader().get_analysis_cache_dir(),
+            max_entries=settings.get("max_entries", 500),
+            max_bytes=int(settings.get("max_size_mb", 50) * 1024 * 1024),
+            max_age=settings.get("max_age_hours", 168) * 3600,
+            max_distance=settings.get("max_distance", 4),
+            hash_size=settings.get("hash_size", DEFAULT_HASH_SIZE),
+            min_detail=settings.get("min_detail", DEFAULT_MIN_DETAIL),
+        )
+    return _analysis_cache
@@ -0,0 +1,229 @@
+"""
+Module de stockage des captures d'écran
+
+Les captures sont stockées par contenu (hash SHA-256 des pixels) dans
+`objects/`, ce qui déduplique les images identiques, et indexées dans un
+manifeste SQLite (run, étape, horodatage). La dernière capture et les
+captures d'un run se retrouvent par index, sans parcourir le dossier.
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import namedtuple
+from typing import List, Optional
+from utils.config_loader import ConfigLoader
+
+CaptureRecord = namedtuple("CaptureRecord", ["id", "run_id", "step", "timestamp", "digest", "path"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT,
+    step INTEGER,
+    timestamp REAL NOT NULL,
+    digest TEXT NOT NULL REFERENCES blobs(digest)
+);
+CREATE INDEX IF NOT EXISTS captures_run ON captures(run_id, step);
+CREATE INDEX IF NOT EXISTS captures_timestamp ON captures(timestamp);
+"""
+
+SELECT_CAPTURE = """
+SELECT captures.id, captures.run_id, captures.step, captures.timestamp, captures.digest, blobs.path
+FROM captures JOIN blobs ON blobs.digest = captures.digest
+"""
+
+
+def image_digest(image) -> str:
+    """
+    Calcule l'empreinte d'une image à partir de ses pixels, de sa taille et de son mode
+    """
+    digest = hashlib.sha256(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("ascii"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class ArtifactStore:
+    """
+    Stockage dédupliqué des captures avec manifeste SQLite et rétention
+    """
+
+    def __init__(self, directory: str, max_count: Optional[int] = None, max_age: Optional[float] = None,
+                 max_bytes: Optional[int] = None, compress_level: int = 1, retention_interval: int = 50):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, "objects")
+        self.max_count = max_count
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self.retention_interval = retention_interval
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, "manifest.sqlite3"),
+                                   timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], f"{digest}.png")
+
+    def put(self, image, run_id: Optional[str] = None, step: Optional[int] = None,
+            timestamp: Optional[float] = None, digest: Optional[str] = None) -> CaptureRecord:
+        """
+        Enregistre une capture ; l'image n'est écrite que si son contenu est nouveau
+
+        Args:
+            image (Image.Image): La capture
+            run_id (str): Identifiant du run
+            step (int): Numéro de l'étape dans le run
+            timestamp (float): Horodatage de la capture, l'heure courante si non spécifié
+            digest (str): Empreinte déjà calculée de l'image
+
+        Returns:
+            CaptureRecord: L'entrée du manifeste
+        """
+        digest = digest or image_digest(image)
+        timestamp = timestamp or time.time()
+        path = self._blob_path(digest)
+
+        with self._lock:
+            row = self._db.execute("SELECT path FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if row is None or not os.path.exists(row[0]):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                image.save(tmp_path, format="PNG", compress_level=self.compress_level)
+                os.replace(tmp_path, path)
+                size = os.path.getsize(path)
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if row is None:
+                    self._db.execute(
+                        "INSERT INTO blobs (digest, path, size, refcount) VALUES (?, ?, ?, 1) "
+                        "ON CONFLICT(digest) DO UPDATE SET refcount = refcount + 1",
+                        (digest, path, size))
+                else:
+                    self._db.execute("UPDATE blobs SET refcount = refcount + 1 WHERE digest = ?", (digest,))
+                cursor = self._db.execute(
+                    "INSERT INTO captures (run_id, step, timestamp, digest) VALUES (?, ?, ?, ?)",
+                    (run_id, step, timestamp, digest))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            record = CaptureRecord(cursor.lastrowid, run_id, step, timestamp, digest, path)
+
+            self._writes += 1
+            if self._writes % self.retention_interval == 0:
+                self._apply_retention()
+        return record
+
+    def latest(self) -> Optional[CaptureRecord]:
+        """Retourne la capture la plus récente"""
+        with self._lock:
+            row = self._db.execute(SELECT_CAPTURE + "ORDER BY captures.id DESC LIMIT 1").fetchone()
+        return CaptureRecord(*row) if row else None
+
+    def captures_for_run(self, run_id: str) -> List[CaptureRecord]:
+        """Retourne les captures d'un run, dans l'ordre des étapes"""
+        with self._lock:
+            rows = self._db.execute(SELECT_CAPTURE + "WHERE captures.run_id = ? ORDER BY captures.step, captures.id",
+                                    (run_id,)).fetchall()
+        return [CaptureRecord(*row) for row in rows]
+
+    def apply_retention(self) -> int:
+        """
+        Supprime les captures les plus anciennes au-delà des limites de
+        nombre, d'âge et de taille, puis les images qui ne sont plus référencées
+
+        Returns:
+            int: Nombre de captures supprimées
+        """
+        with self._lock:
+            return self._apply_retention()
+
+    def _apply_retention(self) -> int:
+        doomed = set()
+        if self.max_age is not None:
+            doomed.update(row[0] for row in self._db.execute(
+                "SELECT id FROM captures WHERE timestamp < ?", (time.time() - self.max_age,)))
+        if self.max_count is not None:
+            doomed.update(row[0] for row in self._db.execute(
+                "SELECT id FROM captures ORDER BY id DESC LIMIT -1 OFFSET ?", (self.max_count,)))
+        if self.max_bytes is not None:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total > self.max_bytes:
+                # Les plus anciennes captures d'abord ; une image n'est libérée qu'à sa dernière référence
+                refs = dict(self._db.execute("SELECT digest, refcount FROM blobs"))
+                sizes = dict(self._db.execute("SELECT digest, size FROM blobs"))
+                for capture_id, digest in self._db.execute("SELECT id, digest FROM captures ORDER BY id"):
+                    if total <= self.max_bytes:
+                        break
+                    doomed.add(capture_id)
+                    refs[digest] -= 1
+                    if refs[digest] == 0:
+                        total -= sizes[digest]
+        if not doomed:
+            return 0
+
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for capture_id in doomed:
+                row = self._db.execute("SELECT digest FROM captures WHERE id = ?", (capture_id,)).fetchone()
+                if row is None:
+                    continue
+                self._db.execute("DELETE FROM captures WHERE id = ?", (capture_id,))
+                self._db.execute("UPDATE blobs SET refcount = refcount - 1 WHERE digest = ?", (row[0],))
+            orphans = self._db.execute("SELECT digest, path FROM blobs WHERE refcount <= 0").fetchall()
+            self._db.execute("DELETE FROM blobs WHERE refcount <= 0")
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+        for _, path in orphans:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return len(doomed)
+
+    def stats(self) -> dict:
+        """Retourne le nombre de captures, d'images distinctes et la taille occupée"""
+        with self._lock:
+            captures = self._db.execute("SELECT COUNT(*) FROM captures").fetchone()[0]
+            blobs, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {"captures": captures, "blobs": blobs, "bytes": size}
+
+
+_artifact_stores = {}
+
+
+def get_artifact_store(directory: Optional[str] = None) -> ArtifactStore:
+    """
+    Retourne le stockage partagé des captures d'un dossier (celui de la
+    configuration par défaut), réglé par la section `screenshots` de config.yaml
+    """
+    config = ConfigLoader()
+    if directory is None:
+        directory = config.get_screenshots_dir()
+    if directory not in _artifact_stores:
+        settings = config.get_section("screenshots")
+        retention = settings.get("retention") or {}
+        max_age_hours = retention.get("max_age_hours")
+        max_size_mb = retention.get("max_size_mb")
+        _artifact_stores[directory] = ArtifactStore(
+            directory,
+            max_count=retention.get("max_count"),
+            max_age=max_age_hours * 3600 if max_age_hours is not None else None,
+            max_bytes=int(max_size_mb * 1024 * 1024) if max_size_mb is not None else None,
+            compress_level=settings.get("compress_level", 1),
+            retention_interval=retention.get("interval", 50),
+        )
+    return _artifact_stores[directory]
@@ -0,0 +1,57 @@
+"""
+Module d'accès paresseux aux dépendances d'interface
+
+pyautogui et PIL.ImageGrab ont besoin d'un affichage et sont lents à
+importer : ils ne sont chargés qu'au premier usage, puis conservés.
+Chaque dépendance (y compris webbrowser) peut être remplacée par un objet
+de substitution exposant la même interface, par exemple pour les benchmarks.
+"""
+_pyautogui = None
+_image_grab = None
+_webbrowser = None
+
+
+def get_pyautogui():
+    """Retourne le module pyautogui, importé au premier appel"""
+    global _pyautogui
+    if _pyautogui is None:
+        import pyautogui
+        _pyautogui = pyautogui
+    return _pyautogui
+
+
+def get_image_grab():
+    """Retourne le module PIL.ImageGrab, importé au premier appel"""
+    global _image_grab
+    if _image_grab is None:
+        from PIL import ImageGrab
+        _image_grab = ImageGrab
+    return _image_grab
+
+
+def get_webbrowser():
+    """Retourne le module webbrowser, importé au premier appel"""
+    global _webbrowser
+    if _webbrowser is None:
+        import webbrowser
+        _webbrowser = webbrowser
+    return _webbrowser
+
+
+def set_backends(pyautogui=None, image_grab=None, webbrowser=None):
+    """
+    Remplace les dépendances d'interface par des objets de substitution
+
+    Args:
+        pyautogui: Objet exposant moveTo, click, typewrite…
+        image_grab: Objet exposant grab()
+        webbrowser: Objet exposant open(url)
+
+    Returns:
+        tuple: Les dépendances précédentes (pyautogui, image_grab, webbrowser),
+            à repasser à set_backends pour les restaurer
+    """
+    global _pyautogui, _image_grab, _webbrowser
+    previous = (_pyautogui, _image_grab, _webbrowser)
+    _pyautogui, _image_grab, _webbrowser = pyautogui, image_grab, webbrowser
+    return previous
@@ -1,27 +1,46 @@
 """
 Module pour l'automatisation du navigateur
 """
-import webbrowser
 import time
 from utils.config_loader import ConfigLoader
+from utils.backends import get_webbrowser
+from utils.tracing import span
+from utils import stability
 
 # Initialisation de la configuration
 config = ConfigLoader()
 
-def open_url():
+def open_url(url=None):
     """
     Ouvre le navigateur par défaut sur l'URL spécifiée dans la configuration
+
+    Args:
+        url (str, optional): URL à ouvrir à la place de celle de la configuration
             
     Returns:
         bool: True si le navigateur a été ouvert avec succès, False sinon
     """
     try:
         # Ouvre l'URL dans le navigateur par défaut
-        url = config.browser.get("url", "https://www.google.com")
-        webbrowser.open(url)
-        
-        # Attendre que la page se charge
-        time.sleep(config.browser.get("wait_time", 2))
+        if url is None:
+            url = config.browser.get("url", "https://www.google.com")
+        wait_time = config.browser.get("wait_time", 2)
+
+        if stability.is_enabled():
+            # Attendre que la page ait changé puis soit stable (y compris pendant un
+            # écran de chargement bref), au plus page_timeout secondes
+            settings = stability.get_stability_settings()
+            stability.settle("page", lambda: get_webbrowser().open(url),
+                             timeout=settings.get("page_timeout", 10),
+                             change_timeout=settings.get("page_change_timeout", 3),
+                             stable_frames=settings.get("page_stable_frames", 8),
+                             fallback=wait_time)
+        else:
+            get_webbrowser().open(url)
+
+            # Attendre que la page se charge
+            with span("browser.wait", seconds=wait_time):
+                time.sleep(wait_time)
         
         print(f"Navigateur ouvert sur {url}")
         return True
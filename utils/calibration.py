@@ -0,0 +1,371 @@
+"""
+Module de calibration des coordonnées
+
+Les positions annoncées par le modèle dérivent de façon systématique
+(décalage, échelle, parfois légère inclinaison) selon l'écran. Une
+transformation affine est ajustée par moindres carrés entre les centres
+prédits des éléments et leurs centres réels, détectés localement dans la
+capture autour de chaque position prédite. Une calibration est conservée
+par affichage (résolution et facteur d'échelle) et appliquée en bloc aux
+coordonnées de tous les éléments au moment de l'analyse.
+"""
+import os
+import json
+import time
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from PIL import Image
+from utils.config_loader import ConfigLoader
+from utils.ui_elements import UIElement
+from utils.tracing import span
+
+CALIBRATION_VERSION = 1
+
+
+class AffineCalibration:
+    """
+    Transformation affine des coordonnées : [x', y'] = A · [x, y, 1]
+    """
+    __slots__ = ("matrix", "samples", "rms")
+
+    def __init__(self, matrix=None, samples: int = 0, rms: Optional[float] = None):
+        self.matrix = np.array(matrix if matrix is not None else [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], dtype=np.float64)
+        self.samples = samples
+        # Erreur quadratique moyenne de l'ajustement, en pixels
+        self.rms = rms
+
+    @classmethod
+    def from_offsets(cls, offset_x: float = 0, offset_y: float = 0,
+                     scale_x: float = 1.0, scale_y: float = 1.0) -> "AffineCalibration":
+        """Calibration d'échelle et de décalage (x' = x * scale_x + offset_x)"""
+        return cls([[scale_x, 0.0, offset_x], [0.0, scale_y, offset_y]])
+
+    @property
+    def is_identity(self) -> bool:
+        return bool(np.allclose(self.matrix, [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]))
+
+    def apply(self, points: np.ndarray) -> np.ndarray:
+        """Transforme un tableau de points (n x 2)"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        return points @ self.matrix[:, :2].T + self.matrix[:, 2]
+
+    def to_dict(self) -> Dict:
+        return {"matrix": np.round(self.matrix, 6).tolist(), "samples": self.samples,
+                "rms": None if self.rms is None else round(self.rms, 3)}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "AffineCalibration":
+        return cls(data["matrix"], data.get("samples", 0), data.get("rms"))
+
+    def __repr__(self) -> str:
+        rms = "?" if self.rms is None else f"{self.rms:.2f}"
+        return f"AffineCalibration({np.round(self.matrix, 4).tolist()}, samples={self.samples}, rms={rms})"
+
+
+def _residuals(design: np.ndarray, actual: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    return np.linalg.norm(design @ matrix.T - actual, axis=1)
+
+
+def _solve(predicted: np.ndarray, actual: np.ndarray) -> np.ndarray:
+    design = np.hstack([predicted, np.ones((len(predicted), 1))])
+    if len(predicted) >= 3 and np.linalg.matrix_rank(design) == 3:
+        solution, *_ = np.linalg.lstsq(design, actual, rcond=None)
+        return solution.T
+    # Trop peu de points, ou points alignés : décalage moyen seul
+    offset = (actual - predicted).mean(axis=0)
+    return np.array([[1.0, 0.0, offset[0]], [0.0, 1.0, offset[1]]])
+
+
+def fit_affine(predicted, actual) -> AffineCalibration:
+    """
+    Ajuste par moindres carrés la transformation affine envoyant les points
+    prédits sur les points réels
+
+    Les points aberrants (détection erronée) sont écartés après un premier
+    ajustement. Avec moins de trois points non alignés, seul un décalage
+    est ajusté.
+
+    Args:
+        predicted: Centres prédits (n x 2)
+        actual: Centres détectés (n x 2)
+
+    Returns:
+        AffineCalibration: La transformation, avec son erreur quadratique moyenne
+    """
+    predicted = np.asarray(predicted, dtype=np.float64).reshape(-1, 2)
+    actual = np.asarray(actual, dtype=np.float64).reshape(-1, 2)
+    if not len(predicted) or len(predicted) != len(actual):
+        raise ValueError("Les points prédits et réels doivent être non vides et de même nombre")
+
+    matrix = _solve(predicted, actual)
+    design = np.hstack([predicted, np.ones((len(predicted), 1))])
+    residuals = _residuals(design, actual, matrix)
+    inliers = residuals <= 3 * np.median(residuals) + 2.0
+    if 3 <= inliers.sum() < len(predicted):
+        predicted, actual, design = predicted[inliers], actual[inliers], design[inliers]
+        matrix = _solve(predicted, actual)
+        residuals = _residuals(design, actual, matrix)
+    return AffineCalibration(matrix, len(predicted), float(np.sqrt(np.mean(residuals ** 2))))
+
+
+def _run_around(active: np.ndarray, center: int, gap: int) -> Optional[Tuple[int, int]]:
+    """
+    Retourne la plage d'indices actifs (trous de `gap` au plus tolérés)
+    contenant `center`, ou la plus proche
+    """
+    indices = np.flatnonzero(active)
+    if not len(indices):
+        return None
+    runs = np.split(indices, np.flatnonzero(np.diff(indices) > gap + 1) + 1)
+    distances = [0 if run[0] <= center <= run[-1] else min(abs(run[0] - center), abs(run[-1] - center))
+                 for run in runs]
+    run = runs[int(np.argmin(distances))]
+    return int(run[0]), int(run[-1])
+
+
+def detect_center(image: Image.Image, element: UIElement, margin: int = 24,
+                  pixel_threshold: float = 24, gap: int = 3) -> Optional[Tuple[float, float]]:
+    """
+    Détecte le centre réel d'un élément autour de sa position prédite
+
+    La zone prédite, élargie de `margin`, est comparée à la couleur de fond
+    (médiane de son pourtour) ; la plage de pixels contrastés contenant la
+    position prédite donne la boîte réelle de l'élément.
+
+    Returns:
+        tuple: Centre (x, y) en pixels de la capture, ou None si l'élément
+            n'est pas isolé dans la zone ou si sa taille détectée ne
+            correspond pas à la taille prédite
+    """
+    half_w = max(element.width // 2, 8) + margin
+    half_h = max(element.height // 2, 8) + margin
+    left, top = max(0, element.x - half_w), max(0, element.y - half_h)
+    right, bottom = min(image.size[0], element.x + half_w), min(image.size[1], element.y + half_h)
+    if right - left < 4 or bottom - top < 4:
+        return None
+    window = np.asarray(image.crop((left, top, right, bottom)).convert("L"), dtype=np.int16)
+    border = np.concatenate([window[0], window[-1], window[:, 0], window[:, -1]])
+    mask = np.abs(window - np.median(border)) > pixel_threshold
+
+    cx, cy = element.x - left, element.y - top
+    columns = _run_around(mask.any(axis=0), cx, gap)
+    if columns is None:
+        return None
+    rows = _run_around(mask[:, columns[0]:columns[1] + 1].any(axis=1), cy, gap)
+    if rows is None:
+        return None
+    columns = _run_around(mask[rows[0]:rows[1] + 1].any(axis=0), cx, gap)
+
+    # Un élément touchant le bord de la zone n'est pas isolé : boîte incertaine
+    height, width = mask.shape
+    if columns[0] == 0 or rows[0] == 0 or columns[1] == width - 1 or rows[1] == height - 1:
+        return None
+    detected_w, detected_h = columns[1] - columns[0] + 1, rows[1] - rows[0] + 1
+    for predicted, detected in ((element.width, detected_w), (element.height, detected_h)):
+        if predicted and not 0.5 <= detected / predicted <= 2.0:
+            return None
+    return left + (columns[0] + columns[1]) / 2.0, top + (rows[0] + rows[1]) / 2.0
+
+
+def collect_samples(image: Image.Image, elements: Iterable[UIElement],
+                    settings: Optional[Dict] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Associe les centres prédits des éléments à leurs centres détectés
+
+    Returns:
+        tuple: (centres prédits, centres détectés), tableaux n x 2
+    """
+    settings = get_calibration_settings() if settings is None else settings
+    predicted, actual = [], []
+    for element in elements:
+        center = detect_center(image, element, margin=settings.get("search_margin", 24),
+                               pixel_threshold=settings.get("pixel_threshold", 24), gap=settings.get("gap", 3))
+        if center is not None:
+            predicted.append(element.center)
+            actual.append(center)
+    return np.array(predicted, dtype=np.float64).reshape(-1, 2), np.array(actual, dtype=np.float64).reshape(-1, 2)
+
+
+def display_key(image_size: Tuple[int, int], scale: Optional[float] = None) -> str:
+    """
+    Identifiant d'un affichage : résolution de la capture, suivie du facteur
+    d'échelle (DPI) lorsqu'il diffère de 1 (« 2560x1600@2x »)
+    """
+    key = f"{image_size[0]}x{image_size[1]}"
+    if scale and abs(scale - 1.0) > 0.01:
+        key += f"@{scale:g}x"
+    return key
+
+
+def current_display_key(image_size: Tuple[int, int]) -> str:
+    """
+    Identifiant de l'affichage d'une capture ; le facteur d'échelle est le
+    rapport entre la capture et la taille logique de l'écran (pyautogui)
+    """
+    scale = None
+    try:
+        from utils.backends import get_pyautogui
+
+        screen_width = get_pyautogui().size()[0]
+        scale = round(image_size[0] / float(screen_width), 2) if screen_width else None
+    except Exception:
+        # Pas d'affichage (analyse d'une capture sur disque) : résolution seule
+        pass
+    return display_key(image_size, scale)
+
+
+class CalibrationStore:
+    """
+    Calibrations par affichage, persistées dans un fichier JSON
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._displays: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._displays = json.load(f).get("displays", {})
+            except (OSError, ValueError) as e:
+                print(f"Erreur lors du chargement des calibrations : {str(e)}")
+
+    def get(self, key: str) -> Optional[AffineCalibration]:
+        with self._lock:
+            entry = self._displays.get(key)
+        return AffineCalibration.from_dict(entry) if entry else None
+
+    def set(self, key: str, calibration: AffineCalibration) -> None:
+        """Enregistre la calibration d'un affichage"""
+        with self._lock:
+            self._displays[key] = dict(calibration.to_dict(), updated=time.time())
+            self._save()
+
+    def remove(self, key: str) -> bool:
+        with self._lock:
+            removed = self._displays.pop(key, None) is not None
+            if removed:
+                self._save()
+        return removed
+
+    def displays(self) -> List[str]:
+        with self._lock:
+            return sorted(self._displays)
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": CALIBRATION_VERSION, "displays": self._displays}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def get_calibration_settings() -> Dict:
+    """Retourne la section `calibration` de la configuration"""
+    return ConfigLoader().get_section("calibration")
+
+
+_calibration_stores: Dict[str, CalibrationStore] = {}
+_default_calibration: Optional[AffineCalibration] = None
+
+
+def get_calibration_store() -> CalibrationStore:
+    """Retourne le stockage des calibrations, partagé par chemin"""
+    config = ConfigLoader()
+    path = get_calibration_settings().get("path") or config.get_calibration_path()
+    if path not in _calibration_stores:
+        _calibration_stores[path] = CalibrationStore(path)
+    return _calibration_stores[path]
+
+
+def set_default_calibration(calibration: Optional[AffineCalibration]) -> None:
+    """
+    Définit la calibration utilisée pour les affichages sans calibration
+    ajustée (paramètres manuels de décalage et d'échelle)
+    """
+    global _default_calibration
+    _default_calibration = calibration
+
+
+def get_calibration(key: str) -> Optional[AffineCalibration]:
+    """Retourne la calibration d'un affichage, sinon la calibration par défaut"""
+    return get_calibration_store().get(key) or _default_calibration
+
+
+def calibrate(image: Image.Image, elements: Iterable[UIElement], key: Optional[str] = None,
+              save: bool = True) -> Optional[AffineCalibration]:
+    """
+    Ajuste la calibration d'un affichage à partir d'une capture et des
+    éléments analysés (non calibrés) de cette capture
+
+    Args:
+        image (Image.Image): La capture analysée
+        elements: Les éléments aux positions prédites par le modèle
+        key (str): Affichage calibré, celui de la capture si non spécifié
+        save (bool): Enregistrer la calibration si elle est acceptée
+
+    Returns:
+        AffineCalibration: La calibration, ou None si les points détectés
+            sont trop peu nombreux ou l'ajustement trop imprécis
+    """
+    settings = get_calibration_settings()
+    key = key or current_display_key(image.size)
+    with span("calibration.fit", display=key) as fit_span:
+        predicted, actual = collect_samples(image, elements, settings)
+        fit_span.set(samples=len(predicted))
+        if len(predicted) < settings.get("min_samples", 3):
+            print(f"Calibration {key} : {len(predicted)} élément(s) détecté(s), calibration inchangée")
+            return None
+        calibration = fit_affine(predicted, actual)
+        fit_span.set(rms=calibration.rms)
+    if calibration.rms > settings.get("max_residual", 8.0):
+        print(f"Calibration {key} : erreur résiduelle trop élevée ({calibration.rms:.1f} px), calibration inchangée")
+        return None
+    if save:
+        get_calibration_store().set(key, calibration)
+    print(f"Calibration {key} : {calibration.samples} points, erreur résiduelle {calibration.rms:.2f} px")
+    return calibration
+
+
+def apply_calibration(elements: List[UIElement], image_size: Tuple[int, int],
+                      calibration: Optional[AffineCalibration] = None) -> Optional[AffineCalibration]:
+    """
+    Applique en bloc la calibration de l'affichage aux positions des éléments
+    (les tailles suivent les facteurs d'échelle)
+
+    Returns:
+        AffineCalibration: La calibration appliquée, ou None
+    """
+    if calibration is None:
+        calibration = get_calibration(current_display_key(image_size))
+    if calibration is None or calibration.is_identity or not elements:
+        return None
+    centers = calibration.apply([element.center for element in elements])
+    centers = np.rint(centers).astype(int)
+    scale_x, scale_y = np.abs(calibration.matrix[0, 0]), np.abs(calibration.matrix[1, 1])
+    width, height = image_size
+    for element, (x, y) in zip(elements, centers):
+        element.x = int(min(max(x, 0), width - 1))
+        element.y = int(min(max(y, 0), height - 1))
+        element.width = int(round(element.width * scale_x))
+        element.height = int(round(element.height * scale_y))
+    return calibration
+
+
+def calibrate_and_apply(elements: List[UIElement], image: Optional[Image.Image] = None,
+                        image_size: Optional[Tuple[int, int]] = None) -> Optional[AffineCalibration]:
+    """
+    Calibre les éléments d'une analyse : ajustement sur la capture si
+    `auto_fit` est activé, puis application de la calibration de l'affichage
+    """
+    settings = get_calibration_settings()
+    if not settings.get("enabled", True):
+        return None
+    image_size = image.size if image is not None else image_size
+    if image_size is None:
+        return None
+    calibration = None
+    if image is not None and settings.get("auto_fit", False):
+        calibration = calibrate(image, elements)
+    return apply_calibration(elements, image_size, calibration)
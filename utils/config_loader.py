@@ -8,6 +8,7 @@ from typing import Dict, Any
 class ConfigLoader:
     _instance = None
     _config = None
+    _directories_created = False
 
     def __new__(cls):
         if cls._instance is None:
@@ -15,8 +16,9 @@ class ConfigLoader:
         return cls._instance
 
     def __init__(self):
-        if self._config is None:
-            self.load_config()
+        # The configuration is loaded and the directories are created on first use,
+        # so that instantiating the loader at import time costs nothing
+        pass
 
     def load_config(self, config_path: str = "config.yaml") -> None:
         """Load configuration from yaml file"""
@@ -25,9 +27,15 @@ class ConfigLoader:
         
         with open(config_path, 'r', encoding='utf-8') as f:
             self._config = yaml.safe_load(f)
-            
-        # Ensure required paths exist
-        self._create_directories()
+
+        # Required paths are created again on next access
+        self._directories_created = False
+
+    def _ensure_directories(self) -> None:
+        """Create required directories once, on first path access"""
+        if not self._directories_created:
+            self._directories_created = True
+            self._create_directories()
 
     def _create_directories(self) -> None:
         """Create required directories if they don't exist"""
@@ -57,9 +65,14 @@ class ConfigLoader:
     def browser(self) -> Dict[str, Any]:
         """Get browser configuration"""
         return self.get_config()['browser']
+
+    def get_section(self, name: str) -> Dict[str, Any]:
+        """Get an optional configuration section (empty dict if missing)"""
+        return self.get_config().get(name) or {}
         
     def get_data_dir(self) -> str:
         """Get the data directory path"""
+        self._ensure_directories()
         return self.paths['data_dir']
         
     def get_screenshots_dir(self) -> str:
@@ -69,7 +82,31 @@ class ConfigLoader:
     def get_analyses_dir(self) -> str:
         """Get the analyses directory path"""
         return os.path.join(self.get_data_dir(), 'analyses')
+
+    def get_analysis_cache_dir(self) -> str:
+        """Get the analysis cache directory path"""
+        return os.path.join(self.get_analyses_dir(), 'cache')
         
+    def get_templates_dir(self) -> str:
+        """Get the known element templates library directory path"""
+        return os.path.join(self.get_analyses_dir(), 'templates')
+
+    def get_cassettes_dir(self) -> str:
+        """Get the recorded model interactions directory path"""
+        return os.path.join(self.get_data_dir(), 'cassettes')
+
+    def get_calibration_path(self) -> str:
+        """Get the per-display coordinate calibrations file path"""
+        return os.path.join(self.get_data_dir(), 'calibration.json')
+
+    def get_state_graph_path(self) -> str:
+        """Get the persisted screen state graph file path"""
+        return os.path.join(self.get_data_dir(), 'state_graph.json')
+
     def get_ui_description_path(self) -> str:
         """Get the ui description file path"""
-        return os.path.join(self.get_analyses_dir(), 'ui_description.txt')
\ No newline at end of file
+        return os.path.join(self.get_analyses_dir(), 'ui_description.txt')
+
+    def get_ui_elements_path(self) -> str:
+        """Get the structured ui elements index path"""
+        return os.path.join(self.get_analyses_dir(), 'ui_elements.json')
\ No newline at end of file
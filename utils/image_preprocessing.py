@@ -0,0 +1,192 @@
+"""
+Module de prétraitement des captures d'écran avant leur envoi au modèle
+
+Le prétraitement recadre la capture (suppression de l'interface du
+navigateur), la réduit à une taille cible puis la réencode dans un format
+compact. La transformation appliquée est conservée pour ramener les
+coordonnées renvoyées par le modèle dans l'espace de l'écran d'origine.
+"""
+import io
+import re
+from typing import Any, Dict, Optional, Tuple
+from PIL import Image
+from utils.config_loader import ConfigLoader
+
+MEDIA_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+
+# Coordonnées au format "x = 123, y = 456" (ou "x≈123 y≈456", "x: 123, y: 456")
+POSITION_PATTERN = re.compile(
+    r"(x\s*[=≈:]\s*)(-?\d+(?:[.,]\d+)?)(\s*,?\s*y\s*[=≈:]\s*)(-?\d+(?:[.,]\d+)?)",
+    re.IGNORECASE,
+)
+# Tailles au format "Taille: 120 x 40"
+SIZE_PATTERN = re.compile(r"(Taille\s*:\s*)(\d+(?:[.,]\d+)?)(\s*[x×]\s*)(\d+(?:[.,]\d+)?)", re.IGNORECASE)
+
+
+class ImageTransform:
+    """
+    Transformation entre l'image envoyée au modèle et l'écran d'origine
+    """
+    __slots__ = ("offset_x", "offset_y", "scale")
+
+    def __init__(self, offset_x: int = 0, offset_y: int = 0, scale: float = 1.0):
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+        # Rapport taille traitée / taille d'origine
+        self.scale = scale
+
+    @property
+    def is_identity(self) -> bool:
+        return self.offset_x == 0 and self.offset_y == 0 and self.scale == 1.0
+
+    def to_screen(self, x: float, y: float) -> Tuple[int, int]:
+        """Convertit un point de l'image traitée en coordonnées écran"""
+        return (round(x / self.scale + self.offset_x), round(y / self.scale + self.offset_y))
+
+    def to_screen_size(self, width: float, height: float) -> Tuple[int, int]:
+        """Convertit une taille de l'image traitée en taille écran"""
+        return (round(width / self.scale), round(height / self.scale))
+
+
+class PreprocessedImage:
+    """
+    Résultat du prétraitement d'une capture
+    """
+
+    def __init__(self, data: bytes, media_type: str, size: Tuple[int, int],
+                 transform: ImageTransform, bytes_before: Optional[int]):
+        self.data = data
+        self.media_type = media_type
+        self.width, self.height = size
+        self.transform = transform
+        self.bytes_before = bytes_before
+        self.bytes_after = len(data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Retourne les statistiques de taille du prétraitement"""
+        stats = {
+            "bytes_before": self.bytes_before,
+            "bytes_after": self.bytes_after,
+            "width": self.width,
+            "height": self.height,
+            "media_type": self.media_type,
+        }
+        if self.bytes_before:
+            stats["ratio"] = round(self.bytes_after / self.bytes_before, 3)
+        return stats
+
+
+def get_preprocessing_settings() -> Dict[str, Any]:
+    """
+    Retourne la section `preprocessing` de la configuration
+    """
+    return ConfigLoader().get_section("preprocessing")
+
+
+def preprocess_screenshot(image: Image.Image, crop: Optional[Dict[str, int]] = None,
+                          max_long_edge: Optional[int] = None, image_format: str = "PNG",
+                          quality: int = 85, bytes_before: Optional[int] = None) -> PreprocessedImage:
+    """
+    Recadre, réduit et réencode une capture d'écran
+
+    Args:
+        image (Image.Image): La capture d'origine
+        crop (dict): Marges à retirer en pixels (top, bottom, left, right)
+        max_long_edge (int): Longueur maximale du plus grand côté après réduction
+        image_format (str): Format de sortie (PNG, JPEG ou WEBP)
+        quality (int): Qualité de compression pour JPEG et WEBP
+        bytes_before (int): Taille de la capture d'origine, pour les statistiques
+
+    Returns:
+        PreprocessedImage: L'image encodée et la transformation appliquée
+    """
+    crop = crop or {}
+    width, height = image.size
+    left = max(0, min(int(crop.get("left", 0)), width - 1))
+    top = max(0, min(int(crop.get("top", 0)), height - 1))
+    right = max(left + 1, width - int(crop.get("right", 0)))
+    bottom = max(top + 1, height - int(crop.get("bottom", 0)))
+    if (left, top, right, bottom) != (0, 0, width, height):
+        image = image.crop((left, top, right, bottom))
+
+    scale = 1.0
+    long_edge = max(image.size)
+    if max_long_edge and long_edge > max_long_edge:
+        scale = max_long_edge / long_edge
+        new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(new_size, Image.LANCZOS)
+
+    image_format = image_format.upper()
+    if image_format == "JPG":
+        image_format = "JPEG"
+    buffer = io.BytesIO()
+    try:
+        if image_format == "PNG":
+            image.save(buffer, format="PNG", optimize=False, compress_level=6)
+        else:
+            image.convert("RGB").save(buffer, format=image_format, quality=quality)
+    except (KeyError, OSError) as e:
+        # Encodeur indisponible (ex. WEBP sans libwebp) : repli sur JPEG
+        print(f"Format {image_format} indisponible ({str(e)}), utilisation de JPEG")
+        image_format = "JPEG"
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality)
+
+    return PreprocessedImage(
+        buffer.getvalue(),
+        MEDIA_TYPES.get(image_format, "image/png"),
+        image.size,
+        ImageTransform(left, top, scale),
+        bytes_before,
+    )
+
+
+def preprocess_from_config(image: Image.Image, bytes_before: Optional[int] = None) -> PreprocessedImage:
+    """
+    Prétraite une capture selon la section `preprocessing` de config.yaml
+    """
+    settings = get_preprocessing_settings()
+    if not settings.get("enabled", True):
+        return preprocess_screenshot(image, bytes_before=bytes_before)
+    return preprocess_screenshot(
+        image,
+        crop=settings.get("crop"),
+        max_long_edge=settings.get("max_long_edge"),
+        image_format=settings.get("format", "PNG"),
+        quality=settings.get("quality", 85),
+        bytes_before=bytes_before,
+    )
+
+
+def _to_number(value: str) -> float:
+    return float(value.replace(",", "."))
+
+
+def map_analysis_coordinates(analysis: str, transform: ImageTransform) -> str:
+    """
+    Ramène les positions et tailles d'une analyse dans l'espace écran d'origine
+
+    Args:
+        analysis (str): L'analyse produite sur l'image prétraitée
+        transform (ImageTransform): La transformation appliquée à la capture
+
+    Returns:
+        str: L'analyse avec des coordonnées écran
+    """
+    if transform.is_identity:
+        return analysis
+
+    def replace_position(match):
+        x, y = transform.to_screen(_to_number(match.group(2)), _to_number(match.group(4)))
+        return f"{match.group(1)}{x}{match.group(3)}{y}"
+
+    def replace_size(match):
+        width, height = transform.to_screen_size(_to_number(match.group(2)), _to_number(match.group(4)))
+        return f"{match.group(1)}{width}{match.group(3)}{height}"
+
+    analysis = POSITION_PATTERN.sub(replace_position, analysis)
+    return SIZE_PATTERN.sub(replace_size, analysis)
@@ -0,0 +1,116 @@
+"""
+Module de détection des zones modifiées entre deux captures d'écran
+"""
+from typing import List, Tuple
+import numpy as np
+from PIL import Image
+
+Box = Tuple[int, int, int, int]
+
+
+def diff_mask(previous: Image.Image, current: Image.Image, threshold: int = 24) -> np.ndarray:
+    """
+    Calcule le masque des pixels modifiés entre deux captures de même taille
+
+    Args:
+        previous (Image.Image): Capture précédente
+        current (Image.Image): Capture courante
+        threshold (int): Écart minimal de luminance pour considérer un pixel modifié
+
+    Returns:
+        np.ndarray: Masque booléen (hauteur x largeur)
+    """
+    before = np.asarray(previous.convert("L"), dtype=np.int16)
+    after = np.asarray(current.convert("L"), dtype=np.int16)
+    return np.abs(after - before) > threshold
+
+
+def _block_mask(mask: np.ndarray, block_size: int, min_pixels: int) -> np.ndarray:
+    """Réduit le masque de pixels en masque de blocs block_size x block_size"""
+    height, width = mask.shape
+    rows = -(-height // block_size)
+    cols = -(-width // block_size)
+    padded = np.zeros((rows * block_size, cols * block_size), dtype=np.uint16)
+    padded[:height, :width] = mask
+    counts = padded.reshape(rows, block_size, cols, block_size).sum(axis=(1, 3))
+    return counts >= min_pixels
+
+
+def _dilate(blocks: np.ndarray, steps: int) -> np.ndarray:
+    """Dilate un masque de blocs (voisinage 8-connexe) pour fusionner les zones proches"""
+    for _ in range(steps):
+        grown = blocks.copy()
+        grown[1:, :] |= blocks[:-1, :]
+        grown[:-1, :] |= blocks[1:, :]
+        grown[:, 1:] |= blocks[:, :-1]
+        grown[:, :-1] |= blocks[:, 1:]
+        grown[1:, 1:] |= blocks[:-1, :-1]
+        grown[:-1, :-1] |= blocks[1:, 1:]
+        grown[1:, :-1] |= blocks[:-1, 1:]
+        grown[:-1, 1:] |= blocks[1:, :-1]
+        blocks = grown
+    return blocks
+
+
+def changed_regions(mask: np.ndarray, block_size: int = 16, min_pixels: int = 4,
+                    merge_gap: int = 1, padding: int = 8) -> List[Box]:
+    """
+    Regroupe les pixels modifiés en boîtes englobantes
+
+    Le masque est réduit en blocs, les blocs voisins (à `merge_gap` blocs
+    près) sont regroupés en composantes connexes et chaque composante donne
+    une boîte en pixels, élargie de `padding`.
+
+    Args:
+        mask (np.ndarray): Masque booléen des pixels modifiés
+        block_size (int): Taille des blocs de regroupement en pixels
+        min_pixels (int): Nombre minimal de pixels modifiés pour retenir un bloc
+        merge_gap (int): Distance en blocs en dessous de laquelle deux zones fusionnent
+        padding (int): Marge ajoutée autour de chaque boîte
+
+    Returns:
+        list: Boîtes (left, top, right, bottom) en pixels
+    """
+    height, width = mask.shape
+    blocks = _block_mask(mask, block_size, min_pixels)
+    if not blocks.any():
+        return []
+    grouped = _dilate(blocks, merge_gap)
+
+    labels = np.zeros(grouped.shape, dtype=np.int32)
+    rows, cols = grouped.shape
+    boxes = []
+    for start in zip(*np.nonzero(grouped)):
+        if labels[start]:
+            continue
+        label = len(boxes) + 1
+        labels[start] = label
+        stack = [start]
+        members = []
+        while stack:
+            r, c = stack.pop()
+            members.append((r, c))
+            for nr in (r - 1, r, r + 1):
+                for nc in (c - 1, c, c + 1):
+                    if 0 <= nr < rows and 0 <= nc < cols and grouped[nr, nc] and not labels[nr, nc]:
+                        labels[nr, nc] = label
+                        stack.append((nr, nc))
+        member_rows, member_cols = np.array(members).T
+        # Restreindre la boîte aux blocs réellement modifiés de la composante
+        changed = blocks[member_rows, member_cols]
+        if changed.any():
+            member_rows, member_cols = member_rows[changed], member_cols[changed]
+        boxes.append((
+            max(0, int(member_cols.min()) * block_size - padding),
+            max(0, int(member_rows.min()) * block_size - padding),
+            min(width, (int(member_cols.max()) + 1) * block_size + padding),
+            min(height, (int(member_rows.max()) + 1) * block_size + padding),
+        ))
+    return boxes
+
+
+def changed_ratio(boxes: List[Box], size: Tuple[int, int]) -> float:
+    """Proportion de la surface de l'écran couverte par les boîtes"""
+    width, height = size
+    area = sum((right - left) * (bottom - top) for left, top, right, bottom in boxes)
+    return area / float(width * height) if width and height else 1.0
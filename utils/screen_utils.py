@@ -1,47 +1,161 @@
 """
 Module pour la capture d'ecran
+
+Les captures sont retournees en memoire pour etre transmises directement a
+l'analyse ; leur archivage dans le stockage deduplique des captures est
+confie a un thread d'ecriture en arriere-plan.
 """
-from PIL import ImageGrab
 from datetime import datetime
 import os
+import queue
+import itertools
+import threading
 from utils.config_loader import ConfigLoader
+from utils.artifact_store import get_artifact_store
+from utils.backends import get_image_grab
 
 # Initialisation de la configuration
 config = ConfigLoader()
 
-def take_screenshot(directory=None):
+# Run courant et numero d'etape des captures
+_run_id = None
+_steps = itertools.count(1)
+
+
+class Capture:
     """
-    Prend une capture d'ecran et la sauvegarde dans le dossier specifie
-    
+    Capture d'ecran en memoire ; le chemin de son archive sur disque est
+    renseigne une fois l'archivage termine
+    """
+    __slots__ = ("image", "path", "timestamp", "run_id", "step", "directory")
+
+    def __init__(self, image, timestamp, run_id=None, step=None, directory=None):
+        self.image = image
+        self.path = None
+        self.timestamp = timestamp
+        self.run_id = run_id
+        self.step = step
+        self.directory = directory
+
+
+class ScreenshotArchiver:
+    """
+    Ecrit les captures dans le stockage des captures depuis un thread d'arriere-plan
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="screenshot-archiver", daemon=True)
+                self._thread.start()
+
+    def submit(self, capture):
+        """Planifie l'archivage d'une capture"""
+        self._ensure_started()
+        self._queue.put(capture)
+
+    def _run(self):
+        while True:
+            capture = self._queue.get()
+            try:
+                record = get_artifact_store(capture.directory).put(
+                    capture.image, run_id=capture.run_id, step=capture.step,
+                    timestamp=capture.timestamp.timestamp())
+                capture.path = record.path
+            except Exception as e:
+                print(f"Erreur lors de l'archivage de la capture : {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Attend la fin de l'ecriture des captures en attente"""
+        self._queue.join()
+
+
+_archiver = None
+_last_capture = None
+
+
+def get_archiver():
+    """Retourne le thread d'archivage partage"""
+    global _archiver
+    if _archiver is None:
+        _archiver = ScreenshotArchiver()
+    return _archiver
+
+
+def start_run(run_id=None):
+    """
+    Demarre un nouveau run : les captures suivantes lui sont rattachees
+    et numerotees a partir de 1
+
     Args:
-        directory (str): Le dossier ou sauvegarder les captures d'ecran
-    
+        run_id (str): Identifiant du run, genere a partir de l'heure si non specifie
+
     Returns:
-        str: Le chemin du fichier de la capture d'ecran
+        str: L'identifiant du run
     """
+    global _run_id, _steps
+    _run_id = run_id or f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{os.getpid()}"
+    _steps = itertools.count(1)
+    return _run_id
+
+
+def capture_frame(directory=None, archive=True):
+    """
+    Prend une capture d'ecran et la retourne en memoire
+
+    Args:
+        directory (str): Le dossier du stockage des captures (celui de la configuration si non specifie)
+        archive (bool): Archiver la capture sur disque en arriere-plan
+
+    Returns:
+        Capture: La capture (image PIL, run et etape), ou None en cas d'erreur
+    """
+    global _last_capture
     try:
-        # Utiliser le répertoire configuré si non spécifié
-        if directory is None:
-            directory = config.get_screenshots_dir()
-            
-        # Creer le dossier s'il n'existe pas
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-            
-        # Generer un nom de fichier unique avec la date et l'heure
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"screenshot_{timestamp}.png"
-        filepath = os.path.join(directory, filename)
-        
-        # Prendre la capture d'ecran avec PIL
-        screenshot = ImageGrab.grab()
-        
-        # Sauvegarder l'image
-        screenshot.save(filepath)
-        
-        print(f"Capture d'ecran sauvegardee : {filepath}")
-        return filepath
-        
+        screenshot = get_image_grab().grab()
+        capture = Capture(screenshot, datetime.now(), _run_id, next(_steps), directory)
+        if archive:
+            get_archiver().submit(capture)
+
+        _last_capture = capture
+        return capture
+
     except Exception as e:
         print(f"Erreur lors de la capture d'ecran : {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+
+def get_last_capture():
+    """Retourne la derniere capture prise par capture_frame"""
+    return _last_capture
+
+
+def flush_archive():
+    """Attend que toutes les captures soient ecrites sur disque"""
+    if _archiver is not None:
+        _archiver.flush()
+
+
+def take_screenshot(directory=None):
+    """
+    Prend une capture d'ecran et la sauvegarde dans le dossier specifie
+
+    Args:
+        directory (str): Le dossier ou sauvegarder les captures d'ecran
+
+    Returns:
+        str: Le chemin du fichier de la capture d'ecran, ecrit a son retour
+    """
+    capture = capture_frame(directory)
+    if capture is None:
+        return None
+    flush_archive()
+    print(f"Capture d'ecran sauvegardee : {capture.path}")
+    return capture.path
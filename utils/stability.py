@@ -0,0 +1,208 @@
+"""
+Module d'attente de stabilité visuelle
+
+Plutôt que d'attendre une durée fixe après une action, l'écran est
+échantillonné en basse résolution jusqu'à ce qu'il reste identique
+pendant plusieurs images consécutives, avec un délai maximal. Lorsqu'une
+image de référence (l'écran avant l'action) est fournie, l'attente
+commence par guetter un changement de l'écran, pour ne pas conclure à la
+stabilité avant que l'action n'ait produit son effet.
+"""
+import time
+import threading
+from typing import Dict, Optional
+import numpy as np
+from PIL import Image
+from utils.backends import get_image_grab
+from utils.config_loader import ConfigLoader
+from utils.tracing import span
+
+
+class WaitResult:
+    """
+    Résultat d'une attente : durée, images échantillonnées et issue
+    """
+    __slots__ = ("name", "waited", "frames", "stable", "changed", "frame")
+
+    def __init__(self, name: str, waited: float, frames: int, stable: bool, changed: Optional[bool], frame):
+        self.name = name
+        self.waited = waited
+        self.frames = frames
+        self.stable = stable
+        self.changed = changed
+        self.frame = frame
+
+    def __repr__(self) -> str:
+        return (f"WaitResult({self.name!r}, waited={self.waited:.3f}, frames={self.frames}, "
+                f"stable={self.stable}, changed={self.changed})")
+
+
+def get_stability_settings() -> Dict:
+    """Retourne la section `stability` de la configuration"""
+    return ConfigLoader().get_section("stability")
+
+
+def is_enabled() -> bool:
+    """Indique si les attentes adaptatives remplacent les délais fixes"""
+    return get_stability_settings().get("enabled", True)
+
+
+def thumbnail_of(image: Image.Image, width: int = 160) -> np.ndarray:
+    """
+    Réduit une capture en niveaux de gris à la largeur donnée (environ)
+
+    Returns:
+        np.ndarray: Luminance (hauteur x largeur), en float32
+    """
+    factor = max(1, image.size[0] // width)
+    small = image.reduce(factor) if factor > 1 else image
+    return np.asarray(small.convert("L"), dtype=np.float32)
+
+
+def grab_thumbnail(width: int = 160) -> np.ndarray:
+    """Capture l'écran et le réduit comme thumbnail_of"""
+    return thumbnail_of(get_image_grab().grab(), width)
+
+
+def frame_difference(a: np.ndarray, b: np.ndarray, pixel_threshold: float = 12) -> float:
+    """
+    Proportion des pixels de deux vignettes dont la luminance diffère de plus
+    de `pixel_threshold` (1.0 si leurs tailles diffèrent)
+
+    Une proportion plutôt qu'un écart moyen : un petit changement localisé
+    (focus d'un champ, texte saisi) reste visible, tandis qu'un curseur
+    clignotant n'occupe que quelques pixels.
+    """
+    if a.shape != b.shape:
+        return 1.0
+    return float((np.abs(a - b) > pixel_threshold).mean())
+
+
+class WaitStats:
+    """
+    Durées réelles des attentes, par nom
+    """
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, result: WaitResult) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(result.name, {"count": 0, "total": 0.0, "max": 0.0, "timeouts": 0})
+            stats["count"] += 1
+            stats["total"] += result.waited
+            stats["max"] = max(stats["max"], result.waited)
+            stats["timeouts"] += 0 if result.stable else 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Retourne, par attente, le nombre, la durée moyenne et maximale et les délais dépassés"""
+        with self._lock:
+            return {
+                name: {"count": stats["count"], "mean": stats["total"] / stats["count"],
+                       "max": stats["max"], "timeouts": stats["timeouts"]}
+                for name, stats in self._stats.items()
+            }
+
+
+_wait_stats = WaitStats()
+
+
+def get_wait_stats() -> Dict[str, Dict[str, float]]:
+    """Retourne les statistiques des attentes depuis le démarrage"""
+    return _wait_stats.summary()
+
+
+def wait_for_stable(name: str = "screen", timeout: Optional[float] = None, reference: Optional[np.ndarray] = None,
+                    change_timeout: Optional[float] = None, stable_frames: Optional[int] = None,
+                    interval: Optional[float] = None, threshold: Optional[float] = None) -> WaitResult:
+    """
+    Attend que l'écran soit stable
+
+    Args:
+        name (str): Nom de l'attente (statistiques et traçage)
+        timeout (float): Durée maximale totale de l'attente, en secondes
+        reference (np.ndarray): Vignette de l'écran avant l'action ; l'attente
+            guette d'abord un changement par rapport à elle
+        change_timeout (float): Durée maximale de l'attente du changement
+        stable_frames (int): Nombre d'images identiques consécutives requises
+        interval (float): Intervalle entre deux images, en secondes
+        threshold (float): Proportion de pixels modifiés en dessous de laquelle deux images sont identiques
+
+    Returns:
+        WaitResult: Durée réelle, images échantillonnées, stabilité atteinte,
+            changement observé (None sans référence) et dernière vignette
+    """
+    settings = get_stability_settings()
+    timeout = settings.get("action_timeout", 2.0) if timeout is None else timeout
+    change_timeout = settings.get("action_change_timeout", 0.3) if change_timeout is None else change_timeout
+    stable_frames = stable_frames or settings.get("stable_frames", 3)
+    interval = settings.get("interval", 0.05) if interval is None else interval
+    threshold = settings.get("threshold", 0.0005) if threshold is None else threshold
+    pixel_threshold = settings.get("pixel_threshold", 12)
+    width = settings.get("thumbnail_width", 160)
+
+    with span(f"wait.{name}") as wait_span:
+        start = time.perf_counter()
+        deadline = start + timeout
+        frame = grab_thumbnail(width)
+        frames = 1
+
+        changed = None
+        if reference is not None:
+            changed = frame_difference(frame, reference, pixel_threshold) > threshold
+            change_deadline = min(deadline, start + change_timeout)
+            while not changed and time.perf_counter() < change_deadline:
+                time.sleep(interval)
+                frame = grab_thumbnail(width)
+                frames += 1
+                changed = frame_difference(frame, reference, pixel_threshold) > threshold
+
+        same = 0
+        stable = False
+        while True:
+            if same >= stable_frames - 1:
+                stable = True
+                break
+            if time.perf_counter() + interval > deadline:
+                break
+            time.sleep(interval)
+            current = grab_thumbnail(width)
+            frames += 1
+            same = same + 1 if frame_difference(current, frame, pixel_threshold) <= threshold else 0
+            frame = current
+
+        result = WaitResult(name, time.perf_counter() - start, frames, stable, changed, frame)
+        wait_span.set(waited=result.waited, frames=frames, stable=stable, changed=changed)
+    _wait_stats.record(result)
+    if not stable:
+        print(f"Attente {name} : écran instable après {result.waited:.2f}s")
+    return result
+
+
+def settle(name: str, action, timeout: Optional[float] = None, change_timeout: Optional[float] = None,
+           stable_frames: Optional[int] = None, fallback: float = 0.0):
+    """
+    Exécute une action puis attend que l'écran se stabilise
+
+    L'écran est capturé avant l'action pour en guetter l'effet. Si la
+    capture est impossible, l'action est exécutée suivie du délai fixe
+    `fallback`.
+
+    Returns:
+        tuple: (valeur retournée par l'action, WaitResult ou None)
+    """
+    try:
+        reference = grab_thumbnail(get_stability_settings().get("thumbnail_width", 160))
+    except Exception as e:
+        print(f"Attente {name} : capture impossible ({str(e)}), délai fixe de {fallback}s")
+        value = action()
+        time.sleep(fallback)
+        return value, None
+    value = action()
+    try:
+        return value, wait_for_stable(name, timeout=timeout, reference=reference, change_timeout=change_timeout,
+                                      stable_frames=stable_frames)
+    except Exception as e:
+        print(f"Attente {name} : capture impossible ({str(e)})")
+        return value, None
@@ -0,0 +1,375 @@
+"""
+Module du graphe des états d'écran
+
+Les suites de tests parcourent sans cesse les mêmes écrans (accueil,
+résultats, détail). Chaque écran rencontré devient un nœud, identifié par
+son empreinte (taille et hash perceptuel de la capture, voir
+utils.analysis_cache.fingerprint ; un écran presque uniforme n'en a pas) et associé aux éléments de
+son analyse ; chaque action exécutée depuis un écran devient une arête
+vers l'écran obtenu, avec ses étapes (outils et entrées, paramétrées par
+le texte de l'action), son taux de succès et sa durée moyenne. Le graphe
+est persisté dans un fichier JSON.
+"""
+import os
+import re
+import json
+import time
+import threading
+from typing import Dict, Iterable, List, Optional
+from PIL import Image
+from utils.config_loader import ConfigLoader
+from utils.ui_elements import UIElement, UIElementStore
+from utils.analysis_cache import fingerprint, hamming_distance, DEFAULT_HASH_SIZE, DEFAULT_MIN_DETAIL
+
+GRAPH_VERSION = 2
+# Valeurs des paramètres retenues par transition, avec leurs états obtenus
+MAX_BINDINGS = 100
+
+
+# Outils dont l'entrée est un texte à saisir, et actions de saisie d'un plan ExecutePlan
+TEXT_TOOLS = ("TypeText",)
+PLAN_TOOL = "ExecutePlan"
+# Actions d'un plan écrit ligne par ligne (agents.agent_ui_automation.PLAN_ACTIONS)
+PLAN_ACTION_NAMES = ("click", "clickat", "clic", "cliquer", "type", "typetext", "saisir", "press", "presskey",
+                     "key", "touche", "appuyer", "wait", "waitstable", "wait-stable", "attendre")
+# Argument d'une action de saisie d'un plan : jusqu'à la fin de la ligne ou
+# à un « ; » suivi de l'action suivante
+PLAN_TEXT_ARGUMENT = re.compile(
+    r"(?im)((?:^|\n|;)\s*(?:\d+[.)]\s*|-\s*)?(?:type|typetext|saisir)\s*(?::|\s)\s*)"
+    r"(.*?)(?=\s*;\s*(?:" + "|".join(map(re.escape, PLAN_ACTION_NAMES)) + r")\b|\n|$)")
+
+
+def _parameterize(text: str, params: Dict[str, str]) -> str:
+    for name, value in params.items():
+        if value:
+            text = text.replace(str(value), f"${{{name}}}")
+    return text
+
+
+def parameterize_steps(steps: Iterable[Dict[str, str]], params: Dict[str, str]) -> List[Dict[str, str]]:
+    """
+    Remplace par `${nom}` les valeurs des paramètres dans les textes saisis
+    par les étapes (entrée de TypeText, argument des saisies d'un plan),
+    pour rejouer l'action avec d'autres valeurs ; les autres entrées
+    (coordonnées, touches) sont conservées telles quelles
+    """
+    parameterized = []
+    for step in steps:
+        argument = str(step.get("input", ""))
+        if step["tool"] in TEXT_TOOLS:
+            argument = _parameterize(argument, params)
+        elif step["tool"] == PLAN_TOOL:
+            argument = PLAN_TEXT_ARGUMENT.sub(lambda match: match.group(1) + _parameterize(match.group(2), params),
+                                              argument)
+        parameterized.append({"tool": step["tool"], "input": argument})
+    return parameterized
+
+
+def binding_key(params: Dict[str, str]) -> str:
+    """Clé des valeurs des paramètres d'une action, pour les états obtenus avec ces valeurs"""
+    return json.dumps(params, sort_keys=True, ensure_ascii=False)
+
+
+def bind_steps(steps: Iterable[Dict[str, str]], params: Dict[str, str]) -> List[Dict[str, str]]:
+    """Remplace les `${nom}` des entrées des étapes par les valeurs des paramètres"""
+    bound = []
+    for step in steps:
+        argument = step["input"]
+        for name, value in params.items():
+            argument = argument.replace(f"${{{name}}}", str(value))
+        bound.append({"tool": step["tool"], "input": argument})
+    return bound
+
+
+class StateNode:
+    """
+    État d'écran : empreinte et éléments analysés (None tant que l'écran
+    n'a pas été analysé)
+    """
+    __slots__ = ("node_id", "fingerprint", "elements", "visits", "last_seen")
+
+    def __init__(self, node_id: str, fingerprint: str, elements: Optional[List[list]] = None,
+                 visits: int = 0, last_seen: float = 0.0):
+        self.node_id = node_id
+        self.fingerprint = fingerprint
+        self.elements = elements
+        self.visits = visits
+        self.last_seen = last_seen
+
+    def element_store(self) -> Optional[UIElementStore]:
+        """Retourne les éléments de l'écran, ou None s'il n'a pas été analysé"""
+        if self.elements is None:
+            return None
+        return UIElementStore(UIElement.from_row(row) for row in self.elements)
+
+    def to_dict(self) -> Dict:
+        return {"fingerprint": self.fingerprint, "elements": self.elements,
+                "visits": self.visits, "last_seen": self.last_seen}
+
+    @classmethod
+    def from_dict(cls, node_id: str, data: Dict) -> "StateNode":
+        return cls(node_id, data["fingerprint"], data.get("elements"),
+                   data.get("visits", 0), data.get("last_seen", 0.0))
+
+
+class StateEdge:
+    """
+    Transition observée : action exécutée depuis un état, étapes, états
+    obtenus (avec leur nombre d'occurrences, au total et par valeurs des
+    paramètres), succès, échecs et durée
+    """
+    __slots__ = ("source", "action", "steps", "targets", "bound_targets", "successes", "failures",
+                 "total_duration", "last_used")
+
+    def __init__(self, source: str, action: str, steps: Optional[List[Dict[str, str]]] = None,
+                 targets: Optional[Dict[str, int]] = None, bound_targets: Optional[Dict[str, Dict[str, int]]] = None,
+                 successes: int = 0, failures: int = 0, total_duration: float = 0.0, last_used: float = 0.0):
+        self.source = source
+        self.action = action
+        self.steps = steps or []
+        self.targets = targets or {}
+        self.bound_targets = bound_targets or {}
+        self.successes = successes
+        self.failures = failures
+        self.total_duration = total_duration
+        self.last_used = last_used
+
+    @property
+    def key(self) -> str:
+        return f"{self.source}|{self.action}"
+
+    @property
+    def success_rate(self) -> float:
+        total = self.successes + self.failures
+        return self.successes / total if total else 0.0
+
+    @property
+    def mean_duration(self) -> float:
+        return self.total_duration / self.successes if self.successes else 0.0
+
+    @property
+    def target(self) -> Optional[str]:
+        """État obtenu le plus souvent"""
+        return max(self.targets, key=self.targets.get) if self.targets else None
+
+    @property
+    def parameterized(self) -> bool:
+        """Indique si les étapes contiennent des paramètres (`${nom}`)"""
+        return any("${" in str(step.get("input", "")) for step in self.steps)
+
+    def expected_targets(self, params: Dict[str, str]) -> List[str]:
+        """
+        Retourne les états d'arrivée attendus d'un rejeu avec ces valeurs des
+        paramètres : tous les états obtenus si les étapes n'en dépendent pas,
+        sinon ceux obtenus avec les mêmes valeurs (un écran de résultats
+        dépend du texte saisi) ; une liste vide si rien ne permet de vérifier
+        """
+        if not self.parameterized:
+            return list(self.targets)
+        return list(self.bound_targets.get(binding_key(params), {}))
+
+    def to_dict(self) -> Dict:
+        return {"source": self.source, "action": self.action, "steps": self.steps, "targets": self.targets,
+                "bound_targets": self.bound_targets,
+                "successes": self.successes, "failures": self.failures,
+                "total_duration": self.total_duration, "last_used": self.last_used}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "StateEdge":
+        return cls(**{name: data.get(name) for name in cls.__slots__ if name in data})
+
+
+class StateGraph:
+    """
+    Graphe des états d'écran et des transitions, persisté dans un fichier JSON
+    """
+
+    def __init__(self, path: str, max_distance: int = 4, hash_size: int = DEFAULT_HASH_SIZE,
+                 max_nodes: int = 500, min_detail: int = DEFAULT_MIN_DETAIL):
+        self.path = path
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.min_detail = min_detail
+        self.max_nodes = max_nodes
+        self._lock = threading.RLock()
+        self._nodes: Dict[str, StateNode] = {}
+        self._edges: Dict[str, StateEdge] = {}
+        self._next_id = 1
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == GRAPH_VERSION and data.get("hash_size") == hash_size:
+                    self._nodes = {node_id: StateNode.from_dict(node_id, node)
+                                   for node_id, node in data.get("nodes", {}).items()}
+                    self._edges = {edge.key: edge for edge in map(StateEdge.from_dict, data.get("edges", []))}
+                    self._next_id = data.get("next_id", len(self._nodes) + 1)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"Erreur lors du chargement du graphe des états : {str(e)}")
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def fingerprint(self, image: Image.Image) -> Optional[str]:
+        """Retourne l'empreinte d'une capture, ou None si elle est presque uniforme"""
+        return fingerprint(image, "screen", self.hash_size, self.min_detail)
+
+    def match(self, fingerprint: str) -> Optional[StateNode]:
+        """Retourne l'état le plus proche de l'empreinte, dans la distance tolérée, ou None"""
+        with self._lock:
+            best, best_distance = None, self.max_distance + 1
+            for node in self._nodes.values():
+                distance = hamming_distance(fingerprint, node.fingerprint)
+                if distance < best_distance:
+                    best, best_distance = node, distance
+            return best
+
+    def observe(self, fingerprint: str, elements: Optional[UIElementStore] = None) -> StateNode:
+        """
+        Enregistre la visite d'un écran : retourne l'état correspondant à
+        l'empreinte, créé s'il est inconnu, et lui associe les éléments donnés
+        """
+        with self._lock:
+            node = self.match(fingerprint)
+            if node is None:
+                node = StateNode(f"s{self._next_id}", fingerprint, last_seen=time.time())
+                self._next_id += 1
+                self._nodes[node.node_id] = node
+                self._evict()
+            node.visits += 1
+            node.last_seen = time.time()
+            if elements is not None:
+                node.elements = [element.to_row() for element in elements]
+            return node
+
+    def set_elements(self, node_id: str, elements: Optional[UIElementStore]) -> None:
+        """Associe à un état les éléments de son analyse (None : l'état sera de nouveau analysé)"""
+        with self._lock:
+            node = self._nodes.get(node_id)
+            if node is not None:
+                node.elements = None if elements is None else [element.to_row() for element in elements]
+
+    def reaches(self, fingerprint: Optional[str], node_ids: Iterable[str]) -> bool:
+        """Indique si l'empreinte d'un écran correspond, dans la distance tolérée, à l'un des états donnés"""
+        if not fingerprint:
+            return False
+        with self._lock:
+            return any(node_id in self._nodes
+                       and hamming_distance(fingerprint, self._nodes[node_id].fingerprint) <= self.max_distance
+                       for node_id in node_ids)
+
+    def edge(self, node_id: str, action: str) -> Optional[StateEdge]:
+        """Retourne la transition connue d'un état pour une action"""
+        with self._lock:
+            return self._edges.get(f"{node_id}|{action}")
+
+    def edges_from(self, node_id: str) -> List[StateEdge]:
+        with self._lock:
+            return [edge for edge in self._edges.values() if edge.source == node_id]
+
+    def record(self, source: str, action: str, success: bool, steps: Optional[List[Dict[str, str]]] = None,
+               target: Optional[str] = None, duration: float = 0.0,
+               params: Optional[Dict[str, str]] = None) -> StateEdge:
+        """
+        Enregistre l'exécution d'une action depuis un état
+
+        Args:
+            source (str): État de départ
+            action (str): Action exécutée (ex. "search")
+            success (bool): L'action a abouti
+            steps (list): Étapes paramétrées de l'action réussie, conservées pour le rejeu
+            target (str): État obtenu
+            duration (float): Durée de l'action, en secondes
+            params (dict): Valeurs des paramètres de l'action, associées à l'état obtenu
+        """
+        with self._lock:
+            key = f"{source}|{action}"
+            edge = self._edges.get(key)
+            if edge is None:
+                edge = self._edges[key] = StateEdge(source, action)
+            edge.last_used = time.time()
+            if success:
+                edge.successes += 1
+                edge.total_duration += duration
+                if steps:
+                    edge.steps = steps
+            else:
+                edge.failures += 1
+            if target is not None:
+                edge.targets[target] = edge.targets.get(target, 0) + 1
+                if params:
+                    key = binding_key(params)
+                    bound = edge.bound_targets.pop(key, {})
+                    bound[target] = bound.get(target, 0) + 1
+                    # Les valeurs les plus récentes en dernier ; les plus anciennes sont oubliées
+                    edge.bound_targets[key] = bound
+                    for old in list(edge.bound_targets)[:-MAX_BINDINGS]:
+                        del edge.bound_targets[old]
+            return edge
+
+    def _evict(self) -> None:
+        """Retire les états vus le moins récemment au-delà de max_nodes, avec leurs transitions"""
+        if len(self._nodes) <= self.max_nodes:
+            return
+        oldest = sorted(self._nodes.values(), key=lambda node: node.last_seen)
+        for node in oldest[:len(self._nodes) - self.max_nodes]:
+            del self._nodes[node.node_id]
+            for key in [key for key, edge in self._edges.items() if edge.source == node.node_id]:
+                del self._edges[key]
+            for edge in self._edges.values():
+                edge.targets.pop(node.node_id, None)
+                for bound in edge.bound_targets.values():
+                    bound.pop(node.node_id, None)
+
+    def save(self) -> None:
+        """Enregistre le graphe dans son fichier JSON"""
+        with self._lock:
+            data = {
+                "version": GRAPH_VERSION,
+                "hash_size": self.hash_size,
+                "next_id": self._next_id,
+                "nodes": {node_id: node.to_dict() for node_id, node in self._nodes.items()},
+                "edges": [edge.to_dict() for edge in self._edges.values()],
+            }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def stats(self) -> Dict[str, int]:
+        """Retourne le nombre d'états (dont analysés) et de transitions"""
+        with self._lock:
+            return {
+                "nodes": len(self._nodes),
+                "analyzed": sum(1 for node in self._nodes.values() if node.elements is not None),
+                "edges": len(self._edges),
+            }
+
+
+def get_state_graph_settings() -> Dict:
+    """Retourne la section `state_graph` de la configuration"""
+    return ConfigLoader().get_section("state_graph")
+
+
+def is_enabled() -> bool:
+    """Indique si le graphe des états est activé dans la configuration"""
+    return get_state_graph_settings().get("enabled", True)
+
+
+_state_graphs: Dict[str, StateGraph] = {}
+
+
+def get_state_graph() -> StateGraph:
+    """Retourne le graphe des états, partagé par chemin"""
+    settings = get_state_graph_settings()
+    path = settings.get("path") or ConfigLoader().get_state_graph_path()
+    if path not in _state_graphs:
+        _state_graphs[path] = StateGraph(
+            path,
+            max_distance=settings.get("max_distance", 4),
+            hash_size=settings.get("hash_size", DEFAULT_HASH_SIZE),
+            max_nodes=settings.get("max_nodes", 500),
+            min_detail=settings.get("min_detail", DEFAULT_MIN_DETAIL),
+        )
+    return _state_graphs[path]
@@ -0,0 +1,434 @@
+"""
+Module de localisation des éléments connus par corrélation
+
+Chaque analyse faite par le modèle alimente une bibliothèque de vignettes
+d'éléments (découpées dans la capture autour de leur boîte), regroupées
+par écran. Sur une nouvelle capture, ces vignettes sont recherchées
+localement par corrélation croisée normalisée (NCC), calculée par FFT sur
+une image réduite puis affinée en pleine résolution, à plusieurs
+échelles : un écran déjà vu est retrouvé en quelques millisecondes, sans
+appel au modèle.
+"""
+import os
+import json
+import math
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from PIL import Image
+from utils.config_loader import ConfigLoader
+from utils.analysis_cache import fingerprint, hamming_distance
+from utils.ui_elements import UIElement, UIElementStore
+from utils.tracing import span
+
+LIBRARY_VERSION = 1
+
+# Écart-type minimal d'une vignette : un aplat ne peut pas être localisé
+MIN_TEMPLATE_STD = 4.0
+
+
+def _fast_length(n: int) -> int:
+    """Plus petite longueur >= n dont les facteurs premiers sont 2, 3 ou 5 (FFT rapide)"""
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+def _window_sums(integral: np.ndarray, height: int, width: int) -> np.ndarray:
+    """Sommes sur toutes les fenêtres height x width, depuis une image intégrale"""
+    return (integral[height:, width:] - integral[:-height, width:]
+            - integral[height:, :-width] + integral[:-height, :-width])
+
+
+class SearchImage:
+    """
+    Image de recherche : spectre et images intégrales calculés une seule
+    fois, partagés par toutes les vignettes recherchées
+    """
+
+    def __init__(self, pixels: np.ndarray):
+        self.pixels = pixels.astype(np.float64)
+        self.shape = (_fast_length(pixels.shape[0]), _fast_length(pixels.shape[1]))
+        self.spectrum = np.fft.rfft2(self.pixels, s=self.shape)
+        padded = np.pad(self.pixels, ((1, 0), (1, 0)))
+        self.integral = padded.cumsum(0).cumsum(1)
+        self.integral_sq = (padded ** 2).cumsum(0).cumsum(1)
+
+    def prepare(self, template: np.ndarray) -> Optional[Tuple[int, int, float, np.ndarray]]:
+        """
+        Prépare une vignette pour cette taille d'image : (hauteur, largeur,
+        norme, spectre conjugué), réutilisable pour toute image de même
+        taille, ou None si la vignette est uniforme
+        """
+        centered = template - template.mean()
+        norm = float(np.sqrt((centered ** 2).sum()))
+        if norm < 1e-6:
+            return None
+        return template.shape[0], template.shape[1], norm, np.conj(np.fft.rfft2(centered, s=self.shape))
+
+    def ncc(self, template: Optional[np.ndarray] = None, prepared=None) -> Optional[np.ndarray]:
+        """
+        Corrélation croisée normalisée de la vignette (ou de sa version
+        préparée) à toutes les positions (coin supérieur gauche) où elle
+        tient entièrement dans l'image
+
+        Returns:
+            np.ndarray: Scores dans [-1, 1], ou None si la vignette est plus
+                grande que l'image ou uniforme
+        """
+        image_h, image_w = self.pixels.shape
+        if prepared is None:
+            if template.shape[0] > image_h or template.shape[1] > image_w:
+                return None
+            prepared = self.prepare(template)
+            if prepared is None:
+                return None
+        height, width, norm, spectrum = prepared
+        if height > image_h or width > image_w:
+            return None
+        # Corrélation circulaire : exacte sur les positions valides (sans repliement)
+        correlation = np.fft.irfft2(self.spectrum * spectrum, s=self.shape)
+        correlation = correlation[:image_h - height + 1, :image_w - width + 1]
+        count = height * width
+        # Écart-type local de l'image sous chaque position (calculs en place : grandes images)
+        sums = _window_sums(self.integral, height, width)
+        denominator = _window_sums(self.integral_sq, height, width)
+        np.square(sums, out=sums)
+        sums /= count
+        denominator -= sums
+        np.maximum(denominator, 0.0, out=denominator)
+        np.sqrt(denominator, out=denominator)
+        denominator *= norm
+        valid = denominator > 1e-6 * norm * np.sqrt(count)
+        return np.divide(correlation, denominator, out=np.zeros_like(denominator), where=valid)
+
+
+def _gray(image: Image.Image, factor: int = 1) -> np.ndarray:
+    """Niveaux de gris (uint8) de la capture, réduite de `factor`"""
+    gray = image.convert("L")
+    if factor > 1:
+        gray = gray.reduce(factor)
+    return np.asarray(gray)
+
+
+def _resize(pixels: np.ndarray, scale: float) -> Optional[np.ndarray]:
+    height, width = pixels.shape
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if min(size) < 4:
+        return None
+    if size == (width, height):
+        return pixels
+    resized = Image.fromarray(pixels.astype(np.uint8)).resize(size, Image.BILINEAR)
+    return np.asarray(resized, dtype=np.float64)
+
+
+class Match:
+    """
+    Position retrouvée d'une vignette : centre en pixels, échelle et score
+    """
+    __slots__ = ("x", "y", "scale", "score")
+
+    def __init__(self, x: int, y: int, scale: float, score: float):
+        self.x = x
+        self.y = y
+        self.scale = scale
+        self.score = score
+
+    def __repr__(self) -> str:
+        return f"Match(x={self.x}, y={self.y}, scale={self.scale}, score={self.score:.3f})"
+
+
+def _refine(full: np.ndarray, template: np.ndarray, scale: float, top: int, left: int,
+            margin: int) -> Optional[Match]:
+    """Affine en pleine résolution une position grossière (coin supérieur gauche)"""
+    scaled = _resize(template, scale)
+    if scaled is None:
+        return None
+    height, width = scaled.shape
+    region_top, region_left = max(0, top - margin), max(0, left - margin)
+    region = full[region_top:top + height + margin, region_left:left + width + margin]
+    scores = SearchImage(region).ncc(scaled)
+    if scores is None:
+        return None
+    dy, dx = np.unravel_index(int(np.argmax(scores)), scores.shape)
+    return Match(int(region_left + dx + width // 2), int(region_top + dy + height // 2),
+                 scale, float(scores[dy, dx]))
+
+
+def locate(image: Image.Image, template: np.ndarray, scales=(1.0,), coarse_factor: int = 2,
+           coarse: Optional[SearchImage] = None, full: Optional[np.ndarray] = None,
+           accept: Optional[float] = None, prepared: Optional[Dict] = None) -> Optional[Match]:
+    """
+    Recherche une vignette (niveaux de gris) dans une capture
+
+    Pour chaque échelle, de la plus proche de 1 à la plus éloignée, la
+    position est cherchée par FFT sur l'image réduite de `coarse_factor`
+    puis affinée en pleine résolution dans son voisinage ; la recherche
+    s'arrête dès qu'un score atteint `accept`.
+
+    Args:
+        image (Image.Image): La capture
+        template (np.ndarray): La vignette, en niveaux de gris
+        scales: Échelles de la vignette essayées
+        coarse_factor (int): Facteur de réduction de la recherche grossière
+        coarse (SearchImage): Image réduite déjà préparée (recherche de plusieurs vignettes)
+        full (np.ndarray): Capture en niveaux de gris déjà convertie
+        accept (float): Score suffisant pour ne pas essayer d'autres échelles
+        prepared (dict): Cache des vignettes préparées pour la recherche
+            grossière, par échelle et taille d'image (recherches répétées)
+
+    Returns:
+        Match: Centre, échelle et score de la meilleure position, ou None
+    """
+    coarse = coarse or SearchImage(_gray(image, coarse_factor))
+    full = _gray(image) if full is None else full
+    best = None
+    for scale in sorted(scales, key=lambda value: abs(np.log(value))):
+        key = (scale, coarse_factor, coarse.shape)
+        if prepared is None or key not in prepared:
+            small = _resize(template, scale / coarse_factor)
+            entry = coarse.prepare(small) if small is not None and small.std() >= MIN_TEMPLATE_STD / 2 else None
+            if prepared is not None:
+                prepared[key] = entry
+        else:
+            entry = prepared[key]
+        scores = coarse.ncc(prepared=entry) if entry is not None else None
+        if scores is None:
+            continue
+        top, left = np.unravel_index(int(np.argmax(scores)), scores.shape)
+        match = _refine(full, template, scale, top * coarse_factor, left * coarse_factor, 2 * coarse_factor)
+        if match is not None and (best is None or match.score > best.score):
+            best = match
+        if best is not None and accept is not None and best.score >= accept:
+            break
+    return best
+
+
+class TemplateLibrary:
+    """
+    Bibliothèque de vignettes d'éléments, regroupées par écran d'origine
+    (hash perceptuel de la capture analysée)
+    """
+
+    def __init__(self, directory: str, max_screens: int = 20, padding: int = 2):
+        self.directory = directory
+        self.max_screens = max_screens
+        self.padding = padding
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(directory, "index.json")
+        self._screens: Dict[str, Dict] = {}
+        self._templates: Dict[str, np.ndarray] = {}
+        # Vignettes préparées pour la recherche grossière, par fichier
+        self._prepared: Dict[str, Dict] = {}
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self._index_path):
+            try:
+                with open(self._index_path, "r", encoding="utf-8") as f:
+                    self._screens = json.load(f).get("screens", {})
+            except (OSError, ValueError) as e:
+                print(f"Erreur lors du chargement de la bibliothèque de vignettes : {str(e)}")
+
+    def __len__(self) -> int:
+        return len(self._screens)
+
+    def _save_index(self) -> None:
+        tmp_path = f"{self._index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": LIBRARY_VERSION, "screens": self._screens}, f, ensure_ascii=False)
+        os.replace(tmp_path, self._index_path)
+
+    def _template(self, name: str) -> Optional[np.ndarray]:
+        template = self._templates.get(name)
+        if template is None:
+            try:
+                with Image.open(os.path.join(self.directory, name)) as crop:
+                    template = np.asarray(crop.convert("L"), dtype=np.float64)
+            except OSError:
+                return None
+            self._templates[name] = template
+        return template
+
+    def add_screen(self, image: Image.Image, elements, screen_id: Optional[str] = None) -> int:
+        """
+        Découpe et enregistre les vignettes des éléments d'une capture analysée
+
+        Les éléments sans taille, débordant de la capture ou uniformes sont
+        ignorés. Un écran déjà connu n'est pas redécoupé.
+
+        Returns:
+            int: Nombre de vignettes enregistrées
+        """
+        screen_id = screen_id or fingerprint(image, min_detail=0)
+        with self._lock:
+            if screen_id in self._screens:
+                self._screens[screen_id]["used"] = time.time()
+                return 0
+        gray = image.convert("L")
+        entries = []
+        for index, element in enumerate(elements):
+            if not element.width or not element.height:
+                continue
+            left, top, right, bottom = element.bbox
+            box = (left - self.padding, top - self.padding, right + self.padding, bottom + self.padding)
+            if box[0] < 0 or box[1] < 0 or box[2] > image.size[0] or box[3] > image.size[1]:
+                continue
+            crop = gray.crop(box)
+            if np.asarray(crop, dtype=np.float64).std() < MIN_TEMPLATE_STD:
+                continue
+            name = f"{screen_id.rsplit(':', 1)[-1][:16]}_{index}.png"
+            crop.save(os.path.join(self.directory, name))
+            entries.append({"file": name, "element": element.to_row(), "offset": [element.x - box[0], element.y - box[1]]})
+        if not entries:
+            return 0
+        with self._lock:
+            now = time.time()
+            self._screens[screen_id] = {"size": list(image.size), "templates": entries, "created": now, "used": now}
+            self._evict()
+            self._save_index()
+        return len(entries)
+
+    def _evict(self) -> None:
+        """Supprime les écrans les moins récemment retrouvés au-delà de max_screens"""
+        while len(self._screens) > self.max_screens:
+            oldest = min(self._screens, key=lambda key: self._screens[key]["used"])
+            for entry in self._screens.pop(oldest)["templates"]:
+                self._templates.pop(entry["file"], None)
+                self._prepared.pop(entry["file"], None)
+                try:
+                    os.remove(os.path.join(self.directory, entry["file"]))
+                except OSError:
+                    pass
+
+    def candidates(self, image: Image.Image, limit: int = 3) -> List[str]:
+        """Écrans de même taille que la capture, du plus ressemblant au moins ressemblant"""
+        screen_hash = fingerprint(image, min_detail=0)
+        with self._lock:
+            screens = [key for key, screen in self._screens.items() if tuple(screen["size"]) == image.size]
+        screens.sort(key=lambda key: hamming_distance(key, screen_hash))
+        return screens[:limit]
+
+    def locate_screen(self, image: Image.Image, screen_id: str, scales=(1.0,), coarse_factor: int = 2,
+                      min_score: float = 0.8, coarse: Optional[SearchImage] = None,
+                      full: Optional[np.ndarray] = None,
+                      max_misses: Optional[int] = None) -> Tuple[List[UIElement], int]:
+        """
+        Recherche dans une capture les éléments d'un écran connu ; la
+        recherche s'arrête après `max_misses` vignettes non retrouvées
+
+        Returns:
+            tuple: (éléments retrouvés avec un score >= min_score, nombre de vignettes de l'écran)
+        """
+        coarse = coarse or SearchImage(_gray(image, coarse_factor))
+        full = _gray(image) if full is None else full
+        with self._lock:
+            entries = list(self._screens.get(screen_id, {}).get("templates", []))
+        found, misses = [], 0
+        for entry in entries:
+            if max_misses is not None and misses > max_misses:
+                break
+            template = self._template(entry["file"])
+            match = None
+            if template is not None:
+                match = locate(image, template, scales, coarse_factor, coarse=coarse, full=full, accept=min_score,
+                               prepared=self._prepared.setdefault(entry["file"], {}))
+            if match is None or match.score < min_score:
+                misses += 1
+                continue
+            element = UIElement.from_row(entry["element"])
+            # Centre de l'élément dans la vignette, à l'échelle retrouvée
+            height, width = template.shape
+            element.x = int(round(match.x + (entry["offset"][0] - width / 2) * match.scale))
+            element.y = int(round(match.y + (entry["offset"][1] - height / 2) * match.scale))
+            element.width = int(round(element.width * match.scale))
+            element.height = int(round(element.height * match.scale))
+            found.append(element)
+        if found:
+            with self._lock:
+                if screen_id in self._screens:
+                    self._screens[screen_id]["used"] = time.time()
+        return found, len(entries)
+
+    def find(self, image: Image.Image, scales=(1.0,), coarse_factor: int = 2, min_score: float = 0.8,
+             min_found_ratio: float = 0.8, max_candidates: int = 3) -> Optional[UIElementStore]:
+        """
+        Retrouve un écran connu dans la capture
+
+        Les écrans candidats sont essayés du plus ressemblant au moins
+        ressemblant ; le premier dont une proportion suffisante des
+        éléments est retrouvée avec confiance est retenu.
+
+        Returns:
+            UIElementStore: Les éléments retrouvés, ou None si aucun écran
+                connu n'est retrouvé avec une confiance suffisante
+        """
+        screens = self.candidates(image, max_candidates)
+        if not screens:
+            return None
+        coarse = SearchImage(_gray(image, coarse_factor))
+        full = _gray(image)
+        for screen_id in screens:
+            with self._lock:
+                total = len(self._screens.get(screen_id, {}).get("templates", []))
+            max_misses = total - math.ceil(min_found_ratio * total)
+            found, total = self.locate_screen(image, screen_id, scales, coarse_factor, min_score, coarse, full,
+                                              max_misses)
+            if total and len(found) / total >= min_found_ratio:
+                return UIElementStore(found)
+        return None
+
+
+def get_template_settings() -> Dict:
+    """Retourne la section `templates` de la configuration"""
+    return ConfigLoader().get_section("templates")
+
+
+def is_enabled() -> bool:
+    """Indique si les éléments connus sont recherchés localement avant l'analyse"""
+    return get_template_settings().get("enabled", True)
+
+
+_template_libraries: Dict[str, TemplateLibrary] = {}
+
+
+def get_template_library() -> TemplateLibrary:
+    """Retourne la bibliothèque de vignettes du dossier de données courant"""
+    settings = get_template_settings()
+    directory = ConfigLoader().get_templates_dir()
+    if directory not in _template_libraries:
+        _template_libraries[directory] = TemplateLibrary(
+            directory,
+            max_screens=settings.get("max_screens", 20),
+            padding=settings.get("padding", 2),
+        )
+    return _template_libraries[directory]
+
+
+def find_known_elements(image: Image.Image) -> Optional[UIElementStore]:
+    """
+    Recherche localement un écran connu dans la capture, avec les
+    paramètres de la configuration
+
+    Returns:
+        UIElementStore: Les éléments retrouvés, ou None (analyse par le modèle nécessaire)
+    """
+    settings = get_template_settings()
+    library = get_template_library()
+    if not len(library):
+        return None
+    with span("templates.locate") as locate_span:
+        elements = library.find(
+            image,
+            scales=tuple(settings.get("scales", [0.9, 1.0, 1.1])),
+            coarse_factor=settings.get("coarse_factor", 2),
+            min_score=settings.get("min_score", 0.8),
+            min_found_ratio=settings.get("min_found_ratio", 0.8),
+            max_candidates=settings.get("max_candidates", 3),
+        )
+        locate_span.set(found=len(elements) if elements is not None else 0, hit=elements is not None)
+    return elements
@@ -0,0 +1,261 @@
+"""
+Module de saisie de texte rapide
+
+La saisie passe par le plus rapide des backends disponibles :
+- `xdotool` : une seule injection groupée des événements clavier (Linux/X11),
+  caractères accentués compris
+- `clipboard` : copie du texte dans le presse-papiers puis collage (Ctrl+V)
+- `pyautogui` : frappe sans délai entre les touches, limitée à l'ASCII
+
+Quel que soit le backend, le champ est ensuite relu (sélection et copie)
+pour vérifier qu'aucune touche n'a été perdue, avec une nouvelle saisie
+plus lente en cas d'écart. Sans presse-papiers pour relire le champ, la
+frappe pyautogui n'est pas vérifiable : elle se fait alors avec un délai
+entre les touches (`retry_interval`). Le contenu texte du presse-papiers
+de l'utilisateur est restauré après le collage et la relecture.
+
+Les retours à la ligne finaux sont envoyés comme des appuis sur Entrée.
+"""
+import os
+import sys
+import time
+import shutil
+import subprocess
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+from utils.backends import get_pyautogui
+from utils.config_loader import ConfigLoader
+
+def _paste_modifier() -> str:
+    return "command" if sys.platform == "darwin" else "ctrl"
+
+
+class Clipboard:
+    """
+    Accès au presse-papiers : pyperclip s'il est installé, sinon les outils
+    du système (wl-copy, xclip, xsel, pbcopy)
+    """
+
+    COMMANDS = [
+        # (copie, lecture, condition)
+        (["wl-copy"], ["wl-paste", "--no-newline"], lambda: bool(os.environ.get("WAYLAND_DISPLAY"))),
+        (["xclip", "-selection", "clipboard"], ["xclip", "-selection", "clipboard", "-o"],
+         lambda: bool(os.environ.get("DISPLAY"))),
+        (["xsel", "--clipboard", "--input"], ["xsel", "--clipboard", "--output"], lambda: bool(os.environ.get("DISPLAY"))),
+        (["pbcopy"], ["pbpaste"], lambda: sys.platform == "darwin"),
+    ]
+
+    def __init__(self):
+        self._pyperclip = None
+        self._commands = None
+        try:
+            import pyperclip
+            # determine_clipboard retourne un objet évalué à False sans mécanisme disponible
+            if pyperclip.determine_clipboard()[0]:
+                self._pyperclip = pyperclip
+        except ImportError:
+            pass
+        if self._pyperclip is None:
+            for copy, paste, condition in self.COMMANDS:
+                if condition() and shutil.which(copy[0]) and shutil.which(paste[0]):
+                    self._commands = (copy, paste)
+                    break
+
+    def available(self) -> bool:
+        return self._pyperclip is not None or self._commands is not None
+
+    def copy(self, text: str) -> None:
+        if self._pyperclip is not None:
+            self._pyperclip.copy(text)
+        else:
+            subprocess.run(self._commands[0], input=text.encode("utf-8"), check=True, timeout=5)
+
+    def paste(self) -> str:
+        if self._pyperclip is not None:
+            return self._pyperclip.paste()
+        completed = subprocess.run(self._commands[1], capture_output=True, check=True, timeout=5)
+        return completed.stdout.decode("utf-8", errors="replace")
+
+    @contextmanager
+    def preserved(self, delay: float = 0.1):
+        """
+        Restaure en sortie le contenu texte du presse-papiers, après `delay`
+        secondes (le temps pour l'application de lire un collage en cours) ;
+        un contenu non textuel (image) n'est pas conservé
+        """
+        try:
+            saved = self.paste()
+        except Exception:
+            saved = None
+        try:
+            yield
+        finally:
+            if saved is not None:
+                time.sleep(delay)
+                try:
+                    self.copy(saved)
+                except Exception as e:
+                    print(f"Erreur lors de la restauration du presse-papiers : {str(e)}")
+
+
+_clipboard = None
+
+
+def get_clipboard() -> Clipboard:
+    """Retourne l'accès au presse-papiers, détecté au premier appel"""
+    global _clipboard
+    if _clipboard is None:
+        _clipboard = Clipboard()
+    return _clipboard
+
+
+class InputResult:
+    """
+    Résultat d'une saisie : backend utilisé, vérification et durée
+    """
+    __slots__ = ("backend", "verified", "duration", "error")
+
+    def __init__(self, backend: Optional[str], verified: Optional[bool], duration: float, error: Optional[str] = None):
+        self.backend = backend
+        # True/False si le champ a été relu, None si la saisie n'a pas été vérifiée
+        self.verified = verified
+        self.duration = duration
+        self.error = error
+
+    def __repr__(self) -> str:
+        return (f"InputResult(backend={self.backend!r}, verified={self.verified}, "
+                f"duration={self.duration:.3f}, error={self.error!r})")
+
+
+def get_text_input_settings() -> Dict:
+    """Retourne la section `text_input` de la configuration"""
+    return ConfigLoader().get_section("text_input")
+
+
+def _xdotool_available() -> bool:
+    return sys.platform.startswith("linux") and bool(os.environ.get("DISPLAY")) and shutil.which("xdotool") is not None
+
+
+def _type_xdotool(text: str, delay_ms: int = 0) -> None:
+    subprocess.run(["xdotool", "type", "--clearmodifiers", "--delay", str(delay_ms), "--", text], check=True, timeout=30)
+
+
+def _type_clipboard(text: str) -> None:
+    get_clipboard().copy(text)
+    get_pyautogui().hotkey(_paste_modifier(), "v")
+
+
+def _type_pyautogui(text: str, interval: float = 0.0) -> None:
+    get_pyautogui().typewrite(text, interval=interval)
+
+
+def available_backends(text: str = "") -> List[str]:
+    """
+    Retourne les backends utilisables pour un texte, du plus rapide au plus lent
+    """
+    backends = []
+    if _xdotool_available():
+        backends.append("xdotool")
+    if get_clipboard().available():
+        backends.append("clipboard")
+    if text.isascii():
+        backends.append("pyautogui")
+    return backends
+
+
+def choose_backend(text: str, preferred: str = "auto") -> Optional[str]:
+    """
+    Choisit le backend de saisie : celui de la configuration s'il convient
+    au texte, sinon le plus rapide disponible
+    """
+    backends = available_backends(text)
+    if preferred != "auto":
+        if preferred in backends:
+            return preferred
+        print(f"Backend de saisie {preferred} indisponible pour ce texte, choix automatique")
+    return backends[0] if backends else None
+
+
+def read_field() -> Optional[str]:
+    """
+    Relit le contenu du champ actif (sélection complète puis copie), ou None
+    si le presse-papiers est inaccessible
+    """
+    clipboard = get_clipboard()
+    if not clipboard.available():
+        return None
+    pyautogui = get_pyautogui()
+    clipboard.copy("")
+    pyautogui.hotkey(_paste_modifier(), "a")
+    pyautogui.hotkey(_paste_modifier(), "c")
+    time.sleep(0.05)
+    content = clipboard.paste()
+    # Désélectionner en replaçant le curseur en fin de champ
+    pyautogui.press("end")
+    return content
+
+
+def _retype(backend: str, text: str, interval: float) -> None:
+    """Remplace le contenu du champ actif par le texte, par une saisie plus lente"""
+    get_pyautogui().hotkey(_paste_modifier(), "a")
+    if text.isascii():
+        _type_pyautogui(text, interval)
+    elif backend == "xdotool":
+        _type_xdotool(text, max(1, int(interval * 1000)))
+    else:
+        _type_clipboard(text)
+
+
+def enter_text(text: str, backend: Optional[str] = None) -> InputResult:
+    """
+    Saisit un texte dans le champ actif avec le backend le plus rapide
+
+    Args:
+        text (str): Le texte à saisir ; les retours à la ligne finaux sont
+            envoyés comme des appuis sur Entrée après le texte
+        backend (str): auto, xdotool, clipboard ou pyautogui (celui de la configuration si non spécifié)
+
+    Returns:
+        InputResult: Le backend utilisé, la vérification et la durée
+    """
+    settings = get_text_input_settings()
+    body = text.rstrip("\n")
+    enters = len(text) - len(body)
+    start = time.perf_counter()
+
+    chosen = choose_backend(body, backend or settings.get("backend", "auto")) if body else None
+    if body and chosen is None:
+        return InputResult(None, False, time.perf_counter() - start,
+                           "aucun backend ne permet de saisir ce texte (caractères non ASCII : "
+                           "installez xdotool, xclip ou pyperclip)")
+
+    verified = None
+    clipboard = get_clipboard()
+    # Relecture du champ par le presse-papiers, indépendante du backend de saisie
+    verify = bool(body) and settings.get("verify", True) and clipboard.available()
+    retry_interval = settings.get("retry_interval", 0.02)
+    uses_clipboard = chosen == "clipboard" or verify
+    with clipboard.preserved(settings.get("clipboard_restore_delay", 0.1)) if uses_clipboard else nullcontext():
+        if chosen == "xdotool":
+            _type_xdotool(body)
+        elif chosen == "clipboard":
+            _type_clipboard(body)
+        elif chosen == "pyautogui":
+            interval = settings.get("interval", 0.0)
+            if settings.get("verify", True) and not verify and not interval:
+                # Frappe sans délai invérifiable (pas de presse-papiers) : délai de sécurité entre les touches
+                interval = retry_interval
+            _type_pyautogui(body, interval)
+        if verify:
+            content = read_field()
+            if content is not None:
+                verified = content.endswith(body)
+                if not verified:
+                    print(f"Saisie incomplète ({chosen}), nouvelle saisie plus lente")
+                    _retype(chosen, body, retry_interval)
+                    content = read_field()
+                    verified = content is not None and content.endswith(body)
+
+    for _ in range(enters):
+        get_pyautogui().press("enter")
+    return InputResult(chosen, verified, time.perf_counter() - start)
@@ -0,0 +1,299 @@
+"""
+Module de traçage et de métriques des runs
+
+Chaque étape instrumentée ouvre un span chronométré, imbriqué dans le span
+courant (étapes du workflow, appels au modèle, outils de l'agent, actions
+pyautogui). Les attributs numériques connus (tokens, octets envoyés,
+succès de cache) sont cumulés en métriques. En fin de run, les spans sont
+ajoutés à un fichier de trace JSONL et les métriques cumulées réécrites au
+format texte de Prometheus. Un profilage cProfile/tracemalloc peut être
+activé par run.
+"""
+import os
+import json
+import time
+import cProfile
+import itertools
+import threading
+import tracemalloc
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from utils.config_loader import ConfigLoader
+
+# Attributs numériques des spans cumulés en compteurs Prometheus
+METRIC_ATTRIBUTES = ("input_tokens", "output_tokens", "cache_read_tokens", "cache_creation_tokens",
+                     "payload_bytes", "cache_hit", "attempts")
+
+METRIC_PREFIX = "ui_automation"
+
+
+class Span:
+    """
+    Intervalle de temps nommé, avec ses attributs et son span parent
+    """
+    __slots__ = ("name", "span_id", "parent_id", "trace_id", "start", "duration", "attributes", "error", "_t0")
+
+    def __init__(self, name: str, span_id: int, parent_id: Optional[int], trace_id: Optional[str],
+                 attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.trace_id = trace_id
+        self.start = time.time()
+        self.duration = None
+        self.attributes = attributes
+        self.error = None
+        self._t0 = time.perf_counter()
+
+    def set(self, **attributes) -> None:
+        """Ajoute ou remplace des attributs"""
+        self.attributes.update(attributes)
+
+    def add(self, name: str, value: float) -> None:
+        """Ajoute une valeur à un attribut numérique"""
+        self.attributes[name] = self.attributes.get(name, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NullSpan:
+    """Span sans effet, utilisé lorsque le traçage est désactivé"""
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def add(self, name: str, value: float) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Collecte les spans et cumule les métriques
+    """
+
+    def __init__(self):
+        self.trace_id = None
+        self._ids = itertools.count(1)
+        self._current = contextvars.ContextVar("current_span", default=None)
+        self._finished: List[Span] = []
+        self._lock = threading.Lock()
+        # Métriques cumulées depuis le démarrage : {(métrique, nom du span): valeur}
+        self.durations: Dict[str, List[float]] = {}
+        self.counters: Dict[tuple, float] = {}
+
+    def current(self) -> Optional[Span]:
+        return self._current.get()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        parent = self._current.get()
+        span = Span(name, next(self._ids), parent.span_id if parent else None,
+                    parent.trace_id if parent else self.trace_id, attributes)
+        token = self._current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {str(e)}"
+            raise
+        finally:
+            self._current.reset(token)
+            span.duration = time.perf_counter() - span._t0
+            self._finish(span)
+
+    def _finish(self, span: Span) -> None:
+        with self._lock:
+            self._finished.append(span)
+            total = self.durations.setdefault(span.name, [0.0, 0])
+            total[0] += span.duration
+            total[1] += 1
+            if span.error:
+                key = ("errors", span.name)
+                self.counters[key] = self.counters.get(key, 0) + 1
+            for attribute in METRIC_ATTRIBUTES:
+                value = span.attributes.get(attribute)
+                if isinstance(value, (bool, int, float)):
+                    key = (attribute, span.name)
+                    self.counters[key] = self.counters.get(key, 0) + float(value)
+
+    def drain(self) -> List[Span]:
+        """Retourne et oublie les spans terminés"""
+        with self._lock:
+            spans, self._finished = self._finished, []
+        return spans
+
+    def prometheus_text(self) -> str:
+        """Retourne les métriques cumulées au format texte de Prometheus"""
+        with self._lock:
+            durations = dict((name, list(total)) for name, total in self.durations.items())
+            counters = dict(self.counters)
+        lines = [
+            f"# HELP {METRIC_PREFIX}_span_duration_seconds Durée des étapes instrumentées",
+            f"# TYPE {METRIC_PREFIX}_span_duration_seconds summary",
+        ]
+        for name, (total, count) in sorted(durations.items()):
+            lines.append(f'{METRIC_PREFIX}_span_duration_seconds_sum{{span="{name}"}} {total:.6f}')
+            lines.append(f'{METRIC_PREFIX}_span_duration_seconds_count{{span="{name}"}} {count}')
+        for metric in ("errors",) + METRIC_ATTRIBUTES:
+            entries = sorted((name, value) for (key, name), value in counters.items() if key == metric)
+            if not entries:
+                continue
+            lines.append(f"# TYPE {METRIC_PREFIX}_{metric}_total counter")
+            for name, value in entries:
+                lines.append(f'{METRIC_PREFIX}_{metric}_total{{span="{name}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+
+_tracer = Tracer()
+_enabled = None
+
+
+def get_tracing_settings() -> Dict[str, Any]:
+    """Retourne la section `tracing` de la configuration"""
+    return ConfigLoader().get_section("tracing")
+
+
+def is_enabled() -> bool:
+    """Indique si le traçage est activé (section `tracing` de config.yaml)"""
+    global _enabled
+    if _enabled is None:
+        _enabled = bool(get_tracing_settings().get("enabled", False))
+    return _enabled
+
+
+def set_enabled(enabled: bool) -> None:
+    """Active ou désactive le traçage, indépendamment de la configuration"""
+    global _enabled
+    _enabled = enabled
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def span(name: str, **attributes):
+    """
+    Ouvre un span imbriqué dans le span courant
+
+    Usage :
+        with span("analysis", cache_hit=False) as s:
+            s.set(payload_bytes=1234)
+    """
+    if not is_enabled():
+        return _null_span()
+    return _tracer.span(name, **attributes)
+
+
+@contextmanager
+def _null_span():
+    yield NULL_SPAN
+
+
+def current_span():
+    """Retourne le span courant (un span sans effet si aucun n'est ouvert)"""
+    if not is_enabled():
+        return NULL_SPAN
+    return _tracer.current() or NULL_SPAN
+
+
+def get_traces_dir() -> str:
+    settings = get_tracing_settings()
+    directory = settings.get("directory") or os.path.join(ConfigLoader().get_data_dir(), "traces")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def export_run(run_id: str) -> Optional[Dict[str, str]]:
+    """
+    Ajoute les spans terminés au fichier de trace JSONL et réécrit les
+    métriques Prometheus
+
+    Returns:
+        dict: Chemins des fichiers écrits (trace, metrics), ou None si le traçage est désactivé
+    """
+    if not is_enabled():
+        return None
+    directory = get_traces_dir()
+    trace_path = os.path.join(directory, "trace.jsonl")
+    metrics_path = os.path.join(directory, "metrics.prom")
+
+    spans = _tracer.drain()
+    with open(trace_path, "a", encoding="utf-8") as f:
+        for finished in spans:
+            record = finished.to_dict()
+            record["trace_id"] = record["trace_id"] or run_id
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    # Écriture atomique : le fichier peut être lu par le collecteur textfile de node_exporter
+    tmp_path = f"{metrics_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(_tracer.prometheus_text())
+    os.replace(tmp_path, metrics_path)
+    return {"trace": trace_path, "metrics": metrics_path}
+
+
+@contextmanager
+def trace_run(run_id: str, profile: Optional[bool] = None, trace_memory: Optional[bool] = None, **attributes):
+    """
+    Trace un run complet : span racine, export en fin de run et profilage optionnel
+
+    Args:
+        run_id (str): Identifiant du run, utilisé comme identifiant de trace
+        profile (bool): Profiler le run avec cProfile (`<run_id>.prof`)
+        trace_memory (bool): Suivre les allocations avec tracemalloc (`<run_id>.memory.txt`)
+    """
+    settings = get_tracing_settings()
+    profile = settings.get("profile", False) if profile is None else profile
+    trace_memory = settings.get("tracemalloc", False) if trace_memory is None else trace_memory
+
+    _tracer.trace_id = run_id
+    profiler = cProfile.Profile() if profile else None
+    started_tracemalloc = trace_memory and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start(settings.get("tracemalloc_frames", 10))
+    if profiler:
+        profiler.enable()
+    try:
+        with span("run", run_id=run_id, **attributes) as root:
+            yield root
+    finally:
+        if profiler:
+            profiler.disable()
+        try:
+            if profiler or trace_memory:
+                directory = get_traces_dir()
+                if profiler:
+                    profile_path = os.path.join(directory, f"{run_id}.prof")
+                    profiler.dump_stats(profile_path)
+                    print(f"Profil cProfile : {profile_path}")
+                if trace_memory and tracemalloc.is_tracing():
+                    snapshot = tracemalloc.take_snapshot()
+                    current, peak = tracemalloc.get_traced_memory()
+                    memory_path = os.path.join(directory, f"{run_id}.memory.txt")
+                    with open(memory_path, "w", encoding="utf-8") as f:
+                        f.write(f"Mémoire courante : {current} octets, pic : {peak} octets\n\n")
+                        for stat in snapshot.statistics("lineno")[:settings.get("tracemalloc_top", 25)]:
+                            f.write(f"{stat}\n")
+                    print(f"Allocations tracemalloc : {memory_path}")
+            paths = export_run(run_id)
+            if paths:
+                print(f"Trace : {paths['trace']} ; métriques : {paths['metrics']}")
+        except Exception as e:
+            print(f"Erreur lors de l'export de la trace : {str(e)}")
+        finally:
+            if started_tracemalloc:
+                tracemalloc.stop()
+            _tracer.trace_id = None
@@ -0,0 +1,445 @@
+"""
+Module de représentation structurée des éléments d'interface
+
+L'analyse textuelle produite par le modèle est convertie en enregistrements
+typés (type, libellé, centre, taille, état), persistés dans un index JSON
+compact et indexés spatialement (grille) pour les recherches par position
+et par libellé.
+"""
+import os
+import re
+import json
+import math
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+from utils.config_loader import ConfigLoader
+from utils.image_preprocessing import POSITION_PATTERN
+
+SIZE_VALUE_PATTERN = re.compile(r"(\d+(?:[.,]\d+)?)\s*[x×]\s*(\d+(?:[.,]\d+)?)")
+KEY_VALUE_PATTERN = re.compile(r"^([^:]{1,40}?)\s*:\s*(.*)$")
+BRACKET_PATTERN = re.compile(r"^\[(.+)\]$")
+LIST_PREFIX_PATTERN = re.compile(r"^(?:[-*•]+|\d+[.)]|#+)\s*")
+QUOTED_PATTERN = re.compile(r"[\"«“]\s*([^\"»”]+?)\s*[\"»”]")
+
+# Clés reconnues dans les blocs d'analyse, après normalisation
+TYPE_KEYS = {"type", "type d'element", "element"}
+LABEL_KEYS = {"contenu", "libelle", "label", "texte", "nom"}
+DESCRIPTION_KEYS = {"description"}
+POSITION_KEYS = {"position", "coordonnees", "centre"}
+SIZE_KEYS = {"taille", "dimensions"}
+STATE_KEYS = {"etat", "state"}
+
+INDEX_VERSION = 1
+
+# Longueur des préfixes comparés par rank : "recherche" et "rechercher" se rejoignent
+STEM_LENGTH = 6
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalise un texte pour les comparaisons (minuscules, sans accents ni ponctuation)
+    """
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return " ".join(re.findall(r"[a-z0-9']+", text))
+
+
+def _stems(text: str) -> set:
+    """Préfixes des mots significatifs d'un texte (au moins 3 caractères)"""
+    return {token[:STEM_LENGTH] for token in normalize_text(text).split() if len(token) >= 3}
+
+
+def _to_number(value: str) -> float:
+    return float(value.replace(",", "."))
+
+
+class UIElement:
+    """
+    Élément d'interface analysé (coordonnées du centre en pixels écran)
+    """
+    __slots__ = ("element_type", "label", "x", "y", "width", "height", "state")
+
+    def __init__(self, element_type: str, label: str, x: int, y: int,
+                 width: int = 0, height: int = 0, state: str = ""):
+        self.element_type = element_type
+        self.label = label
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.state = state
+
+    @property
+    def center(self) -> Tuple[int, int]:
+        return (self.x, self.y)
+
+    @property
+    def bbox(self) -> Tuple[int, int, int, int]:
+        """Boîte englobante (left, top, right, bottom)"""
+        half_w, half_h = self.width // 2, self.height // 2
+        return (self.x - half_w, self.y - half_h, self.x + half_w, self.y + half_h)
+
+    def to_row(self) -> list:
+        return [self.element_type, self.label, self.x, self.y, self.width, self.height, self.state]
+
+    @classmethod
+    def from_row(cls, row: list) -> "UIElement":
+        return cls(*row)
+
+    def describe(self) -> str:
+        """Description compacte d'une ligne, destinée aux prompts"""
+        text = f"[{self.element_type}] {self.label} - x = {self.x}, y = {self.y}"
+        if self.width and self.height:
+            text += f" ({self.width}x{self.height})"
+        if self.state:
+            text += f" - état: {self.state}"
+        return text
+
+    def __repr__(self) -> str:
+        return f"UIElement({self.describe()!r})"
+
+
+def _flush_record(record: Dict[str, str], elements: List[UIElement]) -> None:
+    if "x" not in record:
+        return
+    header = record.get("header", "")
+    element_type = record.get("type") or header or "élément"
+    label = record.get("label") or record.get("description") or header or element_type
+    quoted = QUOTED_PATTERN.search(label)
+    if quoted:
+        label = quoted.group(1)
+    elements.append(UIElement(
+        element_type.strip(),
+        label.strip(),
+        record["x"],
+        record["y"],
+        record.get("width", 0),
+        record.get("height", 0),
+        record.get("state", "").strip(),
+    ))
+
+
+class AnalysisParser:
+    """
+    Analyseur incrémental d'une analyse textuelle, ligne par ligne
+
+    Permet d'extraire les éléments au fil d'une réponse reçue en flux : un
+    élément est émis dès que l'enregistrement suivant commence (ou à la
+    fermeture), c'est-à-dire dès que ses propriétés sont complètes.
+    """
+
+    def __init__(self):
+        self.elements: List[UIElement] = []
+        self._record: Dict[str, str] = {}
+
+    def _flush(self) -> List[UIElement]:
+        count = len(self.elements)
+        _flush_record(self._record, self.elements)
+        self._record = {}
+        return self.elements[count:]
+
+    def feed_line(self, raw_line: str) -> List[UIElement]:
+        """
+        Traite une ligne complète de l'analyse
+
+        Returns:
+            list: Les éléments terminés par cette ligne
+        """
+        line = LIST_PREFIX_PATTERN.sub("", raw_line.strip()).replace("**", "").strip()
+        if not line:
+            return []
+        record = self._record
+
+        bracket = BRACKET_PATTERN.match(line)
+        if bracket:
+            emitted = self._flush()
+            self._record = {"type": bracket.group(1)}
+            return emitted
+
+        emitted = []
+        position = POSITION_PATTERN.search(line)
+        key_value = KEY_VALUE_PATTERN.match(line)
+        key = normalize_text(key_value.group(1)) if key_value else ""
+
+        if position and (key in POSITION_KEYS or not key_value or key not in
+                         TYPE_KEYS | LABEL_KEYS | DESCRIPTION_KEYS | SIZE_KEYS | STATE_KEYS):
+            if "x" in record:
+                emitted = self._flush()
+                record = self._record
+            if key not in POSITION_KEYS:
+                # Position sur la ligne d'en-tête : "Bouton Recherche : x = 10, y = 20"
+                header = line[:position.start()].rstrip(" :-–(")
+                if key_value and key_value.start(2) <= position.start():
+                    header = key_value.group(1)
+                if header:
+                    record["header"] = header
+            record["x"] = round(_to_number(position.group(2)))
+            record["y"] = round(_to_number(position.group(4)))
+            return emitted
+
+        if key_value and key in TYPE_KEYS:
+            if "x" in record and "type" in record:
+                emitted = self._flush()
+                record = self._record
+            record["type"] = key_value.group(2)
+        elif key_value and key in LABEL_KEYS:
+            record["label"] = key_value.group(2)
+        elif key_value and key in DESCRIPTION_KEYS:
+            record["description"] = key_value.group(2)
+        elif key_value and key in SIZE_KEYS:
+            size = SIZE_VALUE_PATTERN.search(key_value.group(2))
+            if size:
+                record["width"] = round(_to_number(size.group(1)))
+                record["height"] = round(_to_number(size.group(2)))
+        elif key_value and key in STATE_KEYS:
+            record["state"] = key_value.group(2)
+        elif not key_value or not key_value.group(2):
+            # Ligne d'en-tête d'un nouvel élément ou d'un groupe
+            if "x" in record:
+                emitted = self._flush()
+            self._record["header"] = line.rstrip(":")
+        return emitted
+
+    def close(self) -> List[UIElement]:
+        """Termine l'analyse et retourne le dernier élément en cours, s'il est complet"""
+        return self._flush()
+
+
+def parse_analysis(analysis: str) -> List[UIElement]:
+    """
+    Convertit une analyse textuelle en liste d'éléments typés
+
+    Le format attendu est celui demandé au modèle (`[Type]`, `Position:`,
+    `Taille:`, `Description:`, `État:`), avec une tolérance pour les listes
+    à puces, les titres markdown et les positions sur la ligne d'en-tête.
+
+    Args:
+        analysis (str): L'analyse produite par le modèle
+
+    Returns:
+        list: Les éléments possédant une position
+    """
+    parser = AnalysisParser()
+    for raw_line in (analysis or "").splitlines():
+        parser.feed_line(raw_line)
+    parser.close()
+    return parser.elements
+
+
+class UIElementStore:
+    """
+    Ensemble d'éléments indexés par grille spatiale et par libellé
+    """
+
+    def __init__(self, elements: Iterable[UIElement] = (), cell_size: int = 64):
+        self.cell_size = cell_size
+        self.elements: List[UIElement] = []
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        self._labels: Dict[str, List[int]] = {}
+        for element in elements:
+            self.add(element)
+
+    def __len__(self) -> int:
+        return len(self.elements)
+
+    def __iter__(self):
+        return iter(self.elements)
+
+    def _cell(self, x: int, y: int) -> Tuple[int, int]:
+        return (x // self.cell_size, y // self.cell_size)
+
+    def add(self, element: UIElement) -> None:
+        """Ajoute un élément et met à jour les index"""
+        index = len(self.elements)
+        self.elements.append(element)
+        self._grid.setdefault(self._cell(element.x, element.y), []).append(index)
+        self._labels.setdefault(normalize_text(element.label), []).append(index)
+
+    def _rebuild(self) -> None:
+        elements, self.elements = self.elements, []
+        self._grid, self._labels = {}, {}
+        for element in elements:
+            self.add(element)
+
+    def nearest(self, x: int, y: int, max_distance: Optional[float] = None) -> Optional[UIElement]:
+        """
+        Retourne l'élément dont le centre est le plus proche du point (x, y)
+
+        Args:
+            x (int): Abscisse en pixels écran
+            y (int): Ordonnée en pixels écran
+            max_distance (float): Distance maximale acceptée, sans limite si None
+        """
+        if not self.elements:
+            return None
+        cx, cy = self._cell(x, y)
+        cells_x = [cell[0] for cell in self._grid]
+        cells_y = [cell[1] for cell in self._grid]
+        max_ring = max(abs(cx - min(cells_x)), abs(cx - max(cells_x)),
+                       abs(cy - min(cells_y)), abs(cy - max(cells_y)))
+        best, best_distance = None, math.inf
+        for ring in range(max_ring + 1):
+            # Tout élément hors des anneaux déjà parcourus est au moins à cette distance
+            if best_distance <= (ring - 1) * self.cell_size:
+                break
+            for gx in range(cx - ring, cx + ring + 1):
+                for gy in range(cy - ring, cy + ring + 1):
+                    if max(abs(gx - cx), abs(gy - cy)) != ring:
+                        continue
+                    for index in self._grid.get((gx, gy), ()):
+                        element = self.elements[index]
+                        distance = math.hypot(element.x - x, element.y - y)
+                        if distance < best_distance:
+                            best, best_distance = element, distance
+        if max_distance is not None and best_distance > max_distance:
+            return None
+        return best
+
+    def at(self, x: int, y: int) -> Optional[UIElement]:
+        """Retourne l'élément dont la boîte englobante contient le point (x, y)"""
+        candidate = self.nearest(x, y)
+        if candidate is None:
+            return None
+        left, top, right, bottom = candidate.bbox
+        return candidate if left <= x <= right and top <= y <= bottom else None
+
+    def find_by_label(self, label: str, element_type: Optional[str] = None) -> Optional[UIElement]:
+        """
+        Retrouve un élément par son libellé (exact, puis partiel)
+
+        Args:
+            label (str): Libellé recherché
+            element_type (str): Filtre optionnel sur le type d'élément
+        """
+        matches = self.search(label, element_type, limit=1)
+        return matches[0] if matches else None
+
+    def search(self, label: str, element_type: Optional[str] = None, limit: int = 5) -> List[UIElement]:
+        """
+        Retourne les éléments dont le libellé correspond le mieux à `label`
+        """
+        query = normalize_text(label)
+        type_filter = normalize_text(element_type) if element_type else None
+
+        def accepts(element):
+            return not type_filter or type_filter in normalize_text(element.element_type)
+
+        exact = [self.elements[i] for i in self._labels.get(query, ()) if accepts(self.elements[i])]
+        if exact:
+            return exact[:limit]
+        if not query:
+            return []
+
+        query_tokens = set(query.split())
+        scored = []
+        for element in self.elements:
+            if not accepts(element):
+                continue
+            text = normalize_text(f"{element.label} {element.element_type}")
+            tokens = set(text.split())
+            score = len(query_tokens & tokens) / len(query_tokens)
+            if query in text:
+                score += 1.0
+            if score > 0:
+                scored.append((score, element))
+        scored.sort(key=lambda item: -item[0])
+        return [element for _, element in scored[:limit]]
+
+    def rank(self, text: str, limit: int) -> List[UIElement]:
+        """
+        Retourne au plus `limit` éléments, classés par pertinence lexicale pour
+        un texte (consigne, tâche) : mots communs au libellé ou au type,
+        pondérés par leur rareté parmi les éléments. Les places restantes sont
+        complétées dans l'ordre de l'analyse.
+        """
+        if len(self.elements) <= limit:
+            return list(self.elements)
+        query = _stems(text)
+        documents = [_stems(f"{e.label} {e.element_type}") & query for e in self.elements]
+        frequency: Dict[str, int] = {}
+        for stems in documents:
+            for stem in stems:
+                frequency[stem] = frequency.get(stem, 0) + 1
+        count = len(self.elements)
+        scores = [sum(math.log(1 + count / frequency[stem]) for stem in stems) for stems in documents]
+        order = sorted(range(count), key=lambda index: (-scores[index], index))
+        return [self.elements[index] for index in order[:limit]]
+
+    def in_region(self, box: Tuple[int, int, int, int]) -> List[UIElement]:
+        """Retourne les éléments dont le centre est dans la boîte (left, top, right, bottom)"""
+        left, top, right, bottom = box
+        return [e for e in self.elements if left <= e.x <= right and top <= e.y <= bottom]
+
+    def remove_in_regions(self, boxes: Iterable[Tuple[int, int, int, int]]) -> int:
+        """
+        Supprime les éléments dont le centre est dans l'une des boîtes
+
+        Returns:
+            int: Nombre d'éléments supprimés
+        """
+        boxes = list(boxes)
+        kept = [e for e in self.elements
+                if not any(l <= e.x <= r and t <= e.y <= b for l, t, r, b in boxes)]
+        removed = len(self.elements) - len(kept)
+        if removed:
+            self.elements = kept
+            self._rebuild()
+        return removed
+
+    def to_prompt_text(self, elements: Optional[Iterable[UIElement]] = None) -> str:
+        """Description compacte des éléments, une ligne par élément"""
+        return "\n".join(e.describe() for e in (self.elements if elements is None else elements))
+
+    def save(self, path: str) -> None:
+        """Enregistre les éléments dans un index JSON compact"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "elements": [e.to_row() for e in self.elements]},
+                      f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "UIElementStore":
+        """Charge un index JSON d'éléments"""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(UIElement.from_row(row) for row in data.get("elements", []))
+
+
+_store_cache: Dict[str, Tuple[float, UIElementStore]] = {}
+
+
+def load_ui_elements(path: Optional[str] = None) -> UIElementStore:
+    """
+    Charge l'index des éléments de la dernière analyse (mis en cache tant
+    que le fichier n'a pas changé)
+
+    Args:
+        path (str): Chemin de l'index, celui de la configuration si non spécifié
+
+    Returns:
+        UIElementStore: Les éléments, vide si aucun index n'existe
+    """
+    if path is None:
+        path = ConfigLoader().get_ui_elements_path()
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return UIElementStore()
+    cached = _store_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    store = UIElementStore.load(path)
+    _store_cache[path] = (mtime, store)
+    return store
+
+
+def save_ui_elements(store: UIElementStore, path: Optional[str] = None) -> str:
+    """
+    Enregistre l'index des éléments et retourne son chemin
+    """
+    if path is None:
+        path = ConfigLoader().get_ui_elements_path()
+    store.save(path)
+    _store_cache[path] = (os.path.getmtime(path), store)
+    return path